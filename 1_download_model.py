@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
-"""下载 AutoGLM-Phone-9B 模型到本地"""
+"""下载 AutoGLM-Phone-9B 模型到本地
+
+只下载 vLLM 需要的文件：仓库同时提供 safetensors 和 .bin/.pth 等格式时只取 safetensors，
+跳过原始 checkpoint 和文档图片。文件并行下载，中断后重新运行会续传未完成的文件；
+下载进度（文件列表和字节数）边下载边写入 model_download_info.json。
+"""
 import os
 import json
-from huggingface_hub import snapshot_download
+import threading
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from huggingface_hub import HfApi, hf_hub_download
 from datetime import datetime
 
 def load_config():
@@ -15,35 +23,125 @@ def load_config():
 config = load_config()
 MODEL_ID = config['MODEL_ID']
 LOCAL_DIR = os.environ.get('LOCAL_DIR', 'model')
+DOWNLOAD_INFO = os.environ.get('DOWNLOAD_INFO', 'model_download_info.json')
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '8'))
+# 预设可覆盖文件选择（逗号分隔的通配符）：INCLUDE 强制下载，EXCLUDE 强制跳过
+DOWNLOAD_INCLUDE = [p for p in os.environ.get('DOWNLOAD_INCLUDE', '').split(',') if p]
+DOWNLOAD_EXCLUDE = [p for p in os.environ.get('DOWNLOAD_EXCLUDE', '').split(',') if p]
+
+WEIGHT_SUFFIXES = ('.safetensors', '.bin', '.pt', '.pth', '.ckpt', '.h5', '.msgpack', '.onnx', '.gguf', '.tflite')
+# vLLM 不读取的文件：原始（非 HF 格式）checkpoint、仓库元数据、说明文档中的图片/视频
+UNUSED_PATTERNS = ['original/*', 'consolidated*', '.gitattributes',
+                   '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.mp4']
+
+
+def weight_format(filename):
+    """The weight format a file belongs to (.bin.index.json counts as .bin), else None"""
+    name = filename[:-len('.index.json')] if filename.endswith('.index.json') else filename
+    for suffix in WEIGHT_SUFFIXES:
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+def matches(filename, patterns):
+    return any(fnmatch.fnmatch(filename, p) for p in patterns)
+
+
+def select_files(filenames):
+    """Split repo files into (download, skip) keeping one weight format, safetensors preferred"""
+    formats = {weight_format(f) for f in filenames} - {None}
+    keep_format = next((s for s in WEIGHT_SUFFIXES if s in formats), None)
+    download, skip = [], []
+    for filename in filenames:
+        fmt = weight_format(filename)
+        unused = matches(filename, UNUSED_PATTERNS) or (fmt is not None and fmt != keep_format)
+        if matches(filename, DOWNLOAD_INCLUDE) or not (unused or matches(filename, DOWNLOAD_EXCLUDE)):
+            download.append(filename)
+        else:
+            skip.append(filename)
+    return download, skip
+
+
+class DownloadInfo:
+    """model_download_info.json, rewritten (atomically) after every finished file"""
+
+    def __init__(self, path, revision, files, skipped):
+        self.path = path
+        self._lock = threading.Lock()
+        self.info = {
+            "status": "in_progress",
+            "model_id": MODEL_ID,
+            "revision": revision,
+            "local_dir": LOCAL_DIR,
+            "total_files": len(files),
+            "total_bytes": sum(files.values()),
+            "downloaded_files": 0,
+            "downloaded_bytes": 0,
+            "files": {},
+            "skipped_files": sorted(skipped),
+            "skipped_bytes": sum(skipped.values()),
+            "started": datetime.now().isoformat(),
+        }
+        self.write()
+
+    def file_done(self, filename, size):
+        with self._lock:
+            self.info["files"][filename] = size
+            self.info["downloaded_files"] += 1
+            self.info["downloaded_bytes"] += size
+            self.write()
+            return self.info["downloaded_files"]
+
+    def finish(self, status):
+        with self._lock:
+            self.info["status"] = status
+            self.info["model_size_gb"] = self.info["downloaded_bytes"] / 1024**3
+            self.info["download_time"] = datetime.now().isoformat()
+            self.write()
+
+    def write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.info, f, indent=2)
+        os.replace(tmp_path, self.path)
+
 
 def main():
     print(f"下载模型: {MODEL_ID}")
     print(f"目标目录: {LOCAL_DIR}")
-    
-    snapshot_download(
-        repo_id=MODEL_ID,
-        local_dir=LOCAL_DIR,
-        local_dir_use_symlinks=False
-    )
-    
-    # 计算大小
-    total_size = sum(
-        os.path.getsize(os.path.join(dp, f))
-        for dp, _, files in os.walk(LOCAL_DIR)
-        for f in files
-    )
-    
-    info = {
-        "status": "completed",
-        "model_id": MODEL_ID,
-        "model_size_gb": total_size / 1024**3,
-        "download_time": datetime.now().isoformat()
-    }
-    
-    with open("model_download_info.json", "w") as f:
-        json.dump(info, f, indent=2)
-    
-    print(f"\n✅ 下载完成: {info['model_size_gb']:.1f} GB")
+
+    repo = HfApi().model_info(MODEL_ID, files_metadata=True)
+    sizes = {s.rfilename: s.size or 0 for s in repo.siblings}
+    download, skip = select_files(list(sizes))
+    info = DownloadInfo(DOWNLOAD_INFO, repo.sha, {f: sizes[f] for f in download}, {f: sizes[f] for f in skip})
+    print(f"文件: {len(download)} 个（{info.info['total_bytes'] / 1024**3:.1f} GB），"
+          f"跳过 {len(skip)} 个（{info.info['skipped_bytes'] / 1024**3:.1f} GB）")
+    for filename in skip:
+        print(f"  跳过: {filename}")
+
+    def fetch(filename):
+        # 已完整下载的文件直接返回，未完成的文件续传
+        path = hf_hub_download(MODEL_ID, filename, revision=repo.sha, local_dir=LOCAL_DIR)
+        return filename, sizes[filename] or os.path.getsize(path)
+
+    # 大文件在前：尽早开始最长的下载
+    ordered = sorted(download, key=lambda f: -sizes[f])
+    executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+    try:
+        for future in as_completed([executor.submit(fetch, f) for f in ordered]):
+            filename, size = future.result()
+            done = info.file_done(filename, size)
+            print(f"  [{done}/{len(download)}] {filename} ({size / 1024**2:.1f} MB)")
+    except BaseException:
+        # 不再开始排队中的文件；已下载的部分保留，重新运行时续传
+        executor.shutdown(wait=False, cancel_futures=True)
+        info.finish("failed")
+        raise
+    executor.shutdown()
+    info.finish("completed")
+
+    print(f"\n✅ 下载完成: {info.info['model_size_gb']:.1f} GB")
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,19 @@
 #!/usr/bin/env python3
-"""上传未压缩模型到 S3（跳过打包，加速部署）"""
+"""上传未压缩模型到 S3（跳过打包，加速部署）
+
+本地为每个文件计算 sha256 并写入清单，清单随模型上传到 S3；再次上传时对比两份清单，
+只上传内容变化的文件。
+"""
 import os
 import json
+import hashlib
+import mmap
+import threading
+import time
 import boto3
 import warnings
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from concurrent.futures import ThreadPoolExecutor
 
 warnings.filterwarnings('ignore', category=DeprecationWarning)
@@ -20,49 +30,213 @@ REGION = config['AWS_REGION']
 MODEL_ID = config['MODEL_ID']
 LOCAL_MODEL_DIR = os.environ.get('LOCAL_MODEL_DIR', 'model')
 
-# 从 MODEL_ID 生成唯一的 S3 前缀
-model_name = MODEL_ID.split('/')[-1].lower().replace('_', '-')
-S3_PREFIX = f"models/{model_name}"
+def s3_prefix(model_id):
+    """Unique S3 prefix derived from the model id"""
+    model_name = model_id.split('/')[-1].lower().replace('_', '-')
+    return f"models/{model_name}"
+
+S3_PREFIX = s3_prefix(MODEL_ID)
+
+# 清单：本地保存在模型目录（兼作哈希缓存，大小和修改时间未变的文件不重新计算），上传到 S3 前缀下
+MANIFEST_NAME = '.upload_manifest.json'
+# 不上传的目录（huggingface_hub 下载时在 local_dir 中写入的元数据）
+SKIP_DIRS = {'.cache'}
+
+# 传输参数：并行上传的文件数 x 每个文件的分片并发数 = 到 S3 的连接数
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', '4'))
+UPLOAD_FILE_CONCURRENCY = int(os.environ.get('UPLOAD_FILE_CONCURRENCY', '8'))
+UPLOAD_CHUNK_MB = int(os.environ.get('UPLOAD_CHUNK_MB', '64'))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', str(min(8, os.cpu_count() or 1))))
+# 删除 S3 上本地已不存在的文件（例如分片重新切分后遗留的旧分片）
+UPLOAD_PRUNE = os.environ.get('UPLOAD_PRUNE', '0') == '1'
+
+HASH_CHUNK = 8 * 1024 * 1024
+
+
+def sha256_file(path):
+    """Hash a file through a read-only memory map (hashlib releases the GIL, so threads hash in parallel)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(view), HASH_CHUNK):
+                    digest.update(view[offset:offset + HASH_CHUNK])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def collect_files(model_dir):
+    """Relative path -> (size, mtime_ns) for every file to upload"""
+    files = {}
+    for root, dirs, filenames in os.walk(model_dir):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for f in filenames:
+            local_path = os.path.join(root, f)
+            rel_path = os.path.relpath(local_path, model_dir).replace(os.sep, '/')
+            if rel_path == MANIFEST_NAME:
+                continue
+            stat = os.stat(local_path)
+            files[rel_path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def build_manifest(model_dir, files):
+    """Hash files in parallel, reusing hashes from the previous local manifest when size and mtime match"""
+    manifest_path = os.path.join(model_dir, MANIFEST_NAME)
+    cached = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            cached = json.load(f).get('files', {})
 
-uploaded_count = 0
-total_files = 0
+    entries = {}
+    pending = []
+    for rel_path, (size, mtime_ns) in files.items():
+        entry = cached.get(rel_path)
+        if entry and entry.get('size') == size and entry.get('mtime_ns') == mtime_ns:
+            entries[rel_path] = entry
+        else:
+            pending.append(rel_path)
 
-def upload_file(args):
-    global uploaded_count
-    s3_client, bucket, local_path, s3_key = args
+    if pending:
+        pending_bytes = sum(files[p][0] for p in pending)
+        print(f"🔍 计算 {len(pending)} 个文件的 sha256（{pending_bytes / 1024**3:.1f} GB，{HASH_WORKERS} 线程）")
+        started = time.monotonic()
+
+        def hash_one(rel_path):
+            return rel_path, sha256_file(os.path.join(model_dir, rel_path))
+
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+            for rel_path, digest in executor.map(hash_one, pending):
+                size, mtime_ns = files[rel_path]
+                entries[rel_path] = {'size': size, 'mtime_ns': mtime_ns, 'sha256': digest}
+        elapsed = time.monotonic() - started
+        print(f"  完成: {elapsed:.1f}s（{pending_bytes / 1024**2 / max(elapsed, 1e-6):.0f} MB/s）")
+
+    manifest = {'version': 1, 'model_id': MODEL_ID, 'files': dict(sorted(entries.items()))}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_remote_manifest(s3_client, bucket, prefix=S3_PREFIX):
     try:
-        # 检查文件是否已存在且大小一致
-        local_size = os.path.getsize(local_path)
+        response = s3_client.get_object(Bucket=bucket, Key=f"{prefix}/{MANIFEST_NAME}")
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(response['Body'].read())
+
+
+def list_remote_sizes(s3_client, bucket, prefix=S3_PREFIX):
+    """Relative path -> size of the objects already under the prefix (one LIST instead of a HEAD per file)"""
+    sizes = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/"):
+        for obj in page.get('Contents', []):
+            sizes[obj['Key'][len(prefix) + 1:]] = obj['Size']
+    return sizes
+
+
+def plan_upload(manifest, remote_manifest, remote_sizes):
+    """Files whose content differs from (or is missing in) S3
+
+    Without a remote manifest (uploads made by earlier versions of this
+    script) an object of the same size counts as unchanged.
+    """
+    remote_files = (remote_manifest or {}).get('files', {})
+    changed = []
+    for rel_path, entry in manifest['files'].items():
+        if remote_sizes.get(rel_path) != entry['size']:
+            changed.append(rel_path)
+        elif remote_manifest is not None and remote_files.get(rel_path, {}).get('sha256') != entry['sha256']:
+            changed.append(rel_path)
+    stale = sorted(p for p in remote_sizes if p not in manifest['files'] and p != MANIFEST_NAME)
+    return changed, stale
+
+
+class Progress:
+    """Thread-safe byte counter fed by boto3 transfer callbacks, printed at most every few seconds"""
+
+    def __init__(self, total_bytes, total_files, interval=5.0):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.interval = interval
+        self.bytes = 0
+        self.files = 0
+        self.started = time.monotonic()
+        self._last_print = self.started
+        self._lock = threading.Lock()
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes += count
+            now = time.monotonic()
+            if now - self._last_print < self.interval:
+                return
+            self._last_print = now
+            line = self._line(now)
+        print(line)
+
+    def file_done(self):
+        with self._lock:
+            self.files += 1
+
+    def _line(self, now):
+        elapsed = max(now - self.started, 1e-6)
+        percent = self.bytes / self.total_bytes * 100 if self.total_bytes else 100.0
+        return (f"  {percent:5.1f}%  {self.bytes / 1024**3:.2f}/{self.total_bytes / 1024**3:.2f} GB  "
+                f"{self.bytes / 1024**2 / elapsed:.0f} MB/s  文件 {self.files}/{self.total_files}")
+
+    def summary(self):
+        with self._lock:
+            return self._line(time.monotonic())
+
+
+def upload_files(s3_client, bucket, changed, manifest):
+    transfer_config = TransferConfig(
+        multipart_threshold=UPLOAD_CHUNK_MB * 1024**2,
+        multipart_chunksize=UPLOAD_CHUNK_MB * 1024**2,
+        max_concurrency=UPLOAD_FILE_CONCURRENCY,
+        use_threads=True,
+    )
+    total_bytes = sum(manifest['files'][p]['size'] for p in changed)
+    progress = Progress(total_bytes, len(changed))
+
+    def upload_one(rel_path):
+        local_path = os.path.join(LOCAL_MODEL_DIR, rel_path)
         try:
-            response = s3_client.head_object(Bucket=bucket, Key=s3_key)
-            s3_size = response['ContentLength']
-            if s3_size == local_size:
-                uploaded_count += 1
-                if uploaded_count % 10 == 0:
-                    print(f"  已验证: {uploaded_count}/{total_files}")
-                return s3_key
-        except:
-            pass  # 文件不存在，需要上传
-        
-        s3_client.upload_file(local_path, bucket, s3_key)
-        uploaded_count += 1
-        if uploaded_count % 10 == 0:
-            print(f"  已上传: {uploaded_count}/{total_files}")
-        return s3_key
-    except Exception as e:
-        print(f"\n❌ 上传失败: {local_path}\n错误: {e}")
-        raise
+            s3_client.upload_file(local_path, bucket, f"{S3_PREFIX}/{rel_path}",
+                                  Config=transfer_config, Callback=progress.add_bytes)
+        except Exception as e:
+            print(f"\n❌ 上传失败: {local_path}\n错误: {e}")
+            raise
+        progress.file_done()
+
+    print(f"⏳ 上传 {len(changed)} 个文件（{total_bytes / 1024**3:.2f} GB）到 s3://{bucket}/{S3_PREFIX}/")
+    # 大文件在前：尽早开始最长的传输
+    ordered = sorted(changed, key=lambda p: -manifest['files'][p]['size'])
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        list(executor.map(upload_one, ordered))
+    print(progress.summary())
+
 
 def main():
     if not os.path.exists(LOCAL_MODEL_DIR) or not os.listdir(LOCAL_MODEL_DIR):
         print("❌ 请先运行: python 1_download_model.py")
         return
-    
+
     sts = boto3.client('sts', region_name=REGION)
     account_id = sts.get_caller_identity()['Account']
     bucket = f"sagemaker-{REGION}-{account_id}"
-    s3_client = boto3.client('s3', region_name=REGION)
-    
+    # 连接池需容纳所有文件的分片并发
+    s3_client = boto3.client('s3', region_name=REGION, config=Config(
+        max_pool_connections=UPLOAD_WORKERS * UPLOAD_FILE_CONCURRENCY + 4,
+        retries={'max_attempts': 10, 'mode': 'adaptive'},
+    ))
+
     # 创建 bucket（如果不存在）
     try:
         s3_client.head_bucket(Bucket=bucket)
@@ -81,31 +255,38 @@ def main():
         except Exception as e:
             print(f"❌ 创建 bucket 失败: {e}")
             raise
-    
-    # 收集所有文件
-    files = []
-    for root, _, filenames in os.walk(LOCAL_MODEL_DIR):
-        for f in filenames:
-            local_path = os.path.join(root, f)
-            rel_path = os.path.relpath(local_path, LOCAL_MODEL_DIR)
-            s3_key = f"{S3_PREFIX}/{rel_path}"
-            files.append((s3_client, bucket, local_path, s3_key))
-    
-    global total_files
-    total_files = len(files)
+
     print(f"📦 模型: {MODEL_ID}")
-    print(f"⏳ 上传 {total_files} 个文件到 s3://{bucket}/{S3_PREFIX}/")
-    
-    # 并行上传
+    manifest = build_manifest(LOCAL_MODEL_DIR, collect_files(LOCAL_MODEL_DIR))
+    remote_manifest = load_remote_manifest(s3_client, bucket)
+    changed, stale = plan_upload(manifest, remote_manifest, list_remote_sizes(s3_client, bucket))
+    unchanged = len(manifest['files']) - len(changed)
+    print(f"✓ {unchanged} 个文件未变化，{len(changed)} 个文件需要上传"
+          + ("" if remote_manifest else "（S3 上无清单，按文件大小判断）"))
+
     try:
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            list(executor.map(upload_file, files))
+        if changed:
+            upload_files(s3_client, bucket, changed, manifest)
     except Exception as e:
         print(f"\n❌ 上传中断")
         raise
-    
+
+    if stale:
+        if UPLOAD_PRUNE:
+            for rel_path in stale:
+                s3_client.delete_object(Bucket=bucket, Key=f"{S3_PREFIX}/{rel_path}")
+            print(f"🗑  已删除 S3 上本地不存在的 {len(stale)} 个文件")
+        else:
+            print(f"⚠️  S3 上有 {len(stale)} 个本地不存在的文件（SageMaker 会一并下载），设置 UPLOAD_PRUNE=1 删除:")
+            for rel_path in stale[:10]:
+                print(f"    {rel_path}")
+
+    # 所有文件上传成功后才更新 S3 上的清单
+    s3_client.put_object(Bucket=bucket, Key=f"{S3_PREFIX}/{MANIFEST_NAME}",
+                         Body=json.dumps(manifest, indent=2).encode(), ContentType='application/json')
+
     model_data_url = f"s3://{bucket}/{S3_PREFIX}/"
-    
+
     config = {
         "model_data_url": model_data_url,
         "compression": "None",
@@ -113,7 +294,7 @@ def main():
     }
     with open("config.json", "w") as f:
         json.dump(config, f, indent=2)
-    
+
     print(f"\n✅ 完成: {model_data_url}")
 
 if __name__ == "__main__":
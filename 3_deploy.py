@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 """Deploy AutoGLM-Phone-9B to SageMaker Endpoint"""
 
+import hashlib
 import json
 import os
+import time
 import boto3
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 def load_config():
@@ -28,6 +32,30 @@ MAX_MODEL_LEN = config['MAX_MODEL_LEN']
 DTYPE = config['DTYPE']
 MODEL_TYPE = config['MODEL_TYPE']
 
+# 预设中可选的容器参数，未配置时不传入（使用 code/model.py 默认值）
+OPTIONAL_ENV_KEYS = [
+    'IMAGE_MAX_EDGE', 'IMAGE_MAX_PIXELS', 'IMAGE_QUALITY', 'IMAGE_FORMAT',
+    'HISTORY_MAX_IMAGES', 'HISTORY_ASSISTANT_TOKENS',
+    'RESPONSE_CACHE_MB', 'RESPONSE_CACHE_TTL',
+    'ADMISSION_MAX_INFLIGHT', 'ADMISSION_MAX_QUEUE', 'ADMISSION_QUEUE_TIMEOUT',
+    'SLOW_LOG_MS', 'SLOW_LOG_SAMPLE',
+    'VLLM_REPLICAS', 'GPUS_PER_REPLICA', 'SESSION_AFFINITY_SLACK',
+    'MODELS', 'MODEL_GPU_MEMORY', 'MODEL_IDLE_TIMEOUT', 'MODEL_START_WAIT',
+    'UPSTREAM_TRANSPORT', 'WARMUP_BUDGET',
+    'VLLM_MAX_NUM_SEQS', 'VLLM_MAX_NUM_BATCHED_TOKENS', 'VLLM_GPU_MEMORY_UTILIZATION',
+    'VLLM_ENABLE_PREFIX_CACHING', 'VLLM_ENABLE_CHUNKED_PREFILL',
+]
+OPTIONAL_ENV = {k: str(config[k]) for k in OPTIONAL_ENV_KEYS if config.get(k)}
+
+ECR_REPOSITORY = 'autoglm-vllm-byoc'
+# 等待 Endpoint 状态变化：状态变化后每 POLL_MIN 秒查询一次，状态不变时逐步放宽到 POLL_MAX
+POLL_MIN = float(os.environ.get('DEPLOY_POLL_MIN', '5'))
+POLL_MAX = float(os.environ.get('DEPLOY_POLL_MAX', '60'))
+DEPLOY_TIMEOUT = float(os.environ.get('DEPLOY_TIMEOUT', '3600'))
+# 部署成功后删除被替换、且不再被任何 Endpoint 使用的旧 EndpointConfig 和 Model
+DEPLOY_GC = os.environ.get('DEPLOY_GC', '1') == '1'
+TRANSITIONAL_STATES = {'Creating', 'Updating', 'SystemUpdating', 'RollingBack'}
+
 def get_execution_role():
     iam = boto3.client("iam")
     account_id = boto3.client("sts").get_caller_identity()["Account"]
@@ -39,6 +67,121 @@ def get_execution_role():
             continue
     raise RuntimeError("未找到 SageMaker 执行角色")
 
+def resolve_image(account_id):
+    """Image URI pinned to the digest behind :latest, so a new push changes the model hash"""
+    repository = f"{account_id}.dkr.ecr.{REGION}.amazonaws.com/{ECR_REPOSITORY}"
+    try:
+        ecr = boto3.client('ecr', region_name=REGION)
+        images = ecr.describe_images(repositoryName=ECR_REPOSITORY, imageIds=[{'imageTag': 'latest'}])
+        return f"{repository}@{images['imageDetails'][0]['imageDigest']}"
+    except Exception as e:
+        print(f"⚠️  无法读取镜像 digest，使用 :latest 标签: {e}")
+        return f"{repository}:latest"
+
+
+def spec_hash(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:10]
+
+
+def resource_exists(describe, **name):
+    try:
+        describe(**name)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('ValidationException', 'ResourceNotFound'):
+            return False
+        raise
+
+
+def describe_endpoint(sm_client, endpoint_name):
+    """describe_endpoint result, or None when the endpoint does not exist"""
+    if not endpoint_name:
+        return None
+    try:
+        return sm_client.describe_endpoint(EndpointName=endpoint_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ValidationException':
+            return None
+        raise
+
+
+def wait_endpoint(sm_client, endpoint_name, phases):
+    """Poll until the endpoint leaves its transitional states
+
+    Polls every POLL_MIN seconds after a status change and backs off to
+    POLL_MAX while the status stays the same; each status's duration is
+    appended to ``phases``.
+    """
+    started = time.monotonic()
+    status, status_started, delay = None, started, POLL_MIN
+    while True:
+        response = sm_client.describe_endpoint(EndpointName=endpoint_name)
+        now = time.monotonic()
+        if response['EndpointStatus'] != status:
+            if status:
+                phases.append((status, now - status_started))
+                print(f"  {status}: {now - status_started:.0f}s")
+            status, status_started, delay = response['EndpointStatus'], now, POLL_MIN
+            print(f"  → {status}")
+        if status not in TRANSITIONAL_STATES:
+            return response
+        if now - started > DEPLOY_TIMEOUT:
+            raise TimeoutError(f"等待 {endpoint_name} 超过 {DEPLOY_TIMEOUT}s（状态 {status}）")
+        time.sleep(delay)
+        delay = min(delay * 1.5, POLL_MAX)
+
+
+def resources_in_use(sm_client):
+    """(endpoint config names, model names) referenced by any endpoint in the region"""
+    endpoints = [e['EndpointName'] for page in sm_client.get_paginator('list_endpoints').paginate()
+                 for e in page['Endpoints']]
+
+    def describe_config(name):
+        try:
+            return sm_client.describe_endpoint_config(EndpointConfigName=name)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ValidationException':
+                return None
+            raise
+
+    # 列出之后被并发删除的 Endpoint / EndpointConfig 直接跳过
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        configs = {d['EndpointConfigName'] for d in executor.map(
+            lambda name: describe_endpoint(sm_client, name), endpoints) if d}
+        models = {v['ModelName'] for d in executor.map(describe_config, configs) if d
+                  for v in d['ProductionVariants']}
+    return configs, models
+
+
+def collect_garbage(sm_client, old_config_name):
+    """Delete a superseded endpoint config and its models unless another endpoint still uses them"""
+    try:
+        old_models = [v['ModelName'] for v in
+                      sm_client.describe_endpoint_config(EndpointConfigName=old_config_name)['ProductionVariants']]
+    except ClientError:
+        old_models = []
+    configs_in_use, models_in_use = resources_in_use(sm_client)
+    deletions = []
+    if old_config_name not in configs_in_use:
+        deletions.append(('EndpointConfig', old_config_name,
+                          lambda: sm_client.delete_endpoint_config(EndpointConfigName=old_config_name)))
+    for model_name in old_models:
+        if model_name not in models_in_use:
+            deletions.append(('Model', model_name, lambda m=model_name: sm_client.delete_model(ModelName=m)))
+
+    def delete(item):
+        kind, name, fn = item
+        try:
+            fn()
+            return f"  🗑  {kind}: {name}"
+        except ClientError as e:
+            return f"  ✗ {kind}: {name}: {e}"
+
+    with ThreadPoolExecutor(max_workers=max(1, len(deletions))) as executor:
+        for line in executor.map(delete, deletions):
+            print(line)
+
+
 def main():
     # 从 deploy_vars.json 读取部署配置
     if not os.path.exists('deploy_vars.json'):
@@ -54,67 +197,95 @@ def main():
     with open(config_file) as f:
         s3_config = json.load(f)
     
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    model_name = f"autoglm-phone-9b-model-{timestamp}"
-    endpoint_config_name = f"autoglm-phone-9b-config-{timestamp}"
-    endpoint_name = f"autoglm-phone-9b-{timestamp}"
+    # 资源名前缀：并发部署多个预设时按预设区分，避免重名
+    name_base = os.environ.get('DEPLOY_NAME', 'autoglm-phone-9b')
     
     account_id = boto3.client("sts").get_caller_identity()["Account"]
-    image_uri = f"{account_id}.dkr.ecr.{REGION}.amazonaws.com/autoglm-vllm-byoc:latest"
+    image_uri = resolve_image(account_id)
     role_arn = get_execution_role()
     
-    print(f"Endpoint: {endpoint_name}")
     print(f"Model: {s3_config['model_data_url']}")
     print(f"Image: {image_uri}")
     print(f"Instance: {INSTANCE_TYPE}")
     
     sm_client = boto3.client('sagemaker', region_name=REGION)
+    phases = []
     
-    # 1. 创建模型
-    print("\n[1/3] 创建模型...")
-    sm_client.create_model(
-        ModelName=model_name,
-        PrimaryContainer={
-            'Image': image_uri,
-            'ModelDataSource': {
-                'S3DataSource': {
-                    'S3Uri': s3_config['model_data_url'],
-                    'S3DataType': 'S3Prefix',
-                    'CompressionType': 'None'
-                }
-            },
-            'Environment': {
-                'VLLM_WORKER_MULTIPROC_METHOD': 'spawn',
-                'SERVED_MODEL_NAME': SERVED_MODEL_NAME,
-                'MAX_MODEL_LEN': MAX_MODEL_LEN,
-                'DTYPE': DTYPE,
-                'MODEL_TYPE': MODEL_TYPE
+    # Model / EndpointConfig 以其内容的哈希命名：内容未变化时直接复用
+    container = {
+        'Image': image_uri,
+        'ModelDataSource': {
+            'S3DataSource': {
+                'S3Uri': s3_config['model_data_url'],
+                'S3DataType': 'S3Prefix',
+                'CompressionType': 'None'
             }
         },
-        ExecutionRoleArn=role_arn
-    )
-    print(f"✓ 模型创建完成: {model_name}")
-    
-    # 2. 创建 Endpoint 配置
-    print("\n[2/3] 创建 Endpoint 配置...")
-    sm_client.create_endpoint_config(
-        EndpointConfigName=endpoint_config_name,
-        ProductionVariants=[{
-            'VariantName': 'AllTraffic',
-            'ModelName': model_name,
-            'InitialInstanceCount': 1,
-            'InstanceType': INSTANCE_TYPE,
-            'ContainerStartupHealthCheckTimeoutInSeconds': 1800
-        }]
-    )
-    print(f"✓ Endpoint 配置创建完成: {endpoint_config_name}")
-    
-    # 3. 创建 Endpoint
-    print(f"\n[3/3] 部署 Endpoint（预计 15 分钟）...")
-    sm_client.create_endpoint(
-        EndpointName=endpoint_name,
-        EndpointConfigName=endpoint_config_name
-    )
+        'Environment': {
+            'VLLM_WORKER_MULTIPROC_METHOD': 'spawn',
+            'SERVED_MODEL_NAME': SERVED_MODEL_NAME,
+            'MAX_MODEL_LEN': MAX_MODEL_LEN,
+            'DTYPE': DTYPE,
+            'MODEL_TYPE': MODEL_TYPE,
+            **OPTIONAL_ENV
+        }
+    }
+    model_name = f"{name_base}-model-{spec_hash({'container': container, 'role': role_arn})}"
+    
+    # 1. 模型
+    print("\n[1/3] 模型...")
+    started = time.monotonic()
+    if resource_exists(sm_client.describe_model, ModelName=model_name):
+        print(f"✓ 配置未变化，复用模型: {model_name}")
+    else:
+        sm_client.create_model(ModelName=model_name, PrimaryContainer=container, ExecutionRoleArn=role_arn)
+        print(f"✓ 模型创建完成: {model_name}")
+    phases.append(('Model', time.monotonic() - started))
+    
+    # 2. Endpoint 配置
+    print("\n[2/3] Endpoint 配置...")
+    started = time.monotonic()
+    variants = [{
+        'VariantName': 'AllTraffic',
+        'ModelName': model_name,
+        'InitialInstanceCount': 1,
+        'InstanceType': INSTANCE_TYPE,
+        'ContainerStartupHealthCheckTimeoutInSeconds': 1800
+    }]
+    endpoint_config_name = f"{name_base}-config-{spec_hash(variants)}"
+    if resource_exists(sm_client.describe_endpoint_config, EndpointConfigName=endpoint_config_name):
+        print(f"✓ 配置未变化，复用 Endpoint 配置: {endpoint_config_name}")
+    else:
+        sm_client.create_endpoint_config(EndpointConfigName=endpoint_config_name, ProductionVariants=variants)
+        print(f"✓ Endpoint 配置创建完成: {endpoint_config_name}")
+    phases.append(('EndpointConfig', time.monotonic() - started))
+    
+    # 3. Endpoint：已有 Endpoint 时原地更新（名称不变，更新期间旧实例继续服务）
+    endpoint = describe_endpoint(sm_client, s3_config.get('endpoint_name'))
+    if endpoint and endpoint['EndpointStatus'] in TRANSITIONAL_STATES:
+        print(f"\n⏳ 等待进行中的操作完成: {endpoint['EndpointName']}（{endpoint['EndpointStatus']}）")
+        endpoint = wait_endpoint(sm_client, endpoint['EndpointName'], phases)
+    old_config_name = None
+    if endpoint and endpoint['EndpointStatus'] == 'InService':
+        endpoint_name = endpoint['EndpointName']
+        if endpoint['EndpointConfigName'] == endpoint_config_name:
+            print(f"\n[3/3] ✓ Endpoint 已是最新配置: {endpoint_name}")
+        else:
+            old_config_name = endpoint['EndpointConfigName']
+            print(f"\n[3/3] 原地更新 Endpoint: {endpoint_name}（{old_config_name} -> {endpoint_config_name}）")
+            sm_client.update_endpoint(EndpointName=endpoint_name, EndpointConfigName=endpoint_config_name)
+    else:
+        if endpoint and endpoint['EndpointStatus'] == 'Failed':
+            # 创建失败的 Endpoint 无法更新：删除后重新创建
+            print(f"\n⚠️  Endpoint {endpoint['EndpointName']} 状态为 Failed，删除后重新创建")
+            old_config_name = endpoint['EndpointConfigName']
+            sm_client.delete_endpoint(EndpointName=endpoint['EndpointName'])
+        endpoint_name = f"{name_base}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        print(f"\n[3/3] 部署 Endpoint: {endpoint_name}（预计 15 分钟）...")
+        sm_client.create_endpoint(
+            EndpointName=endpoint_name,
+            EndpointConfigName=endpoint_config_name
+        )
     
     # 保存 endpoint 信息（即使部署失败也保存）
     s3_config['endpoint_name'] = endpoint_name
@@ -123,30 +294,32 @@ def main():
     
     # 等待部署完成
     print("⏳ 等待部署...")
-    try:
-        waiter = sm_client.get_waiter('endpoint_in_service')
-        waiter.wait(
-            EndpointName=endpoint_name,
-            WaiterConfig={'Delay': 30, 'MaxAttempts': 60}
-        )
-        
-        print(f"\n\n===========================================")
-        print(f"✅ 部署成功: {endpoint_name}")
-        print(f"===========================================")
-    except Exception as e:
-        # 获取失败原因
-        response = sm_client.describe_endpoint(EndpointName=endpoint_name)
-        status = response['EndpointStatus']
-        failure_reason = response.get('FailureReason', 'Unknown')
-        
+    response = wait_endpoint(sm_client, endpoint_name, phases)
+    # 更新失败时 SageMaker 回滚到旧配置，状态仍为 InService
+    if response['EndpointStatus'] != 'InService' or response['EndpointConfigName'] != endpoint_config_name:
         print(f"\n\n===========================================")
         print(f"❌ 部署失败: {endpoint_name}")
-        print(f"状态: {status}")
-        print(f"原因: {failure_reason}")
+        print(f"状态: {response['EndpointStatus']}（当前配置 {response['EndpointConfigName']}）")
+        print(f"原因: {response.get('FailureReason', 'Unknown')}")
         print(f"===========================================")
         print(f"\n查看日志:")
         print(f"aws sagemaker describe-endpoint --endpoint-name {endpoint_name} --region {REGION}")
-        raise
+        raise RuntimeError(f"Endpoint {endpoint_name} 部署失败")
+    
+    print(f"\n\n===========================================")
+    print(f"✅ 部署成功: {endpoint_name}")
+    print(f"===========================================")
+    print("各阶段耗时: " + "，".join(f"{name} {seconds:.1f}s" for name, seconds in phases))
+    
+    s3_config['endpoint_config_name'] = endpoint_config_name
+    s3_config['model_name'] = model_name
+    with open(config_file, "w") as f:
+        json.dump(s3_config, f, indent=2)
+    
+    # 清理被替换的旧配置和模型（不再被任何 Endpoint 使用时）
+    if old_config_name and old_config_name != endpoint_config_name and DEPLOY_GC:
+        print(f"\n清理旧资源...")
+        collect_garbage(sm_client, old_config_name)
     
     print(f"\n测试命令:")
     print(f"python3 -c \"import boto3, json; client=boto3.client('sagemaker-runtime', region_name='{REGION}'); ")
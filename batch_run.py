@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""离线批量推理：流式读取 JSONL 聊天请求，并发调用 Endpoint（或本地容器），按输入顺序写出结果
+
+输入每行一个聊天请求（或 {"custom_id": ..., "body": {...}}）；输出每行一条
+{"index", "status_code", "response"} 或 {"index", "status_code", "error"}（与批量调用的结果格式相同）。
+429 / 5xx / 限流按指数退避重试；请求以 batch 优先级发送，让交互式请求优先。
+每条完成的结果先写入检查点文件（<output>.ckpt），中断后重新运行相同命令只发送未完成的请求。
+消息中的本地图片（"file://路径" 或相对路径）只读取、编码一次。
+用法:
+  python3 batch_run.py eval.jsonl results.jsonl --config configs/autoglm-phone-9b.json
+  python3 batch_run.py eval.jsonl results.jsonl --url http://127.0.0.1:8080 --concurrency 64
+"""
+import argparse
+import asyncio
+import base64
+import functools
+import json
+import mimetypes
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+class HttpTarget:
+    """POST /invocations on a local code/model.py (or the container on port 8080)"""
+
+    def __init__(self, url: str, args):
+        self.name = url
+        self.client = httpx.AsyncClient(
+            base_url=url,
+            timeout=httpx.Timeout(args.timeout, pool=None),
+            limits=httpx.Limits(max_connections=args.concurrency,
+                                max_keepalive_connections=args.concurrency),
+        )
+
+    async def invoke(self, body: bytes):
+        """(status_code or None on a transport error, content, retry_after seconds or None)"""
+        try:
+            resp = await self.client.post("/invocations", content=body,
+                                          headers={"content-type": "application/json", "x-priority": "batch"})
+        except httpx.HTTPError as e:
+            return None, f"{type(e).__name__}: {e}".encode(), None
+        retry_after = resp.headers.get("retry-after")
+        return resp.status_code, resp.content, float(retry_after) if retry_after else None
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class SageMakerTarget:
+    """invoke_endpoint run in a thread pool; botocore retries are off, the runner retries itself"""
+
+    def __init__(self, config: dict, args):
+        import boto3
+        from botocore.config import Config
+
+        self.name = config['endpoint_name']
+        self.client = boto3.client(
+            'sagemaker-runtime', region_name=config['region'],
+            config=Config(max_pool_connections=args.concurrency, read_timeout=args.timeout,
+                          retries={'max_attempts': 0}),
+        )
+        self.executor = ThreadPoolExecutor(max_workers=args.concurrency)
+
+    def _invoke(self, body: bytes):
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            response = self.client.invoke_endpoint(
+                EndpointName=self.name, ContentType='application/json',
+                CustomAttributes='priority=batch', Body=body)
+            return 200, response['Body'].read(), None
+        except ClientError as e:
+            error = e.response.get('Error', {})
+            # 容器返回的非 2xx 响应包装为 ModelError，原始状态码和响应体在 OriginalStatusCode / OriginalMessage 中
+            if 'OriginalStatusCode' in e.response:
+                return e.response['OriginalStatusCode'], e.response.get('OriginalMessage', '').encode(), None
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            if error.get('Code') in ('ThrottlingException', 'ModelNotReadyException'):
+                status = 429
+            return status, json.dumps(error, ensure_ascii=False).encode(), None
+        except BotoCoreError as e:
+            return None, f"{type(e).__name__}: {e}".encode(), None
+
+    async def invoke(self, body: bytes):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._invoke, body)
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+
+
+@functools.lru_cache(maxsize=256)
+def encode_image(path: str) -> str:
+    """A local image as a data: URL (cached: eval sets reuse the same screenshots)"""
+    mime = mimetypes.guess_type(path)[0] or 'image/jpeg'
+    with open(path, 'rb') as f:
+        return f"data:{mime};base64,{base64.b64encode(f.read()).decode()}"
+
+
+def inline_images(request: dict, base_dir: str):
+    """Replace local image references (file:// or relative paths) with data: URLs in place"""
+    for message in request.get('messages') or []:
+        content = message.get('content') if isinstance(message, dict) else None
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            image_url = part.get('image_url') if isinstance(part, dict) else None
+            url = image_url.get('url') if isinstance(image_url, dict) else None
+            if not isinstance(url, str) or url.startswith(('data:', 'http://', 'https://')):
+                continue
+            path = url[len('file://'):] if url.startswith('file://') else url
+            image_url['url'] = encode_image(os.path.normpath(os.path.join(base_dir, path)))
+
+
+def encode_item(line: str, base_dir: str, model_name: str):
+    """(custom_id, body bytes) for an input line; raises ValueError for an unusable line"""
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError("line must be a chat completion request object")
+    custom_id = data.get('custom_id')
+    if isinstance(data.get('body'), dict):
+        data = data['body']
+    if not isinstance(data.get('messages'), list):
+        raise ValueError("request has no messages")
+    # 批量推理不使用流式输出
+    data.pop('stream', None)
+    data.pop('stream_options', None)
+    if model_name:
+        data.setdefault('model', model_name)
+    try:
+        inline_images(data, base_dir)
+    except OSError as e:
+        raise ValueError(f"cannot read image: {e}")
+    return custom_id, json.dumps(data, ensure_ascii=False).encode()
+
+
+class OrderedWriter:
+    """Writes results to the output file in input order, journaling every result first
+
+    A result is appended to the checkpoint file as soon as it arrives, and to
+    the output once every earlier index has been written. On resume the
+    complete output lines are kept and journaled results past them are
+    reused, so no finished request is sent again.
+    """
+
+    def __init__(self, path: str, checkpoint_path: str):
+        self.checkpoint_path = checkpoint_path
+        self.next = 0
+        self.pending = {}
+        if os.path.exists(path):
+            with open(path, 'rb+') as f:
+                data = f.read()
+                complete = data.rfind(b'\n') + 1
+                # 中断时写了一半的最后一行丢弃（检查点中仍有该结果）
+                f.truncate(complete)
+                self.next = data.count(b'\n', 0, complete)
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record['index'] >= self.next:
+                        self.pending[record['index']] = line.rstrip('\n')
+        self.resumed = self.next + len(self.pending)
+        self.output = open(path, 'a', encoding='utf-8')
+        self.journal_lines = len(self.pending)
+        self._compact()
+        self.advanced = asyncio.Event()
+
+    def done(self, index: int) -> bool:
+        return index < self.next or index in self.pending
+
+    def add(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False)
+        self.journal.write(line + '\n')
+        self.journal.flush()
+        self.journal_lines += 1
+        self.pending[record['index']] = line
+        if self.next in self.pending:
+            while self.next in self.pending:
+                self.output.write(self.pending.pop(self.next) + '\n')
+                self.next += 1
+            self.output.flush()
+            self.advanced.set()
+            # 已写入输出的结果不必留在检查点中
+            if self.journal_lines > max(1000, 4 * len(self.pending)):
+                self._compact()
+
+    def _compact(self):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for line in self.pending.values():
+                f.write(line + '\n')
+        os.replace(tmp_path, self.checkpoint_path)
+        self.journal = open(self.checkpoint_path, 'a', encoding='utf-8')
+        self.journal_lines = len(self.pending)
+
+    def close(self, finished: bool):
+        self.output.close()
+        self.journal.close()
+        if finished and not self.pending:
+            os.remove(self.checkpoint_path)
+
+
+async def invoke_with_retries(target, body: bytes, retries: int, stats: Counter):
+    """(status_code, content, attempts); retries 429 / 5xx / transport errors with backoff"""
+    for attempt in range(retries + 1):
+        status, content, retry_after = await target.invoke(body)
+        if (status is not None and status not in RETRY_STATUS) or attempt == retries:
+            return status, content, attempt + 1
+        stats['retries'] += 1
+        # 服务端给出 Retry-After 时按其等待，否则指数退避加随机抖动
+        delay = retry_after or min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+        await asyncio.sleep(delay)
+
+
+def result_record(index: int, custom_id, status, content: bytes, attempts: int) -> dict:
+    record = {"index": index}
+    if custom_id is not None:
+        record["custom_id"] = custom_id
+    try:
+        payload = json.loads(content)
+    except ValueError:
+        payload = content.decode('utf-8', errors='replace')
+    if status == 200:
+        record.update(status_code=status, response=payload)
+    else:
+        record.update(status_code=status or 502,
+                      error=payload if status else {"message": f"upstream error: {payload}"})
+    record["attempts"] = attempts
+    return record
+
+
+def count_items(path: str) -> int:
+    with open(path, encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+
+async def run(args, target, writer: OrderedWriter, total: int) -> Counter:
+    stats = Counter()
+    slots = asyncio.Semaphore(args.concurrency)
+    window = args.window or args.concurrency * 4
+    tasks = set()
+    base_dir = os.path.dirname(os.path.abspath(args.input))
+    started = time.monotonic()
+
+    async def process(index: int, custom_id, body: bytes):
+        try:
+            status, content, attempts = await invoke_with_retries(target, body, args.retries, stats)
+            stats[status if status == 200 else 'errors'] += 1
+            writer.add(result_record(index, custom_id, status, content, attempts))
+        finally:
+            slots.release()
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.progress)
+            done = writer.next + len(writer.pending)
+            rate = (done - writer.resumed) / (time.monotonic() - started)
+            eta = f"，预计剩余 {(total - done) / rate / 60:.1f} 分钟" if rate > 0 else ""
+            print(f"  [{done}/{total}] {rate:.2f} 条/秒，失败 {stats['errors']}，重试 {stats['retries']}{eta}",
+                  flush=True)
+
+    reporter = asyncio.create_task(report())
+    try:
+        with open(args.input, encoding='utf-8') as f:
+            index = -1
+            for line in f:
+                if not line.strip():
+                    continue
+                index += 1
+                if writer.done(index):
+                    continue
+                try:
+                    custom_id, body = encode_item(line, base_dir, args.model)
+                except ValueError as e:
+                    stats['errors'] += 1
+                    writer.add({"index": index, "status_code": 400, "error": {"message": str(e)}, "attempts": 0})
+                    continue
+                await slots.acquire()
+                # 最早的未完成请求卡住时，已完成的结果最多缓存 window 条
+                while index - writer.next >= window:
+                    writer.advanced.clear()
+                    await writer.advanced.wait()
+                task = asyncio.create_task(process(index, custom_id, body))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        reporter.cancel()
+        for task in tasks:
+            task.cancel()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线批量推理（支持断点续跑）')
+    parser.add_argument('input', help='输入 JSONL：每行一个聊天请求或 {"custom_id", "body"}')
+    parser.add_argument('output', help='输出 JSONL（按输入顺序，每行一条结果）')
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument('--config', help='SageMaker Endpoint 配置文件（configs/<preset>.json）')
+    target_group.add_argument('--url', help='本地容器地址，例如 http://127.0.0.1:8080')
+    parser.add_argument('--concurrency', type=int, default=16, help='同时在途的请求数')
+    parser.add_argument('--window', type=int, default=0, help='乱序完成结果的缓存上限（默认 4 × 并发）')
+    parser.add_argument('--retries', type=int, default=5, help='429 / 5xx / 网络错误的最大重试次数')
+    parser.add_argument('--timeout', type=float, default=300, help='单次调用超时（秒）')
+    parser.add_argument('--model', help='请求未指定 model 时使用的模型名（默认取配置中的 served_model_name）')
+    parser.add_argument('--progress', type=float, default=10, help='进度输出间隔（秒）')
+    parser.add_argument('--restart', action='store_true', help='丢弃已有输出和检查点，从头开始')
+    args = parser.parse_args()
+
+    checkpoint_path = f"{args.output}.ckpt"
+    if args.restart:
+        for path in (args.output, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        if not config.get('endpoint_name'):
+            raise SystemExit(f"❌ {args.config} 中没有 endpoint_name")
+        args.model = args.model or config.get('served_model_name')
+        target = SageMakerTarget(config, args)
+    else:
+        target = HttpTarget(args.url, args)
+
+    total = count_items(args.input)
+    print(f"🎯 目标: {target.name}")
+    print(f"📄 输入: {args.input}（{total} 条）→ {args.output}")
+
+    async def execute():
+        writer = OrderedWriter(args.output, checkpoint_path)
+        if writer.resumed:
+            print(f"↩️  从检查点继续: 已完成 {writer.resumed} 条")
+        started = time.monotonic()
+        finished = False
+        try:
+            stats = await run(args, target, writer, total)
+            finished = True
+        finally:
+            writer.close(finished)
+            await target.close()
+        wall = time.monotonic() - started
+        sent = stats[200] + stats['errors']
+        print(f"\n✅ 完成: 本次 {sent} 条，用时 {wall:.1f}s（{sent / wall if wall else 0:.2f} 条/秒），"
+              f"成功 {stats[200]}，失败 {stats['errors']}，重试 {stats['retries']}")
+        return stats
+
+    try:
+        stats = asyncio.run(execute())
+    except KeyboardInterrupt:
+        print("\n⏸️  已中断，重新运行相同命令从检查点继续")
+        sys.exit(130)
+    sys.exit(1 if stats['errors'] else 0)
+
+
+if __name__ == "__main__":
+    main()
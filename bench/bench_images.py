@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+图片分辨率策略基准：在样例截图上测量缩放/重编码耗时与图像 token 估算
+使用方法: python3 bench/bench_images.py --image test/macos-desktop.jpg
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'code'))
+
+from image_policy import ImagePolicy  # noqa: E402
+
+VLLM_MAX_PIXELS = 5000000
+
+# (名称, 长边上限, 像素预算, 格式, 质量)
+POLICIES = [
+    ("off", 0, 0, "jpeg", 90),
+    ("edge-1920", 1920, 0, "jpeg", 90),
+    ("1080p-budget", 0, 1920 * 1080, "jpeg", 90),
+    ("edge-1280", 1280, 0, "jpeg", 85),
+    ("edge-1280-webp", 1280, 0, "webp", 80),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='图片分辨率策略基准')
+    parser.add_argument('--image', default=os.path.join(ROOT_DIR, 'test', 'macos-desktop.jpg'))
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        raw = f.read()
+    print(f"🖼️  图片: {args.image} ({len(raw) / 1024:.0f} KB)\n")
+    print(f"  {'策略':<16}{'耗时(ms)':>10}{'输出(KB)':>10}{'token前':>9}{'token后':>9}{'节省':>8}")
+    for name, max_edge, max_pixels, fmt, quality in POLICIES:
+        policy = ImagePolicy(max_edge, max_pixels, quality, fmt, VLLM_MAX_PIXELS)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            out, _, info = policy.apply(raw, "jpeg")
+        elapsed = (time.perf_counter() - start) / args.repeat * 1000
+        saved = 1 - info["tokens_after"] / info["tokens_before"]
+        print(f"  {name:<16}{elapsed:>10.1f}{len(out) / 1024:>10.0f}"
+              f"{info['tokens_before']:>9}{info['tokens_after']:>9}{saved:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
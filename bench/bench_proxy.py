@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+代理微基准
+  pool:    每请求新建 AsyncClient vs 共享连接池（req/s）
+  payload: 旧的 JSON 解析/重编码代理 vs 字节直通代理（每 MB 负载的代理开销）
+  transport: 代理到上游的回环 TCP vs Unix 域套接字（小文本与大图片请求的延迟、吞吐）
+使用方法:
+  python3 bench/bench_proxy.py pool --requests 2000 --concurrency 32
+  python3 bench/bench_proxy.py payload --sizes 1 4 8
+  python3 bench/bench_proxy.py transport --sizes 1 4 8
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'code'))
+
+import fake_vllm  # noqa: E402
+import model  # noqa: E402
+from replicas import Replica, ReplicaPool  # noqa: E402
+
+PAYLOAD = {
+    "model": "model",
+    "messages": [{"role": "user", "content": "打开微信"}],
+    "max_tokens": 16,
+}
+
+
+async def run_per_request(base_url, total, concurrency):
+    """旧实现：每个请求新建一个 AsyncClient"""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            async with httpx.AsyncClient(timeout=300) as client:
+                resp = await client.post(f"{base_url}/v1/chat/completions", json=PAYLOAD)
+                resp.json()
+
+    await asyncio.gather(*(one() for _ in range(total)))
+
+
+async def run_pooled(base_url, total, concurrency):
+    """新实现：共享 model.create_http_client() 连接池"""
+    sem = asyncio.Semaphore(concurrency)
+    client = model.create_http_client(base_url)
+
+    async def one():
+        async with sem:
+            resp = await client.post("/v1/chat/completions", json=PAYLOAD)
+            resp.json()
+
+    try:
+        await asyncio.gather(*(one() for _ in range(total)))
+    finally:
+        await client.aclose()
+
+
+def bench_pool(args):
+    server = fake_vllm.serve_in_thread(port=args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(f"上游桩服务: {base_url}  请求数: {args.requests}  并发: {args.concurrency}\n")
+    results = {}
+    try:
+        for name, runner in [("per-request", run_per_request), ("pooled", run_pooled)]:
+            start = time.perf_counter()
+            asyncio.run(runner(base_url, args.requests, args.concurrency))
+            elapsed = time.perf_counter() - start
+            results[name] = args.requests / elapsed
+            print(f"  {name:<12} {results[name]:>10.1f} req/s  ({elapsed:.2f}s)")
+        print(f"\n📊 连接池提速: {results['pooled'] / results['per-request']:.2f}x")
+    finally:
+        server.should_exit = True
+
+
+def legacy_app(client: httpx.AsyncClient) -> FastAPI:
+    """旧的 /invocations 实现：request.json() → json= → resp.json() → JSONResponse"""
+    app = FastAPI()
+
+    @app.post("/invocations")
+    async def invoke(request: Request):
+        data = await request.json()
+        resp = await client.post("/v1/chat/completions", json=data)
+        return JSONResponse(resp.json())
+
+    return app
+
+
+def multimodal_body(size_mb: float) -> bytes:
+    """构造约 size_mb 大小、内嵌 base64 图片的聊天请求"""
+    raw = os.urandom(int(size_mb * 1024 * 1024 * 3 / 4))
+    image = base64.b64encode(raw).decode()
+    return json.dumps({
+        "model": "model",
+        "messages": [{"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image}"}},
+            {"type": "text", "text": "打开微信"},
+        ]}],
+        "max_tokens": 16,
+    }).encode()
+
+
+async def time_requests(client, url, body, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        resp = await client.post(url, content=body, headers={"content-type": "application/json"})
+        resp.read()
+    return (time.perf_counter() - start) / repeat
+
+
+async def run_payload(args, base_url):
+    client = model.create_http_client(base_url)
+    model.replicas = ReplicaPool([Replica(0, base_url, client)])
+    apps = [("legacy", legacy_app(client)), ("passthrough", model.app)]
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=300) as direct:
+            for size_mb in args.sizes:
+                body = multimodal_body(size_mb)
+                await time_requests(direct, "/v1/chat/completions", body, 2)
+                baseline = await time_requests(direct, "/v1/chat/completions", body, args.repeat)
+                line = f"  {size_mb:>5.1f} MB  direct {baseline * 1000:8.2f} ms"
+                for name, app in apps:
+                    transport = httpx.ASGITransport(app=app)
+                    async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as proxy:
+                        await time_requests(proxy, "/invocations", body, 2)
+                        latency = await time_requests(proxy, "/invocations", body, args.repeat)
+                    overhead = (latency - baseline) * 1000 / size_mb
+                    line += f" | {name} +{overhead:7.2f} ms/MB"
+                print(line)
+    finally:
+        await client.aclose()
+
+
+def bench_payload(args):
+    # 桩服务在独立进程运行，避免与代理争用 GIL
+    upstream = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, 'fake_vllm.py'), '--port', str(args.port)])
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        for _ in range(100):
+            try:
+                if httpx.get(f"{base_url}/health").status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        print(f"上游桩服务: {base_url}  每档重复: {args.repeat}\n")
+        asyncio.run(run_payload(args, base_url))
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+
+def spawn_upstream(*listen) -> subprocess.Popen:
+    """在独立进程启动桩服务（避免与客户端争用 GIL）"""
+    return subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_vllm.py'), *listen])
+
+
+def wait_healthy(client: httpx.Client):
+    for _ in range(100):
+        try:
+            if client.get("/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("上游桩服务未就绪")
+
+
+async def sample_latency(client, body, repeat):
+    """顺序请求的单次延迟（秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resp = await client.post("/v1/chat/completions", content=body, headers=model.JSON_HEADERS)
+        resp.read()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def throughput(client, body, total, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            resp = await client.post("/v1/chat/completions", content=body, headers=model.JSON_HEADERS)
+            resp.read()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def run_transport(args, transports):
+    payloads = [("text", json.dumps(PAYLOAD).encode())]
+    payloads += [(f"image {size_mb:g}MB", multimodal_body(size_mb)) for size_mb in args.sizes]
+    clients = {name: model.create_http_client(base_url, uds) for name, base_url, uds in transports}
+    try:
+        print(f"  {'payload':<12} {'transport':<9} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+        for label, body in payloads:
+            # 大负载的吞吐测试减少请求数
+            total = args.requests if label == "text" else max(args.concurrency, args.requests // 20)
+            p50 = {}
+            for name, client in clients.items():
+                await sample_latency(client, body, 3)
+                samples = sorted(await sample_latency(client, body, args.repeat))
+                rate = await throughput(client, body, total, args.concurrency)
+                p50[name] = statistics.median(samples)
+                p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+                print(f"  {label:<12} {name:<9} {p50[name] * 1000:>9.3f} {p99 * 1000:>9.3f} {rate:>9.1f}")
+            saved = p50["tcp"] - p50["uds"]
+            print(f"  {'':<12} uds 节省 {saved * 1000:.3f} ms（p50，{saved / p50['tcp'] * 100:.1f}%）")
+    finally:
+        for client in clients.values():
+            await client.aclose()
+
+
+def bench_transport(args):
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="bench-uds-"), "vllm.sock")
+    base_url = f"http://127.0.0.1:{args.port}"
+    upstreams = [spawn_upstream('--port', str(args.port)), spawn_upstream('--uds', socket_path)]
+    try:
+        with httpx.Client(base_url=base_url) as tcp, \
+                httpx.Client(base_url="http://127.0.0.1", transport=httpx.HTTPTransport(uds=socket_path)) as uds:
+            wait_healthy(tcp)
+            wait_healthy(uds)
+        print(f"上游桩服务: {base_url} | unix://{socket_path}  顺序重复: {args.repeat}  并发: {args.concurrency}\n")
+        asyncio.run(run_transport(args, [("tcp", base_url, None), ("uds", base_url, socket_path)]))
+    finally:
+        for upstream in upstreams:
+            upstream.terminate()
+            upstream.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='代理微基准')
+    sub = parser.add_subparsers(dest='suite', required=True)
+
+    pool = sub.add_parser('pool', help='连接池 vs 每请求新建客户端')
+    pool.add_argument('--requests', type=int, default=2000)
+    pool.add_argument('--concurrency', type=int, default=32)
+    pool.add_argument('--port', type=int, default=18000)
+
+    payload = sub.add_parser('payload', help='每 MB 负载的代理开销')
+    payload.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 8])
+    payload.add_argument('--repeat', type=int, default=20)
+    payload.add_argument('--port', type=int, default=18000)
+
+    transport = sub.add_parser('transport', help='回环 TCP vs Unix 域套接字的上游开销')
+    transport.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 8], help='图片请求大小（MB）')
+    transport.add_argument('--repeat', type=int, default=200, help='每档顺序请求次数')
+    transport.add_argument('--requests', type=int, default=2000, help='吞吐测试的请求数（图片请求为其 1/20）')
+    transport.add_argument('--concurrency', type=int, default=16)
+    transport.add_argument('--port', type=int, default=18000)
+
+    args = parser.parse_args()
+    {'pool': bench_pool, 'payload': bench_payload, 'transport': bench_transport}[args.suite](args)
+
+
+if __name__ == "__main__":
+    main()
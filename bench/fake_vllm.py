@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""模拟 vLLM OpenAI 接口的本地桩服务（用于 CPU 环境下压测代理）"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import uvicorn
+
+# 模拟 vLLM 启动日志（供 code/supervisor.py 识别启动阶段）
+STARTUP_LINES = [
+    "INFO Starting to load model /opt/ml/model...",
+    "INFO Loading weights took 0.00 seconds",
+    "INFO Model loading took 17.8 GiB and 0.00 seconds",
+    "INFO Capturing CUDA graphs (mixed prefill-decode, PIECEWISE)",
+    "INFO Graph capturing finished in 0 secs",
+    "INFO Starting vLLM API server on http://127.0.0.1:8000",
+]
+
+STREAM_TOKENS = ["do", "(action=", "\"Launch\"", ", app=", "\"微信\"", ")"]
+
+
+def _chunk(model: str, delta: dict, finish_reason=None) -> bytes:
+    payload = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+
+
+def _tokens(count: int):
+    for i in range(count):
+        yield STREAM_TOKENS[i % len(STREAM_TOKENS)]
+
+
+def create_app(ttft: float = 0.0, tokens_per_sec: float = 0.0, output_tokens: int = len(STREAM_TOKENS),
+               failure_rate: float = 0.0, failure_status: int = 500, max_num_seqs: int = 0) -> FastAPI:
+    """桩服务：ttft 为首 token 延迟（秒），tokens_per_sec 为解码速度（0 表示不限速），
+    failure_rate 为返回 failure_status 错误的请求比例，max_num_seqs 为同时生成的请求上限（0 表示不限，
+    超出的请求排队，模拟 vLLM 调度器的 --max-num-seqs）"""
+    app = FastAPI(title="Fake vLLM Server")
+    token_interval = 1 / tokens_per_sec if tokens_per_sec > 0 else 0
+    counters = {"running": 0, "waiting": 0, "finished": 0}
+    slots = asyncio.Semaphore(max_num_seqs) if max_num_seqs > 0 else None
+
+    @app.get("/health")
+    async def health():
+        return Response(status_code=200)
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(content=(
+            "# HELP vllm:num_requests_running Number of requests currently running.\n"
+            "# TYPE vllm:num_requests_running gauge\n"
+            f'vllm:num_requests_running{{model_name="model"}} {counters["running"]}\n'
+            "# HELP vllm:num_requests_waiting Number of requests waiting to be processed.\n"
+            "# TYPE vllm:num_requests_waiting gauge\n"
+            f'vllm:num_requests_waiting{{model_name="model"}} {counters["waiting"]}\n'
+            "# HELP vllm:request_success_total Count of successfully processed requests.\n"
+            "# TYPE vllm:request_success_total counter\n"
+            f'vllm:request_success_total{{model_name="model"}} {counters["finished"]}\n'
+        ), media_type="text/plain")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.body()
+        data = json.loads(body)
+        model = data.get("model", "model")
+        if failure_rate and random.random() < failure_rate:
+            return JSONResponse({"error": {"message": "injected failure", "type": "fake_error"}},
+                                status_code=failure_status)
+        count = min(output_tokens, data.get("max_tokens") or output_tokens)
+        # 粗略估算：请求体约 4 字节 / token
+        usage = {"prompt_tokens": len(body) // 4, "completion_tokens": count,
+                 "total_tokens": len(body) // 4 + count}
+        if slots is not None:
+            counters["waiting"] += 1
+            try:
+                await slots.acquire()
+            finally:
+                counters["waiting"] -= 1
+        counters["running"] += 1
+
+        def finish():
+            counters["running"] -= 1
+            counters["finished"] += 1
+            if slots is not None:
+                slots.release()
+
+        try:
+            if ttft:
+                await asyncio.sleep(ttft)
+            if not data.get("stream") and token_interval:
+                await asyncio.sleep(token_interval * count)
+        except BaseException:
+            finish()
+            raise
+        if data.get("stream"):
+            include_usage = (data.get("stream_options") or {}).get("include_usage")
+
+            async def events():
+                # 生成结束才释放调度名额
+                try:
+                    yield _chunk(model, {"role": "assistant"})
+                    for token in _tokens(count):
+                        if token_interval:
+                            await asyncio.sleep(token_interval)
+                        yield _chunk(model, {"content": token})
+                    yield _chunk(model, {}, finish_reason="stop")
+                    if include_usage:
+                        yield f"data: {json.dumps({'id': 'chatcmpl-fake', 'choices': [], 'usage': usage})}\n\n".encode()
+                    yield b"data: [DONE]\n\n"
+                finally:
+                    finish()
+            return StreamingResponse(events(), media_type="text/event-stream")
+        finish()
+        return JSONResponse({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(_tokens(count))},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    return app
+
+
+def serve_in_thread(host: str = "127.0.0.1", port: int = 8000, uds: str = None, **options) -> uvicorn.Server:
+    """在后台线程启动桩服务，返回 uvicorn.Server 以便调用方设置 should_exit 停止"""
+    server = uvicorn.Server(uvicorn.Config(create_app(**options), host=host, port=port, uds=uds, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='模拟 vLLM 服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--uds', default=None, help='监听 Unix 域套接字（与 vLLM --uds 相同）')
+    parser.add_argument('--startup-seconds', type=float, default=0,
+                        help='模拟启动耗时：期间逐行打印 vLLM 风格的启动日志')
+    parser.add_argument('--crash-after', type=float, default=None,
+                        help='启动若干秒后以退出码 1 崩溃（模拟启动失败）')
+    parser.add_argument('--ttft', type=float, default=0, help='首 token 延迟（秒）')
+    parser.add_argument('--tokens-per-sec', type=float, default=0, help='解码速度（token/s），0 表示不限速')
+    parser.add_argument('--output-tokens', type=int, default=len(STREAM_TOKENS), help='每个请求生成的 token 数')
+    parser.add_argument('--failure-rate', type=float, default=0, help='注入错误的请求比例（0-1）')
+    parser.add_argument('--failure-status', type=int, default=500, help='注入错误的 HTTP 状态码')
+    parser.add_argument('--max-num-seqs', type=int, default=0, help='同时生成的请求上限（与 vLLM 同名参数对应）')
+    args = parser.parse_args()
+
+    for line in STARTUP_LINES:
+        if args.crash_after is not None and args.crash_after <= 0:
+            print("ERROR CUDA out of memory", flush=True)
+            sys.exit(1)
+        print(line, flush=True)
+        step = args.startup_seconds / len(STARTUP_LINES)
+        time.sleep(step)
+        if args.crash_after is not None:
+            args.crash_after -= step
+    app = create_app(args.ttft, args.tokens_per_sec, args.output_tokens, args.failure_rate, args.failure_status,
+                     args.max_num_seqs)
+    uvicorn.run(app, host=args.host, port=args.port, uds=args.uds, log_level="warning")
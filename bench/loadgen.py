@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+推理容器压测工具（asyncio 负载生成器）
+  闭环 closed: 固定并发，每个并发槽收到响应后立即发送下一个请求
+  开环 open:   固定到达率（均匀或泊松），延迟从计划发送时刻算起，服务变慢时不会少发请求
+目标:
+  --url http://127.0.0.1:8080      已在本机运行的 code/model.py（默认）
+  --config configs/<preset>.json   SageMaker Endpoint
+  --spawn                          在本机启动 code/model.py，由其拉起 bench/fake_vllm.py 代替 vLLM（CPU 环境回归压测）
+使用方法:
+  python3 bench/loadgen.py --spawn --mode closed --concurrency 32 --duration 30
+  python3 bench/loadgen.py --spawn --fake-ttft 0.2 --fake-tokens-per-sec 50 --stream --mode open --rate 20
+  python3 bench/loadgen.py --config configs/autoglm-phone-9b.json --payload image --stream --rate 2 --duration 60
+  python3 bench/loadgen.py --replay captured.jsonl --concurrency 8 --requests 500 --output result.json
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+TEXT_PROMPTS = ["打开微信", "打开设置并连接 Wi-Fi", "在淘宝搜索蓝牙耳机", "给张三发消息说我晚点到"]
+
+# 子进程中运行 code/model.py：用桩服务替换 vLLM 启动命令，其余（监控、代理、准入等）保持不变；
+# 桩服务支持的 vLLM 参数（--max-num-seqs）从真实启动命令中透传
+PROXY_LAUNCHER = """
+import os, sys
+code_dir, fake_vllm, port, *fake_args = sys.argv[1:]
+sys.path.insert(0, code_dir)
+import uvicorn
+import model
+build_vllm_command = model.build_vllm_command
+def fake_vllm_command(port=8000, gpus=None, uds=None, **kwargs):
+    cmd, env = build_vllm_command(port, gpus, uds=uds, **kwargs)
+    passthrough = [arg for flag in ['--max-num-seqs'] if flag in cmd for arg in cmd[cmd.index(flag):cmd.index(flag) + 2]]
+    listen = ['--uds', uds] if uds else ['--port', str(port)]
+    return [sys.executable, fake_vllm, *listen, *passthrough, *fake_args], env
+model.build_vllm_command = fake_vllm_command
+uvicorn.run(model.app, host='127.0.0.1', port=int(port), log_level='warning')
+"""
+
+
+class Sample:
+    """One request: latency/ttft in seconds from the (scheduled) start, error is None on success"""
+
+    __slots__ = ("latency", "ttft", "tokens", "error")
+
+    def __init__(self, latency, ttft=None, tokens=0, error=None):
+        self.latency = latency
+        self.ttft = ttft
+        self.tokens = tokens
+        self.error = error
+
+
+class StreamStats:
+    """Incremental SSE parser: time to first content delta, delta count and final usage"""
+
+    def __init__(self, start: float):
+        self.start = start
+        self.buffer = b""
+        self.ttft = None
+        self.deltas = 0
+        self.usage = None
+
+    def feed(self, data: bytes):
+        self.buffer += data
+        while b"\n\n" in self.buffer:
+            event, self.buffer = self.buffer.split(b"\n\n", 1)
+            if not event.startswith(b"data: {"):
+                continue
+            payload = json.loads(event[len(b"data: "):])
+            if payload.get("usage"):
+                self.usage = payload["usage"]
+            for choice in payload.get("choices") or []:
+                if (choice.get("delta") or {}).get("content"):
+                    if self.ttft is None:
+                        self.ttft = time.perf_counter() - self.start
+                    self.deltas += 1
+
+    def sample(self) -> Sample:
+        tokens = (self.usage or {}).get("completion_tokens") or self.deltas
+        return Sample(time.perf_counter() - self.start, self.ttft, tokens)
+
+
+def completion_tokens(body: bytes) -> int:
+    try:
+        return (json.loads(body).get("usage") or {}).get("completion_tokens") or 0
+    except (ValueError, AttributeError):
+        return 0
+
+
+class HttpTarget:
+    """POST /invocations on a local code/model.py"""
+
+    def __init__(self, url: str, args):
+        self.name = url
+        self.client = httpx.AsyncClient(
+            base_url=url,
+            timeout=httpx.Timeout(args.timeout, pool=None),
+            limits=httpx.Limits(max_connections=args.max_connections,
+                                max_keepalive_connections=args.max_connections),
+        )
+
+    async def invoke(self, body: bytes, stream: bool, start: float) -> Sample:
+        headers = {"content-type": "application/json"}
+        try:
+            if not stream:
+                resp = await self.client.post("/invocations", content=body, headers=headers)
+                if resp.status_code != 200:
+                    return Sample(time.perf_counter() - start, error=f"http_{resp.status_code}")
+                return Sample(time.perf_counter() - start, tokens=completion_tokens(resp.content))
+            async with self.client.stream("POST", "/invocations", content=body, headers=headers) as resp:
+                if resp.status_code != 200:
+                    await resp.aread()
+                    return Sample(time.perf_counter() - start, error=f"http_{resp.status_code}")
+                stats = StreamStats(start)
+                async for data in resp.aiter_bytes():
+                    stats.feed(data)
+                return stats.sample()
+        except httpx.TimeoutException:
+            return Sample(time.perf_counter() - start, error="timeout")
+        except httpx.HTTPError as e:
+            return Sample(time.perf_counter() - start, error=type(e).__name__)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class SageMakerTarget:
+    """invoke_endpoint / invoke_endpoint_with_response_stream, run in a thread pool"""
+
+    def __init__(self, config: dict, args):
+        import boto3
+        from botocore.config import Config
+
+        self.name = config['endpoint_name']
+        self.endpoint = config['endpoint_name']
+        self.client = boto3.client(
+            'sagemaker-runtime', region_name=config['region'],
+            config=Config(max_pool_connections=args.max_connections, read_timeout=args.timeout,
+                          retries={'max_attempts': 0}),
+        )
+        self.executor = ThreadPoolExecutor(max_workers=args.max_connections)
+
+    def _invoke(self, body: bytes, stream: bool, start: float) -> Sample:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            if not stream:
+                response = self.client.invoke_endpoint(
+                    EndpointName=self.endpoint, ContentType='application/json', Body=body)
+                content = response['Body'].read()
+                return Sample(time.perf_counter() - start, tokens=completion_tokens(content))
+            response = self.client.invoke_endpoint_with_response_stream(
+                EndpointName=self.endpoint, ContentType='application/json', Body=body)
+            stats = StreamStats(start)
+            for event in response['Body']:
+                stats.feed(event.get('PayloadPart', {}).get('Bytes', b''))
+            return stats.sample()
+        except ClientError as e:
+            return Sample(time.perf_counter() - start, error=e.response.get('Error', {}).get('Code', 'ClientError'))
+        except BotoCoreError as e:
+            return Sample(time.perf_counter() - start, error=type(e).__name__)
+
+    async def invoke(self, body: bytes, stream: bool, start: float) -> Sample:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._invoke, body, stream, start)
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def load_replay(path: str) -> list:
+    """Chat requests from a JSONL file: one request object (or {"body": {...}}) per line"""
+    requests = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if isinstance(data.get("body"), dict):
+                data = data["body"]
+            if isinstance(data.get("messages"), list):
+                requests.append(data)
+    if not requests:
+        raise SystemExit(f"❌ {path} 中没有可回放的请求（每行应为含 messages 的聊天请求）")
+    return requests
+
+
+def synthesize(kind: str, image_path: str, max_tokens: int) -> list:
+    """Text, image (test/macos-desktop.jpg) or mixed chat requests"""
+    image_url = None
+    if kind in ("image", "mixed"):
+        with open(image_path, 'rb') as f:
+            image_url = "data:image/jpeg;base64," + base64.b64encode(f.read()).decode()
+    requests = []
+    for i, prompt in enumerate(TEXT_PROMPTS):
+        content = prompt
+        if kind == "image" or (kind == "mixed" and i % 2 == 0):
+            content = [{"type": "image_url", "image_url": {"url": image_url}},
+                       {"type": "text", "text": prompt}]
+        requests.append({"messages": [{"role": "user", "content": content}], "max_tokens": max_tokens})
+    return requests
+
+
+def encode_bodies(requests: list, model_name: str, stream: bool) -> list:
+    bodies = []
+    for data in requests:
+        data = dict(data)
+        if model_name:
+            data.setdefault("model", model_name)
+        if stream:
+            data["stream"] = True
+            data["stream_options"] = {"include_usage": True}
+        else:
+            data.pop("stream", None)
+            data.pop("stream_options", None)
+        bodies.append(json.dumps(data, ensure_ascii=False).encode())
+    return bodies
+
+
+async def closed_loop(target, bodies, args, samples):
+    sent = itertools.count()
+    deadline = time.perf_counter() + args.duration if args.duration else None
+
+    async def worker():
+        while True:
+            index = next(sent)
+            if (args.requests and index >= args.requests) or (deadline and time.perf_counter() >= deadline):
+                return
+            start = time.perf_counter()
+            samples.append(await target.invoke(bodies[index % len(bodies)], args.stream, start))
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def open_loop(target, bodies, args, samples):
+    async def run(body, scheduled):
+        samples.append(await target.invoke(body, args.stream, scheduled))
+
+    tasks = []
+    begin = time.perf_counter()
+    scheduled = begin
+    for index in itertools.count():
+        if (args.requests and index >= args.requests) or (args.duration and scheduled - begin >= args.duration):
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(run(bodies[index % len(bodies)], scheduled)))
+        scheduled += random.expovariate(args.rate) if args.arrival == "poisson" else 1 / args.rate
+    await asyncio.gather(*tasks)
+
+
+def percentiles(values: list, scale: float = 1.0) -> dict:
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(p):
+        return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * scale, 2)
+
+    return {"p50": pick(50), "p90": pick(90), "p99": pick(99), "max": round(values[-1] * scale, 2),
+            "mean": round(sum(values) / len(values) * scale, 2)}
+
+
+def summarize(samples: list, wall: float, target, args) -> dict:
+    ok = [s for s in samples if s.error is None]
+    tokens = sum(s.tokens for s in ok)
+    decode = [(s.tokens - 1) / (s.latency - s.ttft) for s in ok
+              if s.ttft is not None and s.tokens > 1 and s.latency > s.ttft]
+    return {
+        "target": target.name,
+        "mode": args.mode,
+        "concurrency": args.concurrency if args.mode == "closed" else None,
+        "rate": args.rate if args.mode == "open" else None,
+        "stream": args.stream,
+        "payload": args.replay or args.payload,
+        "duration_s": round(wall, 2),
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+        "errors": dict(Counter(s.error for s in samples if s.error)),
+        "throughput_rps": round(len(ok) / wall, 2) if wall else 0.0,
+        "latency_ms": percentiles([s.latency for s in ok], 1000),
+        "ttft_ms": percentiles([s.ttft for s in ok if s.ttft is not None], 1000),
+        "output_tokens": tokens,
+        "output_tokens_per_s": round(tokens / wall, 2) if wall else 0.0,
+        "decode_tokens_per_s_per_request": percentiles(decode),
+    }
+
+
+def spawn_proxy(args, env_overrides: dict = None, real_vllm: bool = False, startup_timeout: float = 60):
+    """Start code/model.py locally (with fake_vllm.py unless real_vllm) and wait for /ping; returns (process, url)
+
+    With real_vllm the proxy runs exactly as in the container (port 8080,
+    model in /opt/ml/model), e.g. inside the image on a GPU instance.
+    """
+    env = os.environ.copy()
+    if args.payload in ("image", "mixed") or args.replay:
+        env.setdefault('MODEL_TYPE', 'multimodal')
+    env.update(env_overrides or {})
+    if real_vllm:
+        command = [sys.executable, os.path.join(REPO_DIR, 'code', 'model.py')]
+        url = "http://127.0.0.1:8080"
+    else:
+        fake_args = ['--ttft', str(args.fake_ttft), '--tokens-per-sec', str(args.fake_tokens_per_sec),
+                     '--output-tokens', str(args.fake_output_tokens),
+                     '--failure-rate', str(args.fake_failure_rate)]
+        command = [sys.executable, '-c', PROXY_LAUNCHER, os.path.join(REPO_DIR, 'code'),
+                   os.path.join(BENCH_DIR, 'fake_vllm.py'), str(args.port), *fake_args]
+        url = f"http://127.0.0.1:{args.port}"
+    proxy = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if proxy.poll() is not None:
+            raise SystemExit(f"❌ 本地代理启动失败（退出码 {proxy.returncode}）")
+        try:
+            if httpx.get(f"{url}/ping").status_code == 200:
+                return proxy, url
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    proxy.terminate()
+    raise SystemExit("❌ 等待本地代理就绪超时")
+
+
+async def run(args, target, bodies) -> dict:
+    samples = []
+    try:
+        for body in bodies[:args.warmup]:
+            await target.invoke(body, args.stream, time.perf_counter())
+        start = time.perf_counter()
+        if args.mode == "closed":
+            await closed_loop(target, bodies, args, samples)
+        else:
+            await open_loop(target, bodies, args, samples)
+        wall = time.perf_counter() - start
+    finally:
+        await target.close()
+    return summarize(samples, wall, target, args)
+
+
+def add_workload_arguments(parser):
+    """Workload and --spawn options, shared with bench/sweep.py"""
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed')
+    parser.add_argument('--concurrency', type=int, default=16, help='闭环并发数')
+    parser.add_argument('--rate', type=float, default=10, help='开环到达率（请求/秒）')
+    parser.add_argument('--arrival', choices=['uniform', 'poisson'], default='uniform', help='开环到达间隔分布')
+    parser.add_argument('--requests', type=int, default=0, help='请求总数（0 表示按 --duration）')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长（秒）')
+    parser.add_argument('--warmup', type=int, default=0, help='正式计时前顺序发送的预热请求数')
+    parser.add_argument('--replay', help='回放 JSONL 文件中的请求')
+    parser.add_argument('--payload', choices=['text', 'image', 'mixed'], default='text', help='合成请求类型')
+    parser.add_argument('--image', default=os.path.join(REPO_DIR, 'test', 'macos-desktop.jpg'))
+    parser.add_argument('--max-tokens', type=int, default=64)
+    parser.add_argument('--model', help='请求中的 model 字段（默认取配置文件的 served_model_name）')
+    parser.add_argument('--stream', action='store_true', help='流式请求（统计首 token 延迟）')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--max-connections', type=int, default=1024)
+    parser.add_argument('--output', help='结果另存为 JSON 文件')
+    spawn = parser.add_argument_group('--spawn 模拟 vLLM 参数')
+    spawn.add_argument('--port', type=int, default=18080, help='本地代理端口')
+    spawn.add_argument('--fake-ttft', type=float, default=0.05)
+    spawn.add_argument('--fake-tokens-per-sec', type=float, default=100)
+    spawn.add_argument('--fake-output-tokens', type=int, default=32)
+    spawn.add_argument('--fake-failure-rate', type=float, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='推理容器压测工具')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', default='http://127.0.0.1:8080', help='本地 code/model.py 地址')
+    target.add_argument('--config', help='SageMaker 配置文件（configs/<preset>.json）')
+    target.add_argument('--spawn', action='store_true', help='在本机启动 code/model.py + 模拟 vLLM')
+    add_workload_arguments(parser)
+    args = parser.parse_args()
+    if args.requests:
+        args.duration = 0
+
+    requests = load_replay(args.replay) if args.replay else synthesize(args.payload, args.image, args.max_tokens)
+    proxy = None
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        target = SageMakerTarget(config, args)
+        model_name = args.model or config.get('served_model_name')
+    else:
+        if args.spawn:
+            proxy, args.url = spawn_proxy(args)
+        target = HttpTarget(args.url, args)
+        model_name = args.model
+
+    try:
+        report = asyncio.run(run(args, target, encode_bodies(requests, model_name, args.stream)))
+    finally:
+        if proxy is not None:
+            proxy.terminate()
+            proxy.wait()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+vLLM 启动参数扫描：在参数网格的每个组合下启动 code/model.py，用 bench/loadgen.py 的负载压测，
+按目标指标（默认输出 token 吞吐）在延迟 SLO 和错误率约束下选出最优组合，写入 tuning/<preset>.json
+  默认:   由 bench/fake_vllm.py 代替 vLLM（--max-num-seqs 生效），CPU 环境验证扫描流程
+  --real: 启动真实 vLLM（在容器镜像内、与预设相同的实例类型上运行，模型挂载到 /opt/ml/model）
+使用方法:
+  python3 bench/sweep.py --preset autoglm --grid VLLM_MAX_NUM_SEQS=4,8,16 --fake-tokens-per-sec 50 --duration 10
+  python3 bench/sweep.py --preset autoglm --real --payload image --stream --mode open --rate 4 --duration 120 \\
+      --grid VLLM_MAX_NUM_SEQS=16,32,64 --grid VLLM_MAX_NUM_BATCHED_TOKENS=8192,16384 \\
+      --grid VLLM_ENABLE_PREFIX_CACHING=true,false --slo-p99-ms 8000 --apply
+"""
+import argparse
+import asyncio
+import configparser
+import itertools
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import loadgen  # noqa: E402
+
+PRESETS_FILE = os.path.join(REPO_DIR, 'model_presets.ini')
+# 预设中与容器无关的部署字段，不传给本地代理
+DEPLOY_ONLY_KEYS = {'MODEL_ID', 'INSTANCE_TYPE', 'AWS_REGION'}
+
+
+def load_preset(path: str, preset: str) -> dict:
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str
+    parser.read(path, encoding='utf-8')
+    if not parser.has_section(preset):
+        raise SystemExit(f"❌ 预设 '{preset}' 不存在于 {path}")
+    return dict(parser.items(preset))
+
+
+def parse_grid(specs: list) -> dict:
+    """["KEY=v1,v2", ...] -> {"KEY": ["v1", "v2"], ...}"""
+    grid = {}
+    for spec in specs:
+        key, sep, values = spec.partition('=')
+        if not sep or not key or not values:
+            raise SystemExit(f"❌ 无效的 --grid 参数: {spec}（格式 KEY=v1,v2,...）")
+        grid[key.strip()] = [v.strip() for v in values.split(',') if v.strip()]
+    return grid
+
+
+def grid_points(grid: dict) -> list:
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def feasible(report: dict, slo_metric: str, slo_p99_ms: float, max_error_rate: float) -> bool:
+    if report["succeeded"] == 0 or report["error_rate"] > max_error_rate:
+        return False
+    if slo_p99_ms:
+        latency = report.get(slo_metric)
+        return latency is not None and latency["p99"] <= slo_p99_ms
+    return True
+
+
+def pick_best(results: list, objective: str):
+    """Highest objective among results meeting the SLO; None when no result does"""
+    candidates = [r for r in results if r["feasible"]]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda r: r["report"][objective])
+
+
+def apply_to_presets(path: str, preset: str, params: dict):
+    """Write params into the preset's section of model_presets.ini, keeping comments and order"""
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    start = lines.index(f'[{preset}]')
+    end = start + 1
+    while end < len(lines) and lines[end].strip() and not lines[end].startswith('['):
+        end += 1
+    remaining = dict(params)
+    for index in range(start + 1, end):
+        key = lines[index].partition('=')[0]
+        if key in remaining:
+            lines[index] = f'{key}={remaining.pop(key)}'
+    lines[end:end] = [f'{key}={value}' for key, value in remaining.items()]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+def run_point(args, requests: list, env: dict) -> dict:
+    proxy, url = loadgen.spawn_proxy(args, env, real_vllm=args.real, startup_timeout=args.startup_timeout)
+    try:
+        target = loadgen.HttpTarget(url, args)
+        bodies = loadgen.encode_bodies(requests, args.model, args.stream)
+        return asyncio.run(loadgen.run(args, target, bodies))
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='vLLM 启动参数扫描')
+    parser.add_argument('--preset', required=True, help='model_presets.ini 中的预设名')
+    parser.add_argument('--grid', action='append', default=[], required=True,
+                        help='扫描参数 KEY=v1,v2,...（容器环境变量，可重复）')
+    parser.add_argument('--real', action='store_true', help='启动真实 vLLM（默认用 fake_vllm.py）')
+    parser.add_argument('--startup-timeout', type=float, default=None,
+                        help='每个组合等待 /ping 就绪的时长（秒，默认桩服务 60、真实 vLLM 1800）')
+    parser.add_argument('--objective', choices=['output_tokens_per_s', 'throughput_rps'],
+                        default='output_tokens_per_s')
+    parser.add_argument('--slo-metric', choices=['latency_ms', 'ttft_ms'], default='latency_ms')
+    parser.add_argument('--slo-p99-ms', type=float, default=0, help='p99 延迟上限（毫秒），0 表示不限')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--apply', action='store_true', help='把最优组合写回 model_presets.ini 的预设')
+    loadgen.add_workload_arguments(parser)
+    args = parser.parse_args()
+    if args.requests:
+        args.duration = 0
+    if args.startup_timeout is None:
+        args.startup_timeout = 1800 if args.real else 60
+
+    preset = load_preset(PRESETS_FILE, args.preset)
+    base_env = {k: v for k, v in preset.items() if k not in DEPLOY_ONLY_KEYS}
+    args.model = args.model or preset.get('SERVED_MODEL_NAME')
+    grid = parse_grid(args.grid)
+    points = grid_points(grid)
+    requests = (loadgen.load_replay(args.replay) if args.replay
+                else loadgen.synthesize(args.payload, args.image, args.max_tokens))
+    print(f"预设: {args.preset}（{preset.get('INSTANCE_TYPE', '?')}）  组合数: {len(points)}  "
+          f"目标: {args.objective}  SLO: {args.slo_metric} p99 <= {args.slo_p99_ms or '∞'} ms\n")
+
+    results = []
+    for index, params in enumerate(points, 1):
+        started = time.monotonic()
+        report = run_point(args, requests, {**base_env, **params})
+        ok = feasible(report, args.slo_metric, args.slo_p99_ms, args.max_error_rate)
+        results.append({"params": params, "feasible": ok, "report": report})
+        latency = report.get(args.slo_metric) or {}
+        print(f"  [{index}/{len(points)}] {params}  {args.objective}={report[args.objective]}  "
+              f"p99={latency.get('p99')}ms  errors={report['error_rate']}  "
+              f"{'✅' if ok else '❌'}  ({time.monotonic() - started:.0f}s)")
+
+    best = pick_best(results, args.objective)
+    os.makedirs(os.path.join(REPO_DIR, 'tuning'), exist_ok=True)
+    output = args.output or os.path.join(REPO_DIR, 'tuning', f'{args.preset}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            "preset": args.preset,
+            "instance_type": preset.get('INSTANCE_TYPE'),
+            "vllm": "real" if args.real else "stub",
+            "objective": args.objective,
+            "slo": {"metric": args.slo_metric, "p99_ms": args.slo_p99_ms, "max_error_rate": args.max_error_rate},
+            "grid": grid,
+            "best": best["params"] if best else None,
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {output}")
+    if best is None:
+        print("❌ 没有满足 SLO 的组合")
+        sys.exit(1)
+    print(f"📊 最优组合: {best['params']}（{args.objective}={best['report'][args.objective]}）")
+    if args.apply:
+        apply_to_presets(PRESETS_FILE, args.preset, best["params"])
+        print(f"✅ 已写入 {PRESETS_FILE} [{args.preset}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,270 @@
 #!/usr/bin/env python3
+"""查看 SageMaker Endpoint 的 CloudWatch 日志
+
+所有日志流并发、分页读取；每个流的读取位置保存在游标文件中，再次运行只拉取新日志。
+vLLM 周期输出的吞吐 / KV cache 使用率和启动各阶段耗时解析为时间序列（--stats，CSV 或 JSON）。
+用法:
+  python3 check_logs.py                        # configs/*.json 中的所有 Endpoint
+  python3 check_logs.py autoglm --follow       # 持续跟踪某个预设
+  python3 check_logs.py --endpoint autoglm-phone-9b-20260219-081841 --region us-west-2 --since 6h
+  python3 check_logs.py autoglm --quiet --stats stats.csv
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import sys
+import time
 import boto3
-from datetime import datetime, timedelta
-
-endpoint_arn = "arn:aws:sagemaker:us-west-2:210126446796:endpoint/autoglm-phone-9b-20260219-081841"
-endpoint_name = endpoint_arn.split('/')[-1]
-region = 'us-west-2'
-
-sm_client = boto3.client('sagemaker', region_name=region)
-logs_client = boto3.client('logs', region_name=region)
-
-# Get endpoint details
-print(f"Checking endpoint: {endpoint_name}\n")
-endpoint = sm_client.describe_endpoint(EndpointName=endpoint_name)
-print(f"Status: {endpoint['EndpointStatus']}")
-print(f"Creation Time: {endpoint['CreationTime']}")
-
-if 'FailureReason' in endpoint:
-    print(f"\nFailure Reason: {endpoint['FailureReason']}")
-
-# Get log group name
-log_group = f"/aws/sagemaker/Endpoints/{endpoint_name}"
-
-try:
-    # Get log streams
-    streams = logs_client.describe_log_streams(
-        logGroupName=log_group,
-        orderBy='LastEventTime',
-        descending=True,
-        limit=5
-    )
-    
-    print(f"\n{'='*80}")
-    print(f"Recent Log Streams:")
-    print(f"{'='*80}\n")
-    
-    for stream in streams['logStreams']:
-        stream_name = stream['logStreamName']
-        print(f"\n--- Log Stream: {stream_name} ---\n")
-        
-        # Get log events
-        events = logs_client.get_log_events(
-            logGroupName=log_group,
-            logStreamName=stream_name,
-            startFromHead=False,
-            limit=100
-        )
-        
-        for event in events['events']:
-            timestamp = datetime.fromtimestamp(event['timestamp']/1000)
-            print(f"[{timestamp}] {event['message']}")
-            
-except logs_client.exceptions.ResourceNotFoundException:
-    print(f"\nLog group not found: {log_group}")
-    print("Logs may not be available yet or endpoint hasn't started.")
-except Exception as e:
-    print(f"\nError retrieving logs: {e}")
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+CONFIGS_DIR = 'configs'
+CURSOR_FILE = os.path.join(CONFIGS_DIR, '.log_cursor.json')
+DEFAULT_REGION = 'us-west-2'
+
+# vLLM 周期统计行，例如:
+#   Engine 000: Avg prompt throughput: 812.3 tokens/s, Avg generation throughput: 95.1 tokens/s, Running: 4 reqs,
+#   Waiting: 0 reqs, GPU KV cache usage: 12.5%, Prefix cache hit rate: 41.0%
+STATS_FIELDS = {
+    'prompt_tps': re.compile(r'Avg prompt throughput: ([\d.]+)'),
+    'generation_tps': re.compile(r'Avg generation throughput: ([\d.]+)'),
+    'running': re.compile(r'Running: (\d+)'),
+    'waiting': re.compile(r'(?:Waiting|Pending): (\d+)'),
+    'kv_cache_pct': re.compile(r'GPU KV cache usage: ([\d.]+)%'),
+    'prefix_cache_hit_pct': re.compile(r'[Pp]refix cache hit rate: ([\d.]+)%'),
+}
+# 启动阶段：code/supervisor.py 的阶段切换，以及 vLLM 输出的各步骤耗时
+STARTUP_PATTERNS = [
+    (re.compile(r'\[startup\] phase: (\w+) \(\+([\d.]+)s\)'), None),
+    (re.compile(r'Loading weights took ([\d.]+) seconds'), 'load_weights'),
+    (re.compile(r'Model loading took [\d.]+ ?GiB and ([\d.]+) seconds'), 'model_loading'),
+    (re.compile(r'Memory profiling takes ([\d.]+) seconds'), 'memory_profiling'),
+    (re.compile(r'torch\.compile takes ([\d.]+) s in total'), 'torch_compile'),
+    (re.compile(r'Graph capturing finished in ([\d.]+) secs'), 'cuda_graph_capture'),
+    (re.compile(r'init engine \(profile, create kv cache, warmup model\) took ([\d.]+) seconds'), 'init_engine'),
+]
+CSV_COLUMNS = ['timestamp', 'endpoint', 'stream', 'kind', 'phase', 'seconds'] + list(STATS_FIELDS)
+
+
+def parse_stats(message):
+    """A time-series row for a vLLM stats or startup line, else None"""
+    if 'Avg prompt throughput' in message:
+        row = {'kind': 'stats'}
+        for field, pattern in STATS_FIELDS.items():
+            match = pattern.search(message)
+            if match:
+                row[field] = float(match.group(1))
+        return row
+    for pattern, phase in STARTUP_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            if phase is None:
+                return {'kind': 'startup', 'phase': match.group(1), 'seconds': float(match.group(2))}
+            return {'kind': 'startup', 'phase': phase, 'seconds': float(match.group(1))}
+    return None
+
+
+def parse_since(value):
+    """'30m' / '6h' / '2d' -> epoch milliseconds, 'all' -> 0"""
+    if value == 'all':
+        return 0
+    match = re.fullmatch(r'(\d+)([mhd])', value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"无效的时间: {value}（例如 30m、6h、2d、all）")
+    unit = {'m': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+    since = datetime.now(timezone.utc) - timedelta(**{unit: int(match.group(1))})
+    return int(since.timestamp() * 1000)
+
+
+def resolve_endpoints(args):
+    """[(label, endpoint_name, region)] from --endpoint or configs/<preset>.json"""
+    if args.endpoint:
+        return [(args.endpoint, args.endpoint, args.region or DEFAULT_REGION)]
+    paths = ([os.path.join(CONFIGS_DIR, f"{preset}.json") for preset in args.presets]
+             or sorted(glob.glob(os.path.join(CONFIGS_DIR, '*.json'))))
+    endpoints = []
+    for path in paths:
+        if not os.path.exists(path):
+            raise SystemExit(f"❌ 配置文件不存在: {path}")
+        with open(path) as f:
+            config = json.load(f)
+        if config.get('endpoint_name'):
+            label = os.path.basename(path)[:-len('.json')]
+            endpoints.append((label, config['endpoint_name'], args.region or config.get('region', DEFAULT_REGION)))
+    return endpoints
+
+
+class LogFollower:
+    """Incremental reader of every log stream of a set of endpoints
+
+    The per-stream forward token is kept in the cursor file, so each run
+    (and each --follow poll) only fetches events written since the last one.
+    """
+
+    def __init__(self, endpoints, cursor_path, since, workers):
+        self.endpoints = endpoints
+        self.cursor_path = cursor_path
+        self.since = since
+        self.workers = workers
+        self.cursor = {}
+        if cursor_path and os.path.exists(cursor_path):
+            with open(cursor_path) as f:
+                self.cursor = json.load(f)
+        config = Config(retries={'max_attempts': 10, 'mode': 'adaptive'}, max_pool_connections=workers)
+        self.clients = {region: boto3.client('logs', region_name=region, config=config)
+                        for region in {region for _, _, region in endpoints}}
+
+    def _streams(self, endpoint):
+        label, endpoint_name, region = endpoint
+        log_group = f"/aws/sagemaker/Endpoints/{endpoint_name}"
+        client = self.clients[region]
+        try:
+            paginator = client.get_paginator('describe_log_streams')
+            return [(endpoint, log_group, s['logStreamName'])
+                    for page in paginator.paginate(logGroupName=log_group)
+                    for s in page['logStreams']]
+        except client.exceptions.ResourceNotFoundException:
+            return []
+
+    def _read_stream(self, item):
+        (label, endpoint_name, region), log_group, stream = item
+        client = self.clients[region]
+        key = f"{region}/{log_group}/{stream}"
+        token = self.cursor.get(key)
+        request = {'logGroupName': log_group, 'logStreamName': stream, 'startFromHead': True}
+        if token:
+            request['nextToken'] = token
+        elif self.since:
+            request['startTime'] = self.since
+        events = []
+        while True:
+            response = client.get_log_events(**request)
+            events.extend((e['timestamp'], label, stream, e['message']) for e in response['events'])
+            # 空页之后仍可能有事件：只有返回的 nextForwardToken 与请求的相同时才读完
+            if response['nextForwardToken'] == request.get('nextToken'):
+                break
+            request['nextToken'] = response['nextForwardToken']
+            request.pop('startTime', None)
+        return key, response['nextForwardToken'], events
+
+    def poll(self):
+        """New events from all streams, oldest first"""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            items = [item for streams in executor.map(self._streams, self.endpoints) for item in streams]
+            results = list(executor.map(self._read_stream, items))
+        events = []
+        for key, token, stream_events in results:
+            self.cursor[key] = token
+            events.extend(stream_events)
+        if self.cursor_path:
+            tmp_path = f"{self.cursor_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.cursor, f, indent=2)
+            os.replace(tmp_path, self.cursor_path)
+        return sorted(events, key=lambda e: e[0])
+
+
+class StatsWriter:
+    """Appends parsed rows to a CSV file, or to a JSON array rewritten on every flush"""
+
+    def __init__(self, path):
+        self.path = path
+        self.json = path.endswith('.json')
+        self.rows = []
+        if self.json and os.path.exists(path):
+            with open(path) as f:
+                self.rows = json.load(f)
+
+    def add(self, rows):
+        if not rows:
+            return
+        if self.json:
+            self.rows.extend(rows)
+            with open(self.path, 'w') as f:
+                json.dump(self.rows, f, indent=1)
+            return
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(rows)
+
+
+def print_status(endpoints):
+    def describe(endpoint):
+        label, endpoint_name, region = endpoint
+        try:
+            response = boto3.client('sagemaker', region_name=region).describe_endpoint(EndpointName=endpoint_name)
+        except Exception as e:
+            return f"📦 {label}: {endpoint_name}（{region}）状态未知: {e}"
+        line = f"📦 {label}: {endpoint_name}（{region}）{response['EndpointStatus']}"
+        if 'FailureReason' in response:
+            line += f"\n   Failure Reason: {response['FailureReason']}"
+        return line
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for line in executor.map(describe, endpoints):
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查看 SageMaker Endpoint 的 CloudWatch 日志')
+    parser.add_argument('presets', nargs='*', help='预设名（读取 configs/<preset>.json，默认全部）')
+    parser.add_argument('--endpoint', help='直接指定 Endpoint 名称')
+    parser.add_argument('--region', help='区域（默认取配置文件中的 region）')
+    parser.add_argument('--since', type=parse_since, default='1h',
+                        help='首次读取（无游标）时从多久之前开始: 30m / 6h / 2d / all（默认 1h）')
+    parser.add_argument('--reset', action='store_true', help='忽略已保存的游标，从 --since 重新读取')
+    parser.add_argument('--no-cursor', action='store_true', help='不读取也不保存游标')
+    parser.add_argument('--follow', '-f', action='store_true', help='持续跟踪新日志')
+    parser.add_argument('--interval', type=float, default=10, help='--follow 的轮询间隔（秒）')
+    parser.add_argument('--stats', help='把 vLLM 统计和启动阶段耗时追加写入 CSV 或 JSON（按扩展名）')
+    parser.add_argument('--quiet', '-q', action='store_true', help='不打印原始日志')
+    parser.add_argument('--workers', type=int, default=16, help='并发读取的日志流数')
+    args = parser.parse_args()
+
+    endpoints = resolve_endpoints(args)
+    if not endpoints:
+        print("❌ 没有找到已部署的 Endpoint（configs/*.json 中没有 endpoint_name）")
+        sys.exit(1)
+    print_status(endpoints)
+
+    cursor_path = None if args.no_cursor else CURSOR_FILE
+    if cursor_path:
+        os.makedirs(os.path.dirname(cursor_path), exist_ok=True)
+        if args.reset and os.path.exists(cursor_path):
+            os.remove(cursor_path)
+    follower = LogFollower(endpoints, cursor_path, args.since, args.workers)
+    stats = StatsWriter(args.stats) if args.stats else None
+    multiple = len(endpoints) > 1
+
+    try:
+        while True:
+            started = time.monotonic()
+            events = follower.poll()
+            rows = []
+            for timestamp, label, stream, message in events:
+                when = datetime.fromtimestamp(timestamp / 1000, timezone.utc)
+                if not args.quiet:
+                    prefix = f"[{label}] " if multiple else ""
+                    print(f"{prefix}[{when.strftime('%Y-%m-%d %H:%M:%S')}] {message.rstrip()}")
+                row = parse_stats(message) if stats else None
+                if row:
+                    rows.append({'timestamp': when.isoformat(), 'endpoint': label, 'stream': stream, **row})
+            if stats:
+                stats.add(rows)
+            if not args.follow:
+                print(f"\n{len(events)} 条日志" + (f"，{len(rows)} 条统计写入 {args.stats}" if stats else ""))
+                break
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Admission control: in-flight limit, bounded priority queue and load shedding"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+# 数值越小优先级越高
+PRIORITIES = {"interactive": 0, "default": 1, "batch": 2}
+
+
+class Rejected(Exception):
+    """Raised when a request is shed; carries the HTTP status and Retry-After seconds"""
+
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """Limit concurrent upstream requests and queue the rest by priority
+
+    Requests beyond ``max_inflight`` wait in a queue of at most ``max_queue``
+    entries, ordered by priority class and then arrival. When the queue is
+    full, a new request displaces the newest waiter of a strictly lower
+    priority, or is rejected with 429. Waiters that exceed ``queue_timeout``
+    are rejected with 503.
+    """
+
+    def __init__(self, max_inflight=64, max_queue=256, queue_timeout=30.0):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self.waiters = []  # heap of [priority, seq, future]
+        self._seq = itertools.count()
+        self.service_time = 1.0  # 上游请求耗时的指数移动平均（秒），用于估算 Retry-After
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.displaced = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for w in self.waiters if not w[2].done())
+
+    def retry_after(self) -> int:
+        backlog = self.queued + self.inflight
+        return max(1, min(60, math.ceil(backlog * self.service_time / max(1, self.max_inflight))))
+
+    def saturated(self, priority: int) -> bool:
+        """Cheap pre-check so requests that would be shed are rejected before any parsing"""
+        if self.inflight < self.max_inflight or self.queued < self.max_queue:
+            return False
+        return not any(w[0] > priority and not w[2].done() for w in self.waiters)
+
+    def _displace(self, priority: int) -> bool:
+        victims = [w for w in self.waiters if w[0] > priority and not w[2].done()]
+        if not victims:
+            return False
+        victim = max(victims, key=lambda w: (w[0], w[1]))
+        victim[2].set_exception(Rejected(429, self.retry_after(), "displaced by higher-priority request"))
+        self.displaced += 1
+        return True
+
+    async def acquire(self, priority: int = PRIORITIES["default"]):
+        if self.inflight < self.max_inflight and not self.queued:
+            self.inflight += 1
+            self.admitted += 1
+            return
+        if self.queued >= self.max_queue and not self._displace(priority):
+            self.rejected_full += 1
+            raise Rejected(429, self.retry_after(), "admission queue full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, [priority, next(self._seq), future])
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # 超时与放行同时发生：名额已转交给本请求
+                self.admitted += 1
+                return
+            future.cancel()
+            self.rejected_timeout += 1
+            raise Rejected(503, self.retry_after(), "queue deadline exceeded")
+        except asyncio.CancelledError:
+            # 客户端断开：若名额已转交，归还给下一个等待者
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            else:
+                future.cancel()
+            raise
+        self.admitted += 1
+
+    def release(self, service_time: float = None):
+        if service_time is not None:
+            self.service_time = 0.9 * self.service_time + 0.1 * service_time
+        # 名额直接转交给优先级最高的等待者，in-flight 计数不变
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.inflight -= 1
+
+    def slot(self, priority: int):
+        return _Slot(self, priority)
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "displaced": self.displaced,
+            "service_time_s": round(self.service_time, 3),
+        }
+
+
+class _Slot:
+    """async with controller.slot(priority): holds one in-flight slot"""
+
+    def __init__(self, controller: AdmissionController, priority: int):
+        self.controller = controller
+        self.priority = priority
+        self.started = None
+
+    async def __aenter__(self):
+        await self.controller.acquire(self.priority)
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.controller.release(time.monotonic() - self.started)
@@ -0,0 +1,87 @@
+"""Agent-history compaction to cap prefill tokens"""
+
+IMAGE_PLACEHOLDER = "[历史截图已省略]"
+TRUNCATION_MARK = "…"
+
+# 粗略估算：中英混合文本约 3 字符 / token
+CHARS_PER_TOKEN = 3
+
+
+def _is_image(part) -> bool:
+    return isinstance(part, dict) and part.get("type") in ("image_url", "image")
+
+
+def _part_text(part) -> str:
+    # "text": null 或非字符串的文本块按空文本处理
+    text = part.get("text")
+    return text if isinstance(text, str) else ""
+
+
+def _text_chars(content) -> int:
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        return sum(len(_part_text(part)) for part in content
+                   if isinstance(part, dict) and part.get("type") == "text")
+    return 0
+
+
+def estimate_tokens(messages, image_tokens: int) -> int:
+    """Rough prompt-token estimate: text length plus a fixed cost per image"""
+    total = 0
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        content = message.get("content")
+        total += _text_chars(content) // CHARS_PER_TOKEN
+        if isinstance(content, list):
+            total += image_tokens * sum(1 for part in content if _is_image(part))
+    return total
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    # 保留结尾：AutoGLM 的动作指令（do(...)/finish(...)）在回复末尾
+    if len(text) <= max_chars:
+        return text
+    return TRUNCATION_MARK + text[-max_chars:]
+
+
+def compact_history(data: dict, max_images: int = 0, assistant_tokens: int = 0,
+                    image_tokens: int = 1500):
+    """Compact a chat request in place; returns (tokens_before, tokens_after)
+
+    Keeps only the last ``max_images`` images (older ones become a text
+    placeholder) and truncates every assistant turn except the latest to
+    ``assistant_tokens``. A value of 0 disables the corresponding step.
+    """
+    messages = data.get("messages")
+    if not isinstance(messages, list):
+        return 0, 0
+    before = estimate_tokens(messages, image_tokens)
+
+    images_seen = 0
+    latest_assistant = True
+    for message in reversed(messages):
+        if not isinstance(message, dict):
+            continue
+        content = message.get("content")
+
+        if max_images and isinstance(content, list):
+            for index in range(len(content) - 1, -1, -1):
+                if not _is_image(content[index]):
+                    continue
+                images_seen += 1
+                if images_seen > max_images:
+                    content[index] = {"type": "text", "text": IMAGE_PLACEHOLDER}
+
+        if assistant_tokens and message.get("role") == "assistant":
+            if latest_assistant:
+                latest_assistant = False
+            elif isinstance(content, str):
+                message["content"] = _truncate(content, assistant_tokens * CHARS_PER_TOKEN)
+            elif isinstance(content, list):
+                for part in content:
+                    if isinstance(part, dict) and part.get("type") == "text" and _part_text(part):
+                        part["text"] = _truncate(part["text"], assistant_tokens * CHARS_PER_TOKEN)
+
+    return before, estimate_tokens(messages, image_tokens)
@@ -0,0 +1,69 @@
+"""Server-side image downscaling and re-encoding policy"""
+
+import io
+import math
+
+from PIL import Image
+
+# Qwen2-VL / GLM-4V 系列视觉编码器：14px patch，2x2 合并 → 每个图像 token 覆盖 28x28 像素
+PIXELS_PER_TOKEN_EDGE = 28
+
+
+def estimate_image_tokens(width: int, height: int, max_pixels: int = 0) -> int:
+    """Estimate vision tokens for an image after vLLM's own max_pixels cap"""
+    if max_pixels and width * height > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+        width, height = int(width * scale), int(height * scale)
+    return math.ceil(width / PIXELS_PER_TOKEN_EDGE) * math.ceil(height / PIXELS_PER_TOKEN_EDGE)
+
+
+class ImagePolicy:
+    """Resize images to a long-edge / pixel budget and re-encode them
+
+    Images already within budget are passed through unchanged, so the policy
+    never re-encodes (and degrades) small screenshots.
+    """
+
+    def __init__(self, max_edge=0, max_pixels=0, quality=90, fmt="jpeg", vllm_max_pixels=0):
+        self.max_edge = max_edge
+        self.max_pixels = max_pixels
+        self.quality = quality
+        self.fmt = fmt.lower()
+        self.vllm_max_pixels = vllm_max_pixels
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_edge or self.max_pixels)
+
+    def target_size(self, width: int, height: int):
+        scale = 1.0
+        if self.max_edge and max(width, height) > self.max_edge:
+            scale = self.max_edge / max(width, height)
+        if self.max_pixels and width * height * scale * scale > self.max_pixels:
+            scale = math.sqrt(self.max_pixels / (width * height))
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def apply(self, raw: bytes, ext: str):
+        """Return (raw, ext, info) with the image resized and re-encoded if over budget"""
+        # PIL 延迟解码：截断或损坏的图片可能直到 convert/resize/save 才报错，整个过程都在保护范围内
+        try:
+            image = Image.open(io.BytesIO(raw))
+            width, height = image.size
+            new_width, new_height = self.target_size(width, height)
+            info = {
+                "tokens_before": estimate_image_tokens(width, height, self.vllm_max_pixels),
+                "tokens_after": estimate_image_tokens(new_width, new_height, self.vllm_max_pixels),
+            }
+            if (new_width, new_height) == (width, height):
+                return raw, ext, info
+
+            # JPEG 解码时直接按 1/2、1/4… 缩小，避免先解码全尺寸
+            image.draft("RGB", (new_width, new_height))
+            image = image.convert("RGB").resize(
+                (new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            out = io.BytesIO()
+            image.save(out, format="WEBP" if self.fmt == "webp" else "JPEG", quality=self.quality)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            # 无法处理的图片原样交给 vLLM 处理
+            return raw, ext, None
+        return out.getvalue(), "webp" if self.fmt == "webp" else "jpeg", info
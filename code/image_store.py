@@ -0,0 +1,138 @@
+"""Content-addressed shared-memory store for inline data-URL images"""
+
+import base64
+import binascii
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+
+def split_data_url(url: str):
+    """Return (ext, base64 payload) for a base64 image data URL, or None"""
+    header, sep, payload = url.partition(",")
+    if not sep or not header.startswith("data:image/") or not header.endswith(";base64"):
+        return None
+    return header[len("data:image/"):-len(";base64")].split("+")[0] or "bin", payload
+
+
+def decode_data_url(url: str):
+    """Return (ext, raw bytes) for a base64 image data URL, or None if it cannot be decoded"""
+    parsed = split_data_url(url)
+    if parsed is None:
+        return None
+    ext, payload = parsed
+    try:
+        return ext, base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
+class ImageStore:
+    """Bounded LRU store of decoded images, referenced by vLLM as file:// URLs
+
+    Images are keyed by a hash of their base64 payload, so a screenshot that is
+    resent across agent steps is decoded and written only once. Entries used by
+    in-flight requests are pinned and never evicted until released.
+    """
+
+    def __init__(self, root="/dev/shm/mm-images", max_bytes=1024 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> [path, size, pins, info]
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        # 丢弃上次运行遗留的文件，索引只存在于内存
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root, exist_ok=True)
+
+    def _evict(self):
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                return
+            path, size, pins, _ = self.entries[key]
+            if pins:
+                continue
+            del self.entries[key]
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def acquire(self, url: str, transform=None):
+        """Store a data URL image and pin it; returns (key, path, info) or None
+
+        transform(raw, ext) -> (raw, ext, info) is applied once when the image
+        is first stored; its info is cached with the entry and returned on hits.
+        """
+        parsed = split_data_url(url)
+        if parsed is None:
+            return None
+        ext, payload = parsed
+        key = hashlib.blake2b(payload.encode("ascii", errors="ignore"), digest_size=16).hexdigest()
+
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[2] += 1
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += len(url) - len(entry[0]) - len("file://")
+                return key, entry[0], entry[3]
+
+        decoded = decode_data_url(url)
+        if decoded is None:
+            return None
+        ext, raw = decoded
+        info = None
+        if transform is not None:
+            raw, ext, info = transform(raw, ext)
+        path = os.path.join(self.root, f"{key}.{ext}")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [path, len(raw), 0, info]
+                self.total_bytes += len(raw)
+                self.misses += 1
+            else:
+                # 另一个线程同时写入了同一张图片
+                self.entries.move_to_end(key)
+                self.hits += 1
+            entry[2] += 1
+            self.bytes_saved += len(url) - len(entry[0]) - len("file://")
+            self._evict()
+        return key, entry[0], entry[3]
+
+    def release(self, keys):
+        with self._lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry[2] -= 1
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes_saved": self.bytes_saved,
+            }
@@ -1,42 +1,183 @@
 """Universal vLLM Inference Handler for SageMaker"""
 
-import subprocess
-import time
+import asyncio
+import base64
 import os
 import json
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 import httpx
+import orjson
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import Response, StreamingResponse
 import uvicorn
 
-vllm_process = None
+from admission import PRIORITIES, AdmissionController, Rejected
+from compaction import compact_history
+from image_policy import ImagePolicy
+from metrics import LATENCY_BUCKETS, SIZE_BUCKETS, TTFT_BUCKETS, Registry
+from image_store import ImageStore, decode_data_url
+from response_cache import ResponseCache, cache_key, is_deterministic
+from model_router import ModelHost, ModelRouter, UnknownModel, parse_models
+from replicas import Replica, ReplicaPool
+from supervisor import StartupError, StartupSupervisor
+from timing import RequestTiming, SlowLog, new_request_id
+from warmup import load_warmup, run_warmup
+
+replicas = None
+model_router = None
+image_store = None
+response_cache = None
+admission = None
 
 # 从环境变量读取配置（由 SageMaker 传入）
+MODEL_DIR = "/opt/ml/model"
 SERVED_MODEL_NAME = os.environ.get('SERVED_MODEL_NAME', 'model')
 MAX_MODEL_LEN = os.environ.get('MAX_MODEL_LEN', '4096')
 DTYPE = os.environ.get('DTYPE', 'auto')
 MODEL_TYPE = os.environ.get('MODEL_TYPE', 'text')  # text, multimodal
 
+# vLLM 调度参数：未设置时使用 vLLM 默认值，可在预设中按实例类型覆盖（bench/sweep.py 搜索最优组合）
+VLLM_TUNING_FLAGS = {
+    'VLLM_MAX_NUM_SEQS': '--max-num-seqs',
+    'VLLM_MAX_NUM_BATCHED_TOKENS': '--max-num-batched-tokens',
+    'VLLM_GPU_MEMORY_UTILIZATION': '--gpu-memory-utilization',
+    'VLLM_ENABLE_PREFIX_CACHING': '--enable-prefix-caching',  # true / false
+    'VLLM_ENABLE_CHUNKED_PREFILL': '--enable-chunked-prefill',  # true / false
+}
+VLLM_TUNING = {key: os.environ[key] for key in VLLM_TUNING_FLAGS if os.environ.get(key)}
 
-def start_vllm_server() -> bool:
-    """Start vLLM server with configurable parameters"""
-    global vllm_process
-    
-    model_path = "/opt/ml/model"
-    
+# 代理到 vLLM 的上游连接池配置（每个副本一个连接池）
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('UPSTREAM_MAX_CONNECTIONS', '256'))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get('UPSTREAM_MAX_KEEPALIVE', '64'))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get('UPSTREAM_KEEPALIVE_EXPIRY', '60'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '5'))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', '300'))
+UPSTREAM_POOL_TIMEOUT = float(os.environ.get('UPSTREAM_POOL_TIMEOUT', '30'))
+# 代理与 vLLM 之间的传输：uds 时 vLLM 监听 Unix 域套接字，请求体不再经过回环 TCP 协议栈；
+# 套接字目录不可用时回退到 tcp
+UPSTREAM_TRANSPORT = os.environ.get('UPSTREAM_TRANSPORT', 'tcp')  # tcp, uds
+VLLM_SOCKET_DIR = os.environ.get('VLLM_SOCKET_DIR', '/tmp')
+
+# 数据并行：启动 N 个 vLLM 副本，各自绑定不同 GPU 和端口，按未完成请求数最少路由
+VLLM_REPLICAS = int(os.environ.get('VLLM_REPLICAS', '1'))
+GPUS_PER_REPLICA = int(os.environ.get('GPUS_PER_REPLICA', '1'))  # >1 时副本内使用张量并行
+VLLM_BASE_PORT = 8000
+REPLICA_RESTART_DELAY = float(os.environ.get('REPLICA_RESTART_DELAY', '5'))
+SESSION_AFFINITY_SLACK = int(os.environ.get('SESSION_AFFINITY_SLACK', '4'))
+
+# 多模型托管（可选）：MODELS="name[:显存比例],..."，每个模型是 /opt/ml/model/<name> 子目录，
+# 按请求的 model 字段路由。第一个为默认模型，随容器启动；其余在首次请求时启动，空闲超时后停止
+MODELS = os.environ.get('MODELS', '')
+MODEL_GPU_MEMORY = float(os.environ.get('MODEL_GPU_MEMORY', '0.45'))  # 未指定比例的模型占用的显存比例
+MODEL_IDLE_TIMEOUT = float(os.environ.get('MODEL_IDLE_TIMEOUT', '900'))  # 0 表示不因空闲停止
+MODEL_START_WAIT = float(os.environ.get('MODEL_START_WAIT', '50'))  # 等待模型启动的上限，须小于 SageMaker 60s 调用超时
+GPU_MEMORY_BUDGET = 0.95
+
+# 启动监控配置
+VLLM_STARTUP_TIMEOUT = float(os.environ.get('VLLM_STARTUP_TIMEOUT', '600'))
+COLD_START_LOG = os.environ.get('COLD_START_LOG', '/tmp/cold_start_timeline.json')
+
+# 预热：vLLM /health 就绪后、/ping 返回 200 前回放预热请求，让多模态处理器缓存、kernel 调优和
+# 大图首次 prefill 的惰性初始化发生在接流量之前
+WARMUP_FILE = os.environ.get('WARMUP_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warmup.jsonl'))
+WARMUP_BUDGET = float(os.environ.get('WARMUP_BUDGET', '60'))  # 预热总时长上限（秒），0 表示关闭
+warmup_requests = []
+
+# 多模态图片缓存：把 base64 图片解码到共享内存，以 file:// 引用传给 vLLM（0 表示关闭）
+IMAGE_STORE_MB = int(os.environ.get('IMAGE_STORE_MB', '1024'))
+IMAGE_STORE_DIR = os.environ.get('IMAGE_STORE_DIR', '/dev/shm/mm-images')
+
+# 图片分辨率策略（按预设配置）：超出长边/像素预算的图片在代理中缩放并重新编码，0 表示不限制
+IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', '0'))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', '0'))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '90'))
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'jpeg')  # jpeg, webp
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '4'))
+VLLM_MAX_PIXELS = 5000000
+
+image_policy = ImagePolicy(IMAGE_MAX_EDGE, IMAGE_MAX_PIXELS, IMAGE_QUALITY, IMAGE_FORMAT, VLLM_MAX_PIXELS)
+image_tokens = {"before": 0, "after": 0}
+stats_lock = threading.Lock()
+
+# 历史压缩（可选）：只保留最近 N 张截图，较早的助手回复截断到 token 预算，0 表示关闭
+HISTORY_MAX_IMAGES = int(os.environ.get('HISTORY_MAX_IMAGES', '0'))
+HISTORY_ASSISTANT_TOKENS = int(os.environ.get('HISTORY_ASSISTANT_TOKENS', '0'))
+HISTORY_IMAGE_TOKENS = int(os.environ.get('HISTORY_IMAGE_TOKENS', '1500'))  # 估算时每张图片的 token 数
+
+# 响应缓存：temperature=0 的相同请求直接复用结果，并发的相同请求只转发一次（0 表示关闭）
+RESPONSE_CACHE_MB = int(os.environ.get('RESPONSE_CACHE_MB', '0'))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '300'))
+
+# 批量调用：/invocations 接受请求数组或 {"batch": [...]}，并发转发给 vLLM
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '16'))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '256'))
+# JSON Lines 请求体（SageMaker Batch Transform 的 SplitType=Line）按行作为批量请求处理，结果逐行返回
+JSONL_CONTENT_TYPES = ("application/jsonlines", "application/x-jsonlines", "application/jsonl")
+
+# 准入控制（默认关闭）：限制同时转发给 vLLM 的请求数，其余按优先级排队，队列满或超时快速返回 429/503。
+# auto 表示所有副本的调度容量：VLLM_REPLICAS × --max-num-seqs（未设置时按 vLLM 默认 256）
+ADMISSION_MAX_INFLIGHT = os.environ.get('ADMISSION_MAX_INFLIGHT', '0')
+ADMISSION_MAX_INFLIGHT = (VLLM_REPLICAS * int(VLLM_TUNING.get('VLLM_MAX_NUM_SEQS', '256'))
+                          if ADMISSION_MAX_INFLIGHT == 'auto' else int(ADMISSION_MAX_INFLIGHT))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '256'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '30'))
+
+# 代理自身的 Prometheus 指标（/metrics 同时转发 vLLM 的指标）
+registry = Registry()
+requests_total = registry.counter(
+    "proxy_requests_total", "Requests to /invocations by mode and status", ("mode", "status"))
+requests_inflight = registry.gauge("proxy_requests_inflight", "Requests currently being handled")
+request_latency = registry.histogram(
+    "proxy_request_duration_seconds", "End-to-end /invocations latency", LATENCY_BUCKETS)
+ttft = registry.histogram(
+    "proxy_time_to_first_token_seconds", "Time to first streamed chunk", TTFT_BUCKETS)
+prompt_tokens = registry.counter("proxy_prompt_tokens_total", "Prompt tokens reported by vLLM usage")
+completion_tokens = registry.counter("proxy_completion_tokens_total", "Completion tokens reported by vLLM usage")
+upstream_errors = registry.counter("proxy_upstream_errors_total", "Failed upstream calls by kind", ("kind",))
+request_bytes = registry.histogram("proxy_request_bytes", "Request body size", SIZE_BUCKETS)
+response_bytes = registry.histogram("proxy_response_bytes", "Response body size", SIZE_BUCKETS)
+
+# 慢请求日志：超过阈值的请求按采样率以 JSON 行写到标准输出（CloudWatch），0 表示关闭
+SLOW_LOG_MS = float(os.environ.get('SLOW_LOG_MS', '0'))
+SLOW_LOG_SAMPLE = float(os.environ.get('SLOW_LOG_SAMPLE', '1.0'))
+slow_log = SlowLog(SLOW_LOG_MS, SLOW_LOG_SAMPLE)
+
+# CPU 密集的请求预处理（JSON 解析、图片解码/缩放）在线程池中执行
+prepare_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="prepare")
+
+
+def build_vllm_command(port: int = VLLM_BASE_PORT, gpus=None, model_path: str = MODEL_DIR,
+                       served_model_name: str = SERVED_MODEL_NAME, gpu_memory: float = None, uds: str = None):
+    """Build the vLLM command line and environment from configurable parameters
+
+    ``gpus`` pins the server to those devices (tensor parallel across them);
+    ``gpu_memory`` caps the fraction of GPU memory this server may use;
+    ``uds`` serves on that Unix domain socket instead of 127.0.0.1:``port``.
+    """
     # 基础参数（所有模型通用）
     cmd = [
         "python3", "-m", "vllm.entrypoints.openai.api_server",
         "--model", model_path,
-        "--served-model-name", SERVED_MODEL_NAME,
+        "--served-model-name", served_model_name,
         "--max-model-len", MAX_MODEL_LEN,
         "--dtype", DTYPE,
         "--trust-remote-code",
-        "--host", "127.0.0.1",
-        "--port", "8000",
     ]
+    if uds:
+        cmd.extend(["--uds", uds])
+    else:
+        cmd.extend(["--host", "127.0.0.1", "--port", str(port)])
+    if gpus and len(gpus) > 1:
+        cmd.extend(["--tensor-parallel-size", str(len(gpus))])
+    tuning = dict(VLLM_TUNING)
+    if gpu_memory:
+        tuning['VLLM_GPU_MEMORY_UTILIZATION'] = str(gpu_memory)
+    cmd.extend(tuning_args(tuning))
     
     # 多模态参数（仅当 MODEL_TYPE=multimodal 时添加）
     if MODEL_TYPE == 'multimodal':
@@ -44,46 +185,212 @@ def start_vllm_server() -> bool:
             "--allowed-local-media-path", "/",
             "--mm-encoder-tp-mode", "data",
             "--mm-processor-cache-type", "shm",
-            "--mm-processor-kwargs", '{"max_pixels": 5000000}',
+            "--mm-processor-kwargs", json.dumps({"max_pixels": VLLM_MAX_PIXELS}),
             "--chat-template-content-format", "string",
             "--limit-mm-per-prompt", '{"image": 10}',
         ])
     
     env = os.environ.copy()
     env["VLLM_WORKER_MULTIPROC_METHOD"] = "spawn"
+    if gpus:
+        env["CUDA_VISIBLE_DEVICES"] = ",".join(str(gpu) for gpu in gpus)
     
     print(f"Starting vLLM server with config:")
-    print(f"  Model Name: {SERVED_MODEL_NAME}")
+    print(f"  Model Name: {served_model_name}")
     print(f"  Max Length: {MAX_MODEL_LEN}")
     print(f"  Data Type: {DTYPE}")
     print(f"  Model Type: {MODEL_TYPE}")
+    if tuning:
+        print(f"  Tuning: {tuning}")
+    if gpus:
+        print(f"  GPUs: {env['CUDA_VISIBLE_DEVICES']}")
     print(f"Command: {' '.join(cmd)}")
-    
-    vllm_process = subprocess.Popen(cmd, env=env)
-    
-    for _ in range(120):
+    return cmd, env
+
+
+def tuning_args(tuning: dict) -> list:
+    """vLLM flags for the VLLM_* scheduler settings; booleans map to --flag / --no-flag"""
+    args = []
+    for key, value in tuning.items():
+        flag = VLLM_TUNING_FLAGS[key]
+        if flag.startswith("--enable-"):
+            args.append(flag if value.lower() in ("1", "true", "yes", "on") else "--no-" + flag[2:])
+        else:
+            args.extend([flag, value])
+    return args
+
+
+def upstream():
+    """The object managing the vLLM servers: the model router, or the replica pool"""
+    return model_router if model_router is not None else replicas
+
+
+async def start_vllm_server():
+    """Start the vLLM replicas under their supervisors; exit the container if startup fails"""
+    try:
+        await upstream().start()
+        print("vLLM server ready")
+    except Exception as e:
+        # StartupError 之外的异常（如启动子进程时的 OSError）同样立即退出，不能让后台任务静默结束
+        if isinstance(e, StartupError):
+            print(f"vLLM server failed to start: {e}")
+        else:
+            traceback.print_exc()
+            print(f"vLLM server failed to start: {e!r}")
         try:
-            resp = httpx.get("http://127.0.0.1:8000/health", timeout=5)
-            if resp.status_code == 200:
-                print("vLLM server ready")
-                return True
-        except:
-            pass
-        time.sleep(5)
-    
-    print("vLLM server failed to start")
-    return False
+            await upstream().stop()
+        except Exception as stop_error:
+            print(f"Stopping vLLM after failed start: {stop_error!r}")
+        # 立即退出容器，避免 SageMaker 一直等到健康检查超时
+        os._exit(1)
+
+
+def vllm_socket_path(port: int):
+    """Unix socket path for the vLLM server on ``port``, or None to use TCP"""
+    if UPSTREAM_TRANSPORT != "uds":
+        return None
+    path = os.path.join(VLLM_SOCKET_DIR, f"vllm-{port}.sock")
+    # sun_path 上限 108 字节
+    if len(path.encode()) > 107 or not os.access(VLLM_SOCKET_DIR, os.W_OK):
+        print(f"Unix socket {path} unavailable, falling back to TCP")
+        return None
+    return path
+
+
+def create_http_client(base_url: str = f"http://127.0.0.1:{VLLM_BASE_PORT}", uds: str = None) -> httpx.AsyncClient:
+    """Create the shared keep-alive client used to proxy requests to vLLM
+
+    With ``uds`` connections go to that Unix socket; ``base_url`` then only
+    sets the Host header.
+    """
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        base_url=base_url,
+        limits=limits,
+        # 自定义 transport 时客户端的 limits 不生效，需传给 transport
+        transport=httpx.AsyncHTTPTransport(uds=uds, limits=limits) if uds else None,
+        timeout=httpx.Timeout(
+            connect=UPSTREAM_CONNECT_TIMEOUT,
+            read=UPSTREAM_READ_TIMEOUT,
+            write=UPSTREAM_READ_TIMEOUT,
+            pool=UPSTREAM_POOL_TIMEOUT,
+        ),
+    )
+
+
+def load_warmup_requests() -> list:
+    if not WARMUP_BUDGET or not WARMUP_FILE:
+        return []
+    try:
+        return load_warmup(WARMUP_FILE, MODEL_TYPE == 'multimodal')
+    except (OSError, ValueError) as e:
+        print(f"Warmup disabled: {e}")
+        return []
+
+
+def warmup_replica(client: httpx.AsyncClient, name: str, served_model_name: str):
+    """Coroutine function replaying the warmup set against one vLLM server"""
+    async def send(body: bytes, timeout: float):
+        # 与真实请求相同的预处理（图片缩放、写共享内存），预热的是 vLLM 实际收到的图片尺寸
+        prepared = await prepare(body, False, PRIORITIES["default"])
+        try:
+            return await client.post("/v1/chat/completions", content=prepared.body, headers=JSON_HEADERS,
+                                     timeout=timeout)
+        finally:
+            prepared.release()
+
+    async def warmup():
+        await run_warmup(send, warmup_requests, WARMUP_BUDGET, name, served_model_name)
+    return warmup
+
+
+def timeline_path(suffix: str = None) -> str:
+    if not suffix:
+        return COLD_START_LOG
+    root, ext = os.path.splitext(COLD_START_LOG)
+    return f"{root}.{suffix}{ext}"
+
+
+def create_replica(index: int, port: int = None, gpus=None, timeline: str = COLD_START_LOG, **model) -> Replica:
+    """A supervised vLLM server on ``port`` (default 8000 + index)"""
+    port = port or VLLM_BASE_PORT + index
+    uds = vllm_socket_path(port)
+    cmd, env = build_vllm_command(port, gpus, uds=uds, **model)
+    base_url = f"http://127.0.0.1:{port}"
+    client = create_http_client(base_url, uds)
+    served_model_name = model.get("served_model_name", SERVED_MODEL_NAME)
+    supervisor = StartupSupervisor(
+        cmd, env,
+        health_url=f"{base_url}/health",
+        timeout=VLLM_STARTUP_TIMEOUT,
+        timeline_path=timeline,
+        uds=uds,
+        warmup=warmup_replica(client, served_model_name if MODELS else f"replica {index}", served_model_name)
+        if warmup_requests else None,
+    )
+    return Replica(index, f"unix://{uds}" if uds else base_url, client, supervisor)
+
+
+def create_replica_pool() -> ReplicaPool:
+    """VLLM_REPLICAS data-parallel replicas, each on its own GPUS_PER_REPLICA GPUs"""
+    pinned = VLLM_REPLICAS > 1 or GPUS_PER_REPLICA > 1
+    return ReplicaPool(
+        [create_replica(
+            index,
+            gpus=list(range(index * GPUS_PER_REPLICA, (index + 1) * GPUS_PER_REPLICA)) if pinned else None,
+            timeline=timeline_path(f"replica{index}" if VLLM_REPLICAS > 1 else None),
+        ) for index in range(VLLM_REPLICAS)],
+        restart_delay=REPLICA_RESTART_DELAY,
+        affinity_slack=SESSION_AFFINITY_SLACK,
+    )
+
+
+def create_model_pool(host: ModelHost) -> ReplicaPool:
+    """Single-replica pool for a hosted model in /opt/ml/model/<name>"""
+    replica = create_replica(
+        0, port=host.port, timeline=timeline_path(host.name),
+        model_path=os.path.join(MODEL_DIR, host.name), served_model_name=host.name, gpu_memory=host.gpu_memory,
+    )
+    return ReplicaPool([replica], restart_delay=REPLICA_RESTART_DELAY)
+
+
+def create_model_router() -> ModelRouter:
+    hosts = [ModelHost(name, gpu_memory, VLLM_BASE_PORT + index)
+             for index, (name, gpu_memory) in enumerate(parse_models(MODELS, MODEL_GPU_MEMORY))]
+    return ModelRouter(hosts, create_model_pool, GPU_MEMORY_BUDGET, MODEL_IDLE_TIMEOUT, MODEL_START_WAIT)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    if not start_vllm_server():
-        raise RuntimeError("Failed to start vLLM server")
+    global replicas, model_router, image_store, response_cache, admission, warmup_requests
+    # Startup: vLLM 在后台启动，/ping 在就绪前返回 503
+    warmup_requests = load_warmup_requests()
+    if MODELS:
+        model_router = create_model_router()
+    else:
+        replicas = create_replica_pool()
+    startup_task = asyncio.create_task(start_vllm_server())
+    if MODEL_TYPE == 'multimodal' and IMAGE_STORE_MB > 0:
+        image_store = ImageStore(IMAGE_STORE_DIR, IMAGE_STORE_MB * 1024 * 1024)
+    if RESPONSE_CACHE_MB > 0:
+        response_cache = ResponseCache(RESPONSE_CACHE_MB * 1024 * 1024, RESPONSE_CACHE_TTL)
+    if ADMISSION_MAX_INFLIGHT > 0:
+        admission = AdmissionController(ADMISSION_MAX_INFLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT)
+    registry.add_collector("proxy_image_store", lambda: image_store.stats() if image_store else None)
+    registry.add_collector("proxy_response_cache", lambda: response_cache.stats() if response_cache else None)
+    registry.add_collector("proxy_admission", lambda: admission.stats() if admission else None)
+    registry.add_collector("proxy_replicas", lambda: replicas.stats() if replicas else None)
+    registry.add_collector("proxy_models", lambda: model_router.stats() if model_router else None)
     yield
     # Shutdown
-    if vllm_process:
-        vllm_process.terminate()
+    startup_task.cancel()
+    await upstream().stop()
+    replicas = model_router = None
+    prepare_executor.shutdown(wait=False)
 
 
 app = FastAPI(title="Universal vLLM Inference Server", lifespan=lifespan)
@@ -91,15 +398,698 @@ app = FastAPI(title="Universal vLLM Inference Server", lifespan=lifespan)
 
 @app.get("/ping")
 async def ping():
-    return Response(status_code=200)
+    if upstream() is None:
+        return Response(status_code=503)
+    return Response(
+        content=orjson.dumps(upstream().status()),
+        status_code=200 if upstream().ready else 503,
+        media_type="application/json",
+    )
+
+
+JSON_HEADERS = {"content-type": "application/json"}
+
+
+def parse_json(body: bytes):
+    """Parse a request body with orjson; returns None if it is not valid JSON"""
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None
+
+
+def wants_stream(body: bytes) -> bool:
+    # 快速路径：请求体里没有 "stream" 字段时无需解析 JSON
+    if b'"stream"' not in body:
+        return False
+    data = parse_json(body)
+    return isinstance(data, dict) and bool(data.get("stream"))
+
+
+def iter_image_urls(data: dict):
+    """Yield the image_url dicts of inline data-URL images in a chat request"""
+    for message in data.get("messages") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            image_url = part.get("image_url") if isinstance(part, dict) else None
+            if isinstance(image_url, dict) and str(image_url.get("url", "")).startswith("data:"):
+                yield image_url
+
+
+def rewrite_images(data: dict):
+    """Apply the image store and resolution policy to a parsed chat request in place
+
+    Returns (changed, pinned store keys, (tokens_before, tokens_after) or None).
+    """
+    transform = image_policy.apply if image_policy.enabled else None
+    pinned = []
+    before = after = 0
+    changed = False
+    for image_url in iter_image_urls(data):
+        if image_store is not None:
+            acquired = image_store.acquire(image_url["url"], transform)
+            if acquired is None:
+                continue
+            key, path, info = acquired
+            pinned.append(key)
+            image_url["url"] = f"file://{path}"
+        elif transform is not None:
+            decoded = decode_data_url(image_url["url"])
+            if decoded is None:
+                continue
+            raw, ext, info = transform(decoded[1], decoded[0])
+            image_url["url"] = f"data:image/{ext};base64,{base64.b64encode(raw).decode()}"
+        else:
+            continue
+        changed = True
+        if info:
+            before += info["tokens_before"]
+            after += info["tokens_after"]
+    return changed, pinned, (before, after) if changed and transform else None
+
+
+def custom_attributes(request: Request) -> dict:
+    """Parse SageMaker CustomAttributes ("key=value,key=value") into a dict"""
+    # SageMaker 只透传 CustomAttributes 这一个自定义请求头
+    raw = request.headers.get("x-amzn-sagemaker-custom-attributes", "")
+    pairs = (item.partition("=") for item in raw.replace(";", ",").split(","))
+    return {k.strip().lower(): v.strip().lower() for k, _, v in pairs if k.strip()}
+
+
+def cache_bypassed(request: Request) -> bool:
+    """Per-request cache switch: Cache-Control: no-cache, or CustomAttributes cache=bypass"""
+    if "no-cache" in request.headers.get("cache-control", ""):
+        return True
+    return custom_attributes(request).get("cache") == "bypass"
+
+
+def request_priority(request: Request, default: str = "default") -> int:
+    """Priority class from X-Priority or CustomAttributes priority=interactive|default|batch"""
+    name = request.headers.get("x-priority", "").lower() or custom_attributes(request).get("priority", default)
+    return PRIORITIES.get(name, PRIORITIES[default])
+
+
+def reject_response(e: Rejected) -> Response:
+    return Response(
+        content=orjson.dumps({"error": {"message": e.reason, "type": "overloaded"}}),
+        status_code=e.status_code,
+        media_type="application/json",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+class PreparedRequest:
+    """Result of prepare_request(): the body to forward and what was learned parsing it"""
+
+    __slots__ = ("body", "stream", "pinned", "headers", "cache_key", "priority", "timing", "session", "model",
+                 "deferred")
+
+    def __init__(self, body, stream=None, pinned=(), headers=None, cache_key=None):
+        self.body = body
+        self.stream = stream
+        self.pinned = list(pinned)
+        self.headers = headers or {}
+        self.cache_key = cache_key
+        self.priority = PRIORITIES["default"]
+        self.timing = None
+        self.session = None
+        self.model = None
+        self.deferred = None  # 推迟改写的已解析请求（见 rewrite_request）
+
+    def release(self):
+        """Unpin the stored images once vLLM no longer needs them (idempotent)"""
+        if self.pinned and image_store is not None:
+            image_store.release(self.pinned)
+        self.pinned = []
+
+
+def needs_prepare(body: bytes, use_cache: bool) -> bool:
+    """Whether any stage needs the parsed request, so the body has to be parsed at all"""
+    if HISTORY_MAX_IMAGES or HISTORY_ASSISTANT_TOKENS:
+        return True
+    if model_router is not None and b'"model"' in body:
+        return True
+    if use_cache and b'"temperature"' in body:
+        return True
+    return (image_store is not None or image_policy.enabled) and b'"data:image/' in body
+
+
+def prepare_request(body: bytes, use_cache: bool = False) -> PreparedRequest:
+    """Parse the request once, run the enabled rewrite stages and re-encode it once"""
+    data = parse_json(body)
+    if not isinstance(data, dict):
+        return PreparedRequest(body)
+    prepared = PreparedRequest(body, stream=bool(data.get("stream")))
+    if isinstance(data.get("model"), str):
+        prepared.model = data["model"]
+
+    # 缓存键基于客户端发送的原始请求，在任何改写之前计算
+    if use_cache and is_deterministic(data):
+        prepared.cache_key = cache_key(data)
+        if prepared.cache_key in response_cache and not prepared.stream:
+            # 大概率命中缓存：改写推迟到确实需要转发时（complete 中），期间过期也不会转发未改写的请求体
+            prepared.deferred = data
+            return prepared
+
+    rewrite_request(prepared, data)
+    return prepared
+
+
+def rewrite_request(prepared: PreparedRequest, data: dict):
+    """Run history compaction and image rewriting on the parsed request, re-encoding the body once"""
+    prepared.deferred = None
+    changed = False
+
+    # 先压缩历史，被省略的旧截图无需再解码/缩放
+    if HISTORY_MAX_IMAGES or HISTORY_ASSISTANT_TOKENS:
+        before, after = compact_history(
+            data, HISTORY_MAX_IMAGES, HISTORY_ASSISTANT_TOKENS, HISTORY_IMAGE_TOKENS)
+        prepared.headers["X-Prompt-Tokens-Estimate"] = str(before)
+        prepared.headers["X-Prompt-Tokens-Estimate-Compacted"] = str(after)
+        changed = after != before
+
+    images_changed, prepared.pinned, tokens = rewrite_images(data)
+    if tokens:
+        with stats_lock:
+            image_tokens["before"] += tokens[0]
+            image_tokens["after"] += tokens[1]
+        prepared.headers["X-Image-Tokens-Before"] = str(tokens[0])
+        prepared.headers["X-Image-Tokens-After"] = str(tokens[1])
+
+    if changed or images_changed:
+        prepared.body = orjson.dumps(data)
+
+
+@app.get("/stats")
+async def stats():
+    with stats_lock:
+        tokens = dict(image_tokens, saved=image_tokens["before"] - image_tokens["after"])
+    return {
+        "image_store": image_store.stats() if image_store else None,
+        "image_tokens": tokens,
+        "response_cache": response_cache.stats() if response_cache else None,
+        "admission": admission.stats() if admission else None,
+        "replicas": [r.status() for r in replicas.replicas] if replicas else None,
+        "models": model_router.status()["models"] if model_router else None,
+    }
+
+
+@app.get("/execution-parameters")
+async def execution_parameters():
+    """Defaults SageMaker Batch Transform uses when the transform job does not set them"""
+    # 每个 Transform 请求最多并发 BATCH_CONCURRENCY 条，总数不超过准入上限
+    transforms = max(1, ADMISSION_MAX_INFLIGHT // BATCH_CONCURRENCY) if ADMISSION_MAX_INFLIGHT else 4
+    return {"MaxConcurrentTransforms": transforms, "BatchStrategy": "MULTI_RECORD", "MaxPayloadInMB": 6}
+
+
+def record_usage(usage):
+    if isinstance(usage, dict):
+        prompt_tokens.inc(usage.get("prompt_tokens") or 0)
+        completion_tokens.inc(usage.get("completion_tokens") or 0)
+        return usage
+    return None
+
+
+def record_upstream_error(e: Exception):
+    if isinstance(e, httpx.TimeoutException):
+        upstream_errors.inc(labels=("timeout",))
+    elif isinstance(e, httpx.TransportError):
+        upstream_errors.inc(labels=("transport",))
+    else:
+        upstream_errors.inc(labels=("other",))
+
+
+def finish_request(mode: str, status: int, timing: RequestTiming, body: bytes, response_size: int,
+                   usage=None, cache=None):
+    requests_inflight.dec()
+    requests_total.inc(labels=(mode, str(status)))
+    request_latency.observe(timing.elapsed)
+    response_bytes.observe(response_size)
+    if slow_log.wants(timing):
+        slow_log.write(
+            timing, mode=mode, status=status,
+            prompt_tokens=usage.get("prompt_tokens") if usage else None,
+            completion_tokens=usage.get("completion_tokens") if usage else None,
+            images=body.count(b'"image_url"'),
+            request_bytes=len(body), response_bytes=response_size, cache=cache,
+        )
+
+
+def upstream_error_response(e: Exception) -> Response:
+    return Response(
+        content=orjson.dumps({"error": {"message": f"upstream error: {e!r}", "type": "upstream_error"}}),
+        status_code=502,
+        media_type="application/json",
+    )
+
+
+def model_not_found(e: UnknownModel) -> Response:
+    return Response(
+        content=orjson.dumps({"error": {"message": f"model '{e}' is not hosted", "type": "model_not_found"}}),
+        status_code=404,
+        media_type="application/json",
+    )
+
+
+async def upstream_pool(prepared: PreparedRequest) -> ReplicaPool:
+    """The replicas serving the request's model (starting it if needed)"""
+    if model_router is None:
+        return replicas
+    return await model_router.pool(prepared.model)
+
+
+async def post_upstream(prepared: PreparedRequest, pool: ReplicaPool) -> httpx.Response:
+    replica = pool.acquire(prepared.session)
+    try:
+        timing = prepared.timing
+        if timing is None:
+            return await replica.client.post("/v1/chat/completions", content=prepared.body, headers=JSON_HEADERS)
+        timing.upstream_started()
+        resp = await replica.client.post("/v1/chat/completions", content=prepared.body, headers=JSON_HEADERS,
+                                         extensions=timing.extensions)
+        timing.upstream_finished()
+        return resp
+    finally:
+        pool.release(replica)
+
+
+async def forward(prepared: PreparedRequest):
+    """POST a chat request to vLLM under admission control; returns (status, content_type, content)"""
+    # 先确定目标模型（可能等待其启动），再占用准入名额
+    pool = await upstream_pool(prepared)
+    try:
+        if admission is None:
+            resp = await post_upstream(prepared, pool)
+        else:
+            queued = time.perf_counter()
+            async with admission.slot(prepared.priority):
+                if prepared.timing is not None:
+                    prepared.timing.add("queue", queued)
+                resp = await post_upstream(prepared, pool)
+    except httpx.HTTPError as e:
+        record_upstream_error(e)
+        raise
+    if resp.status_code >= 500:
+        upstream_errors.inc(labels=("status_5xx",))
+    return resp.status_code, resp.headers.get("content-type"), resp.content
+
+
+def parse_batch(body: bytes):
+    """Return the list of chat requests for a batch body (array or {"batch": [...]}), else None"""
+    if body.lstrip()[:1] == b"[":
+        data = parse_json(body)
+        return data if isinstance(data, list) else None
+    if b'"batch"' in body:
+        data = parse_json(body)
+        if isinstance(data, dict) and isinstance(data.get("batch"), list):
+            return data["batch"]
+    return None
+
+
+def parse_jsonl(request: Request, body: bytes):
+    """Return the chat requests of a JSON Lines body (one per non-empty line), else None"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in JSONL_CONTENT_TYPES:
+        return None
+    # 无法解析的行保留为 None，在结果中对应一条 400
+    return [parse_json(line) for line in body.splitlines() if line.strip()]
+
+
+async def prepare(body: bytes, use_cache: bool, priority: int, timing: RequestTiming = None) -> PreparedRequest:
+    started = time.perf_counter()
+    prepared = PreparedRequest(body)
+    if needs_prepare(body, use_cache):
+        # JSON 解析、图片解码/缩放/写共享内存在线程池中执行，不阻塞事件循环
+        prepared = await asyncio.get_running_loop().run_in_executor(
+            prepare_executor, prepare_request, body, use_cache)
+    prepared.priority = priority
+    if prepared.stream is None:
+        prepared.stream = wants_stream(prepared.body)
+    if timing is not None:
+        timing.add("parse", started)
+        prepared.timing = timing
+    return prepared
+
+
+async def complete(prepared: PreparedRequest):
+    """Run a non-streaming request through the response cache (if any) and vLLM
+
+    Returns (status, content_type, content); stored images are released once
+    the upstream call that uses them has finished.
+    """
+    if prepared.cache_key is None:
+        try:
+            return await forward(prepared)
+        finally:
+            prepared.release()
+
+    upstream = False
+
+    def fetch():
+        # 本请求成为实际转发的请求：图片在上游响应后才释放
+        nonlocal upstream
+        upstream = True
+
+        async def run():
+            try:
+                if prepared.deferred is not None:
+                    await asyncio.get_running_loop().run_in_executor(
+                        prepare_executor, rewrite_request, prepared, prepared.deferred)
+                return await forward(prepared)
+            finally:
+                prepared.release()
+        return run()
+
+    try:
+        response, source = await response_cache.get_or_fetch(prepared.cache_key, fetch)
+    finally:
+        if not upstream:
+            prepared.release()
+    prepared.headers["X-Cache"] = source
+    return response
+
+
+@app.get("/metrics")
+async def metrics():
+    """Proxy metrics followed by vLLM's own /metrics (Prometheus text format)"""
+    text = registry.render()
+    if model_router is not None:
+        # 多模型：只抓取正在运行的模型，按 model 标签区分
+        servers = [(f'model="{h.name}"', r) for h in model_router.hosts.values() if h.pool for r in h.pool.replicas]
+    elif replicas is not None:
+        servers = [(f'replica="{r.index}"', r) for r in replicas.replicas]
+    else:
+        servers = []
+    scraped = await asyncio.gather(*(scrape_vllm_metrics(r) for _, r in servers))
+    if model_router is None and len(servers) == 1:
+        text += f"proxy_vllm_metrics_up {int(scraped[0] is not None)}\n"
+        text += scraped[0] or ""
+    else:
+        for (label, _), vllm_text in zip(servers, scraped):
+            text += f"proxy_vllm_metrics_up{{{label}}} {int(vllm_text is not None)}\n"
+        text += merge_metrics([(label, t) for (label, _), t in zip(servers, scraped) if t])
+    return Response(content=text, media_type="text/plain; version=0.0.4")
+
+
+async def scrape_vllm_metrics(replica: Replica):
+    try:
+        resp = await replica.client.get("/metrics", timeout=2)
+    except httpx.HTTPError:
+        return None
+    return resp.text if resp.status_code == 200 else None
+
+
+def merge_metrics(texts) -> str:
+    """Merge per-server Prometheus expositions, adding each server's label (e.g. replica="0") to every sample
+
+    Samples are grouped by metric family (the format requires each family to
+    be contiguous) under a single copy of its HELP/TYPE lines.
+    """
+    families = {}
+    for label, text in texts:
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = families.setdefault(parts[2], ([], []))
+                    if line not in family[0]:
+                        family[0].append(line)
+                continue
+            if family is None:
+                family = families.setdefault(line.split("{")[0].split(" ")[0], ([], []))
+            name, brace, rest = line.partition("{")
+            if brace:
+                separator = "" if rest.startswith("}") else ","
+                family[1].append(f'{name}{{{label}{separator}{rest}')
+            else:
+                name, _, value = line.partition(" ")
+                family[1].append(f'{name}{{{label}}} {value}')
+    lines = []
+    for comments, samples in families.values():
+        lines.extend(comments)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def session_key(request: Request):
+    """Conversation key for replica affinity: X-Session-Id or CustomAttributes session_id="""
+    return request.headers.get("x-session-id") or custom_attributes(request).get("session_id")
+
+
+def request_id(request: Request) -> str:
+    """Caller-supplied X-Request-Id or CustomAttributes request_id=, else a new one"""
+    return (request.headers.get("x-request-id") or custom_attributes(request).get("request_id")
+            or new_request_id())
 
 
 @app.post("/invocations")
 async def invoke(request: Request):
-    data = await request.json()
-    async with httpx.AsyncClient(timeout=300) as client:
-        resp = await client.post("http://127.0.0.1:8000/v1/chat/completions", json=data)
-        return JSONResponse(resp.json())
+    timing = RequestTiming(request_id(request))
+    requests_inflight.inc()
+    # 原样转发请求体字节，只有启用了需要解析的阶段时才解析 JSON
+    body = await request.body()
+    request_bytes.observe(len(body))
+    mode, response, usage = "single", None, None
+    try:
+        mode, response, usage = await handle_invocation(request, body, timing)
+        # SageMaker 只把 CustomAttributes 响应头返回给调用方，请求 ID 同时放在其中便于对照慢请求日志
+        response.headers["X-Request-Id"] = timing.request_id
+        response.headers["X-Amzn-SageMaker-Custom-Attributes"] = f"request_id={timing.request_id}"
+        response.headers["Server-Timing"] = timing.header()
+        return response
+    finally:
+        # 流式响应在输出结束时由 stream_completion 记录
+        if not isinstance(response, StreamingResponse):
+            finish_request(mode, response.status_code if response else 500, timing, body,
+                           len(response.body) if response else 0, usage,
+                           response.headers.get("x-cache") if response else None)
+
+
+async def handle_invocation(request: Request, body: bytes, timing: RequestTiming):
+    """Returns (mode, response, usage) where mode is single, batch or stream"""
+    use_cache = response_cache is not None
+    if use_cache and cache_bypassed(request):
+        response_cache.bypassed += 1
+        use_cache = False
+
+    lines = parse_jsonl(request, body)
+    if lines is not None:
+        # Batch Transform 按 MaxPayloadInMB 打包记录，行数可能超过 BATCH_MAX_ITEMS：分块依次处理
+        priority = request_priority(request, "batch")
+        results = []
+        for start in range(0, len(lines), BATCH_MAX_ITEMS):
+            for result in await invoke_batch(lines[start:start + BATCH_MAX_ITEMS], use_cache, priority):
+                result["index"] += start
+                results.append(result)
+        serialize_started = time.perf_counter()
+        content = b"".join(orjson.dumps(result) + b"\n" for result in results)
+        response = Response(content=content, media_type="application/jsonlines")
+        timing.add("serialize", serialize_started)
+        return "batch", response, batch_usage(results)
+
+    batch = parse_batch(body)
+    if batch is not None:
+        # 批量请求未指定优先级时按 batch 类排队，让交互式请求优先
+        results = await invoke_batch(batch, use_cache, request_priority(request, "batch"))
+        serialize_started = time.perf_counter()
+        content = results if body.lstrip()[:1] == b"[" else {"batch": results}
+        response = Response(content=orjson.dumps(content), media_type="application/json")
+        timing.add("serialize", serialize_started)
+        return "batch", response, batch_usage(results)
+
+    priority = request_priority(request)
+    if admission is not None and admission.saturated(priority):
+        # 在解析请求之前快速拒绝
+        admission.rejected_full += 1
+        return "single", reject_response(Rejected(429, admission.retry_after(), "admission queue full")), None
+
+    try:
+        prepared = await prepare(body, use_cache, priority, timing)
+        prepared.session = session_key(request)
+        if prepared.stream:
+            return "stream", await stream_completion(prepared, body), None
+        status, content_type, content = await complete(prepared)
+    except Rejected as e:
+        return "single", reject_response(e), None
+    except UnknownModel as e:
+        return "single", model_not_found(e), None
+    except httpx.HTTPError as e:
+        return "single", upstream_error_response(e), None
+    serialize_started = time.perf_counter()
+    usage = None
+    if status == 200 and b'"usage"' in content:
+        usage = record_usage((parse_json(content) or {}).get("usage"))
+    response = Response(content=content, status_code=status, media_type=content_type,
+                        headers=prepared.headers)
+    timing.add("serialize", serialize_started)
+    return "single", response, usage
+
+
+def batch_usage(results: list):
+    """Sum the usage of successful batch items"""
+    usage = {"prompt_tokens": 0, "completion_tokens": 0}
+    for result in results:
+        response = result.get("response")
+        item_usage = response.get("usage") if isinstance(response, dict) else None
+        if isinstance(item_usage, dict):
+            usage["prompt_tokens"] += item_usage.get("prompt_tokens") or 0
+            usage["completion_tokens"] += item_usage.get("completion_tokens") or 0
+    return usage
+
+
+async def invoke_batch(items: list, use_cache: bool, priority: int) -> list:
+    """Fan a batch of chat requests out to vLLM concurrently; results keep input order
+
+    Each result is {"index", "status_code", "response"} on success or
+    {"index", "status_code", "error"} on failure, so one bad item does not
+    fail the whole batch.
+    """
+    if len(items) > BATCH_MAX_ITEMS:
+        return [{"index": i, "status_code": 413,
+                 "error": {"message": f"batch exceeds BATCH_MAX_ITEMS={BATCH_MAX_ITEMS}"}}
+                for i in range(len(items))]
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(index: int, item):
+        if not isinstance(item, dict):
+            return {"index": index, "status_code": 400,
+                    "error": {"message": "batch item must be a chat completion request object"}}
+        # 批量请求不支持流式输出
+        item.pop("stream", None)
+        async with semaphore:
+            try:
+                prepared = await prepare(orjson.dumps(item), use_cache, priority)
+                status, _, content = await complete(prepared)
+            except Rejected as e:
+                return {"index": index, "status_code": e.status_code,
+                        "error": {"message": e.reason, "retry_after": e.retry_after}}
+            except UnknownModel as e:
+                return {"index": index, "status_code": 404,
+                        "error": {"message": f"model '{e}' is not hosted", "type": "model_not_found"}}
+            except httpx.HTTPError as e:
+                return {"index": index, "status_code": 502,
+                        "error": {"message": f"upstream error: {e!r}"}}
+        result = parse_json(content)
+        if result is None:
+            result = content.decode("utf-8", errors="replace")
+        if status == 200:
+            record_usage(result.get("usage") if isinstance(result, dict) else None)
+            return {"index": index, "status_code": status, "response": result}
+        return {"index": index, "status_code": status, "error": result}
+
+    return await asyncio.gather(*(run(i, item) for i, item in enumerate(items)))
+
+
+def usage_from_sse(chunk: bytes):
+    """Find the usage object in an SSE chunk (sent when stream_options.include_usage is set)"""
+    for line in chunk.split(b"\n"):
+        if line.startswith(b"data: {") and b'"usage"' in line:
+            data = parse_json(line[len(b"data: "):])
+            if isinstance(data, dict) and data.get("usage"):
+                return data["usage"]
+    return None
+
+
+async def stream_completion(prepared: PreparedRequest, request_body: bytes) -> Response:
+    """Relay vLLM's SSE chunks to the client as they arrive"""
+    headers = prepared.headers
+    timing = prepared.timing
+    try:
+        pool = await upstream_pool(prepared)
+    except BaseException:
+        prepared.release()
+        raise
+    # 准入名额和副本的未完成计数一直占用到流式输出结束
+    if admission is not None:
+        queued = time.perf_counter()
+        try:
+            await admission.acquire(prepared.priority)
+        except BaseException:
+            prepared.release()
+            raise
+        timing.add("queue", queued)
+    admitted = time.monotonic()
+    replica = None
+
+    def done():
+        prepared.release()
+        if replica is not None:
+            pool.release(replica)
+        if admission is not None:
+            admission.release(time.monotonic() - admitted)
+
+    timing.upstream_started()
+    try:
+        replica = pool.acquire(prepared.session)
+        upstream_request = replica.client.build_request(
+            "POST", "/v1/chat/completions", content=prepared.body, headers=JSON_HEADERS,
+            extensions=timing.extensions)
+        resp = await replica.client.send(upstream_request, stream=True)
+    except BaseException as e:
+        if isinstance(e, httpx.HTTPError):
+            record_upstream_error(e)
+        done()
+        raise
+    if resp.status_code != 200:
+        # 上游在开始流式输出前报错：按普通响应返回
+        if resp.status_code >= 500:
+            upstream_errors.inc(labels=("status_5xx",))
+        try:
+            body = await resp.aread()
+        finally:
+            await resp.aclose()
+            done()
+        return Response(content=body, status_code=resp.status_code,
+                        media_type=resp.headers.get("content-type"), headers=headers)
+
+    async def relay():
+        # 逐块转发：下游写完一块才读取下一块（背压）；
+        # 客户端断开时生成器被关闭，finally 关闭上游连接，vLLM 随之中止该请求
+        size = 0
+        usage = None
+        try:
+            async for chunk in resp.aiter_raw():
+                size += len(chunk)
+                if b'"usage"' in chunk:
+                    usage = record_usage(usage_from_sse(chunk)) or usage
+                yield chunk
+        except httpx.HTTPError as e:
+            # 首块之前的错误由调用方返回 502，之后的错误中断流式输出；两者都计入上游错误
+            record_upstream_error(e)
+            raise
+        finally:
+            await resp.aclose()
+            timing.upstream_finished()
+            done()
+            if streaming:
+                finish_request("stream", resp.status_code, timing, request_body, size, usage)
+
+    # 先取首块再返回响应：生成器已启动，即使客户端在发送前断开，finally 也会在回收时执行
+    streaming = False
+    chunks = relay()
+    first_chunk = await anext(chunks, None)
+    if first_chunk is None:
+        # 上游返回 200 但没有内容：relay 已结束且未记录请求，按普通空响应返回，由 invoke 记录
+        return Response(content=b"", status_code=resp.status_code,
+                        media_type=resp.headers.get("content-type"), headers=headers)
+    streaming = True
+    ttft.observe(timing.elapsed)
+
+    async def body():
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(
+        body(),
+        media_type=resp.headers.get("content-type", "text/event-stream"),
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+"""Multi-model hosting: route by the request's model field, lazy start and idle eviction"""
+
+import asyncio
+import time
+
+from admission import Rejected
+
+
+class UnknownModel(LookupError):
+    """Raised when a request names a model this container does not host"""
+
+
+def parse_models(spec: str, default_gpu_memory: float) -> list:
+    """Parse MODELS="name[:gpu_memory],..." into (name, gpu_memory) pairs"""
+    models = []
+    for entry in spec.split(","):
+        name, _, gpu_memory = entry.strip().partition(":")
+        if name:
+            models.append((name, float(gpu_memory) if gpu_memory else default_gpu_memory))
+    return models
+
+
+class ModelHost:
+    """One hosted model: its vLLM pool (None while stopped) and usage bookkeeping"""
+
+    def __init__(self, name: str, gpu_memory: float, port: int):
+        self.name = name
+        self.gpu_memory = gpu_memory
+        self.port = port
+        self.pool = None
+        self.starting = None  # 启动任务（完成后保留，用于判断启动结果）
+        self.last_used = 0.0
+        self.starts = 0
+        self.error = None
+        self.failed_at = None
+
+    @property
+    def state(self) -> str:
+        if self.pool is None:
+            return "failed" if self.error else "stopped"
+        if self.starting is not None and not self.starting.done():
+            return "starting"
+        return "ready" if self.pool.ready else "restarting"
+
+    @property
+    def idle(self) -> bool:
+        return self.pool is not None and all(r.outstanding == 0 for r in self.pool.replicas)
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "gpu_memory": self.gpu_memory,
+            "port": self.port,
+            "starts": self.starts,
+            "idle_s": round(time.monotonic() - self.last_used, 1) if self.last_used else None,
+            "error": self.error,
+            "startup": self.pool.status() if self.pool is not None else None,
+        }
+
+
+class ModelRouter:
+    """Per-model vLLM pools sharing the instance's GPU memory
+
+    The first model is the default (used when a request has no ``model``); it
+    starts with the container and is never evicted. Other models start on
+    their first request and stop after ``idle_timeout`` seconds without
+    traffic. Starting a model whose ``gpu_memory`` fraction would exceed
+    ``memory_budget`` first stops the least recently used idle models.
+    """
+
+    def __init__(self, hosts, create_pool, memory_budget=0.95, idle_timeout=900.0,
+                 start_wait=50.0, retry_after_failure=60.0):
+        self.hosts = {host.name: host for host in hosts}
+        self.default = hosts[0]
+        self.create_pool = create_pool
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.start_wait = start_wait
+        self.retry_after_failure = retry_after_failure
+        self.evictions = 0
+        self._lock = asyncio.Lock()
+        self._reaper = None
+
+    @property
+    def ready(self) -> bool:
+        return self.default.state == "ready"
+
+    async def start(self):
+        """Start the default model; raises StartupError if it does not come up"""
+        self.default.last_used = time.monotonic()
+        self.default.starting = asyncio.create_task(self._start(self.default))
+        await asyncio.shield(self.default.starting)
+        if self.idle_timeout:
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def _start(self, host: ModelHost):
+        async with self._lock:
+            await self._make_room(host)
+            host.pool = self.create_pool(host)
+            host.starts += 1
+            host.error = None
+        try:
+            await host.pool.start()
+        except BaseException as e:
+            pool, host.pool = host.pool, None
+            host.error = str(e) or type(e).__name__
+            host.failed_at = time.monotonic()
+            await pool.stop()
+            raise
+        print(f"[models] {host.name} ready")
+
+    async def _make_room(self, host: ModelHost):
+        used = sum(h.gpu_memory for h in self.hosts.values() if h.pool is not None)
+        candidates = sorted(
+            (h for h in self.hosts.values() if h is not self.default and h.idle and h.state == "ready"),
+            key=lambda h: h.last_used,
+        )
+        while used + host.gpu_memory > self.memory_budget:
+            if not candidates:
+                raise Rejected(503, 30, f"not enough GPU memory to start model {host.name}")
+            victim = candidates.pop(0)
+            used -= victim.gpu_memory
+            await self._evict(victim)
+
+    async def _evict(self, host: ModelHost):
+        pool, host.pool, host.starting = host.pool, None, None
+        self.evictions += 1
+        print(f"[models] stopping {host.name} (idle {time.monotonic() - host.last_used:.0f}s)")
+        await pool.stop()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_timeout / 2))
+            async with self._lock:
+                now = time.monotonic()
+                for host in self.hosts.values():
+                    if (host is not self.default and host.idle and host.state == "ready"
+                            and now - host.last_used > self.idle_timeout):
+                        await self._evict(host)
+
+    async def pool(self, name: str = None):
+        """The ReplicaPool serving ``name``, starting the model if needed
+
+        Waits up to ``start_wait`` seconds for a model that is starting, then
+        sheds the request with 503 so the caller retries instead of timing out.
+        """
+        host = self.default if name is None else self.hosts.get(name)
+        if host is None:
+            raise UnknownModel(name)
+        host.last_used = time.monotonic()
+        if host.pool is None and (host.starting is None or host.starting.done()):
+            if host.failed_at and time.monotonic() - host.failed_at < self.retry_after_failure:
+                raise Rejected(503, round(self.retry_after_failure), f"model {host.name} failed to start: {host.error}")
+            host.starting = asyncio.create_task(self._start(host))
+        if not host.starting.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(host.starting), self.start_wait)
+            except asyncio.TimeoutError:
+                raise Rejected(503, 10, f"model {host.name} is starting") from None
+            except Rejected:
+                raise
+            except Exception:
+                pass  # 启动失败：host.error 已记录
+        if host.pool is None:
+            raise Rejected(503, round(self.retry_after_failure), f"model {host.name} unavailable: {host.error}")
+        return host.pool
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for host in self.hosts.values():
+            if host.starting is not None:
+                host.starting.cancel()
+        await asyncio.gather(*(h.pool.stop() for h in self.hosts.values() if h.pool is not None))
+
+    def status(self) -> dict:
+        return {
+            "state": "ready" if self.ready else "starting",
+            "models": [host.status() for host in self.hosts.values()],
+        }
+
+    def stats(self) -> dict:
+        return {
+            "hosted": len(self.hosts),
+            "running": sum(1 for h in self.hosts.values() if h.pool is not None),
+            "gpu_memory_used": round(sum(h.gpu_memory for h in self.hosts.values() if h.pool is not None), 3),
+            "starts": sum(h.starts for h in self.hosts.values()),
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,155 @@
+"""Data-parallel vLLM replicas: per-replica supervision and least-outstanding routing"""
+
+import asyncio
+import hashlib
+import itertools
+import time
+
+from admission import Rejected
+from supervisor import StartupError
+
+
+class Replica:
+    """One vLLM server with its own HTTP client
+
+    ``supervisor`` is None for a server managed elsewhere (already running),
+    which is then treated as always healthy.
+    """
+
+    def __init__(self, index: int, base_url: str, client, supervisor=None):
+        self.index = index
+        self.base_url = base_url
+        self.client = client
+        self.supervisor = supervisor
+        self.healthy = supervisor is None
+        self.outstanding = 0
+        self.served = 0
+        self.restarts = 0
+
+    def status(self) -> dict:
+        status = {
+            "index": self.index,
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "served": self.served,
+            "restarts": self.restarts,
+        }
+        if self.supervisor is not None:
+            status.update(self.supervisor.status())
+        return status
+
+
+def _affinity_score(session: str, index: int) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{session}:{index}".encode(), digest_size=8).digest(), "big")
+
+
+class ReplicaPool:
+    """Route requests across vLLM replicas and restart replicas that exit
+
+    Requests go to the healthy replica with the fewest outstanding requests.
+    Requests carrying a session key prefer the replica chosen by rendezvous
+    hashing, so a conversation keeps hitting the same prefix cache, unless that
+    replica has more than ``affinity_slack`` requests above the least loaded one.
+    """
+
+    def __init__(self, replicas, restart_delay=5.0, max_restart_delay=60.0, affinity_slack=4):
+        self.replicas = list(replicas)
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.affinity_slack = affinity_slack
+        self.affinity_hits = 0
+        self.affinity_spills = 0
+        self._rotation = itertools.count()
+        self._watchers = []
+
+    @property
+    def ready(self) -> bool:
+        return any(r.healthy for r in self.replicas)
+
+    async def _start(self, replica: Replica):
+        await replica.supervisor.start()
+        replica.healthy = True
+
+    async def start(self):
+        """Start every supervised replica; raises StartupError if one fails to come up"""
+        await asyncio.gather(*(self._start(r) for r in self.replicas if r.supervisor is not None))
+        self._watchers = [asyncio.create_task(self._watch(r)) for r in self.replicas if r.supervisor is not None]
+
+    async def _watch(self, replica: Replica):
+        delay = self.restart_delay
+        while True:
+            up_since = time.monotonic()
+            await replica.supervisor.process.wait()
+            replica.healthy = False
+            print(f"[replicas] replica {replica.index} exited with code "
+                  f"{replica.supervisor.process.returncode}, restarting")
+            # 稳定运行一段时间后再退出，重启延迟复位
+            if time.monotonic() - up_since > self.max_restart_delay:
+                delay = self.restart_delay
+            while True:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_restart_delay)
+                replica.restarts += 1
+                try:
+                    await self._start(replica)
+                    break
+                except StartupError as e:
+                    print(f"[replicas] replica {replica.index} restart failed: {e}")
+                    await replica.supervisor.stop()
+
+    def pick(self, session: str = None):
+        """The replica for a request, or None when no replica is healthy"""
+        ready = [r for r in self.replicas if r.healthy]
+        if not ready:
+            return None
+        # 轮转起点：负载相同的副本之间轮询
+        start = next(self._rotation) % len(ready)
+        least = min(ready[start:] + ready[:start], key=lambda r: r.outstanding)
+        if session is None or len(ready) == 1:
+            return least
+        preferred = max(ready, key=lambda r: _affinity_score(session, r.index))
+        if preferred.outstanding <= least.outstanding + self.affinity_slack:
+            self.affinity_hits += 1
+            return preferred
+        self.affinity_spills += 1
+        return least
+
+    def acquire(self, session: str = None) -> Replica:
+        replica = self.pick(session)
+        if replica is None:
+            raise Rejected(503, max(1, round(self.restart_delay)), "no vLLM replica available")
+        replica.outstanding += 1
+        replica.served += 1
+        return replica
+
+    def release(self, replica: Replica):
+        replica.outstanding -= 1
+
+    async def stop(self):
+        for watcher in self._watchers:
+            watcher.cancel()
+        for replica in self.replicas:
+            replica.healthy = False
+        await asyncio.gather(*(r.supervisor.stop() for r in self.replicas if r.supervisor is not None))
+        for replica in self.replicas:
+            await replica.client.aclose()
+
+    def status(self) -> dict:
+        """/ping body: a single replica reports its startup status directly"""
+        if len(self.replicas) == 1 and self.replicas[0].supervisor is not None:
+            return self.replicas[0].supervisor.status()
+        return {
+            "state": "ready" if self.ready else "starting",
+            "replicas": [r.status() for r in self.replicas],
+        }
+
+    def stats(self) -> dict:
+        return {
+            "replicas": len(self.replicas),
+            "healthy": sum(1 for r in self.replicas if r.healthy),
+            "outstanding": sum(r.outstanding for r in self.replicas),
+            "restarts": sum(r.restarts for r in self.replicas),
+            "affinity_hits": self.affinity_hits,
+            "affinity_spills": self.affinity_spills,
+        }
@@ -0,0 +1,118 @@
+"""Exact-match response cache with in-flight request coalescing"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+import orjson
+
+
+def is_deterministic(data: dict) -> bool:
+    """Only greedy, single-choice, non-streaming requests have reusable responses"""
+    return (
+        data.get("temperature") == 0
+        and data.get("n", 1) == 1
+        and not data.get("stream")
+    )
+
+
+def cache_key(data: dict) -> str:
+    """Canonical hash of a chat request: key order and whitespace do not matter"""
+    return hashlib.blake2b(orjson.dumps(data, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """Memory-bounded LRU/TTL cache of successful upstream responses
+
+    Concurrent requests with the same key share a single upstream call: the
+    first one fetches, the rest wait for its result. The fetch runs as its own
+    task, so a disconnecting client does not cancel it for the others.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, size, response)
+        self.inflight = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def __contains__(self, key) -> bool:
+        # 只读查询，可在预处理线程中调用（不调整 LRU 顺序）
+        return key in self.entries
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[2]
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def _put(self, key, response):
+        size = len(response[2])
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, size, response)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _finish(self, key, task: asyncio.Task):
+        self.inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        response = task.result()
+        if response[0] == 200:
+            self._put(key, response)
+
+    async def get_or_fetch(self, key: str, fetch):
+        """Return (response, source) where source is hit, coalesced or miss
+
+        ``fetch()`` is called synchronously only when this request becomes the
+        one going upstream, and must return an awaitable of
+        (status, content_type, content).
+        """
+        response = self._get(key)
+        if response is not None:
+            self.hits += 1
+            return response, "hit"
+
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), "coalesced"
+
+        self.misses += 1
+        task = asyncio.ensure_future(fetch())
+        self.inflight[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task), "miss"
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "inflight": len(self.inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,178 @@
+"""Async vLLM startup supervisor with phase tracking"""
+
+import asyncio
+import json
+import re
+import sys
+import time
+
+import httpx
+
+# vLLM 启动日志中标志各阶段开始的行（按出现顺序排列，只允许向后推进）
+PHASE_PATTERNS = [
+    ("weights_loading", re.compile(r"Starting to load model|Loading weights|Loading safetensors")),
+    ("memory_profiling", re.compile(r"Model loading took|Memory profiling|Available KV cache memory")),
+    ("cuda_graph_capture", re.compile(r"Capturing (CUDA graphs|cudagraphs)")),
+    ("api_server_startup", re.compile(r"Graph capturing finished|Starting vLLM API server|init engine .* took")),
+]
+
+STREAM_LIMIT = 1024 * 1024
+
+
+class StartupError(RuntimeError):
+    """Raised when the child process exits or never becomes healthy"""
+
+
+class StartupSupervisor:
+    """Launch the vLLM child, tail its output for startup phases and poll /health
+
+    The child can be any command, so a fake process standing in for vLLM can be
+    supervised the same way in tests and benchmarks. ``warmup`` is an optional
+    coroutine function run once /health is up; the server is only reported
+    ready after it returns.
+    """
+
+    def __init__(self, cmd, env=None, health_url="http://127.0.0.1:8000/health",
+                 timeout=600.0, poll_interval=0.5, max_poll_interval=2.0,
+                 timeline_path=None, uds=None, warmup=None):
+        self.cmd = cmd
+        self.env = env
+        self.health_url = health_url
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeline_path = timeline_path
+        self.uds = uds
+        self.warmup = warmup
+        self.process = None
+        self.state = "starting"  # starting, ready, failed
+        self.error = None
+        self.started_at = None
+        self.phases = []
+        self._phase_index = -1
+        self._tail_task = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def _enter_phase(self, name: str):
+        now = time.monotonic()
+        if self.phases:
+            self.phases[-1]["end"] = now
+        self.phases.append({"name": name, "start": now, "end": None})
+        print(f"[startup] phase: {name} (+{now - self.started_at:.1f}s)")
+
+    def _match_phase(self, line: str):
+        for index in range(self._phase_index + 1, len(PHASE_PATTERNS)):
+            name, pattern = PHASE_PATTERNS[index]
+            if pattern.search(line):
+                self._phase_index = index
+                self._enter_phase(name)
+                return
+
+    async def _tail(self, stream: asyncio.StreamReader):
+        # 转发子进程输出到本进程 stdout（CloudWatch 照常收集），同时识别启动阶段
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # 单行超过缓冲上限（如进度条），按块读取
+                line = await stream.read(STREAM_LIMIT)
+            if not line:
+                return
+            text = line.decode("utf-8", errors="replace")
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            if self.state == "starting":
+                self._match_phase(text)
+
+    async def _wait_healthy(self):
+        deadline = self.started_at + self.timeout
+        interval = self.poll_interval
+        exited = asyncio.ensure_future(self.process.wait())
+        try:
+            transport = httpx.AsyncHTTPTransport(uds=self.uds) if self.uds else None
+            async with httpx.AsyncClient(timeout=5, transport=transport) as client:
+                while time.monotonic() < deadline:
+                    try:
+                        resp = await client.get(self.health_url)
+                        if resp.status_code == 200:
+                            return
+                    except httpx.TransportError:
+                        pass
+                    # 子进程退出时立即醒来，而不是等满一个轮询间隔
+                    await asyncio.wait({exited}, timeout=interval)
+                    if exited.done():
+                        raise StartupError(f"vLLM exited with code {self.process.returncode} during startup")
+                    interval = min(interval * 1.5, self.max_poll_interval)
+        finally:
+            exited.cancel()
+        raise StartupError(f"vLLM not healthy after {self.timeout:.0f}s")
+
+    async def start(self):
+        """Spawn the child and return once it is healthy; raises StartupError otherwise"""
+        self.started_at = time.monotonic()
+        self.state = "starting"
+        self.error = None
+        self.phases = []
+        self._phase_index = -1
+        self._enter_phase("process_start")
+        self.process = await asyncio.create_subprocess_exec(
+            *self.cmd, env=self.env, limit=STREAM_LIMIT,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        )
+        self._tail_task = asyncio.create_task(self._tail(self.process.stdout))
+        try:
+            await self._wait_healthy()
+            if self.warmup is not None:
+                self._enter_phase("warmup")
+                try:
+                    await self.warmup()
+                except Exception as e:
+                    # 预热失败不影响启动
+                    print(f"[startup] warmup failed: {e!r}")
+        except BaseException as e:
+            self.state = "failed"
+            self.error = str(e)
+            self.phases[-1]["end"] = time.monotonic()
+            self.write_timeline()
+            raise
+        self._enter_phase("ready")
+        self.phases[-1]["end"] = self.phases[-1]["start"]
+        self.state = "ready"
+        self.write_timeline()
+
+    async def stop(self, grace: float = 30.0):
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), grace)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        if self._tail_task:
+            self._tail_task.cancel()
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "state": self.state,
+            "error": self.error,
+            "elapsed_s": round(now - self.started_at, 2) if self.started_at else 0,
+            "phases": [
+                {
+                    "name": p["name"],
+                    "offset_s": round(p["start"] - self.started_at, 2),
+                    "duration_s": round((p["end"] or now) - p["start"], 2),
+                }
+                for p in self.phases
+            ],
+        }
+
+    def write_timeline(self):
+        timeline = self.status()
+        print(f"[startup] cold-start timeline: {json.dumps(timeline)}")
+        if self.timeline_path:
+            with open(self.timeline_path, "w") as f:
+                json.dump(timeline, f, indent=2)
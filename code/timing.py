@@ -0,0 +1,97 @@
+"""Per-request phase timing, Server-Timing header and sampled slow-request log"""
+
+import os
+import random
+import sys
+import time
+
+import orjson
+
+
+def new_request_id() -> str:
+    return os.urandom(8).hex()
+
+
+class RequestTiming:
+    """Accumulates proxy phase durations for one /invocations request
+
+    Phases: parse (request preparation), queue (admission wait),
+    upstream-connect (connection pool wait + connect, up to sending request
+    headers), upstream-ttfb (request sent to response headers),
+    upstream-total (whole upstream call) and serialize (building the response).
+    """
+
+    __slots__ = ("request_id", "started", "phases", "_upstream_start", "_request_sent")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.phases = {}
+        self._upstream_start = None
+        self._request_sent = None
+
+    def add(self, phase: str, since: float) -> float:
+        """Add the time elapsed since ``since`` (perf_counter) to a phase; returns now"""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - since
+        return now
+
+    def upstream_started(self):
+        self._upstream_start = time.perf_counter()
+
+    def upstream_finished(self):
+        if self._upstream_start is not None:
+            self.add("upstream-total", self._upstream_start)
+
+    async def trace(self, event: str, info: dict):
+        """httpx ``trace`` extension hook (httpcore connection events)"""
+        if event.endswith("send_request_headers.started"):
+            self._request_sent = self.add("upstream-connect", self._upstream_start)
+        elif event.endswith("receive_response_headers.complete") and self._request_sent is not None:
+            self.add("upstream-ttfb", self._request_sent)
+
+    @property
+    def extensions(self) -> dict:
+        return {"trace": self.trace}
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def header(self) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        parts = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in self.phases.items()]
+        parts.append(f"total;dur={self.elapsed * 1000:.1f}")
+        return ", ".join(parts)
+
+
+class SlowLog:
+    """Write requests slower than a threshold as JSON lines (to stdout → CloudWatch)
+
+    ``sample`` is the fraction of slow requests that are logged. With a
+    threshold of 0 the log is off and ``wants`` returns immediately, so the
+    caller never gathers the extra fields.
+    """
+
+    def __init__(self, threshold_ms: float = 0, sample: float = 1.0, stream=None):
+        self.threshold = threshold_ms / 1000
+        self.sample = sample
+        self.stream = stream or sys.stdout
+        self.logged = 0
+
+    def wants(self, timing: RequestTiming) -> bool:
+        if not self.threshold or timing.elapsed < self.threshold:
+            return False
+        return self.sample >= 1 or random.random() < self.sample
+
+    def write(self, timing: RequestTiming, **fields):
+        entry = {
+            "event": "slow_request",
+            "request_id": timing.request_id,
+            "total_ms": round(timing.elapsed * 1000, 1),
+            "phases_ms": {phase: round(seconds * 1000, 1) for phase, seconds in timing.phases.items()},
+            **fields,
+        }
+        self.stream.write(orjson.dumps(entry).decode() + "\n")
+        self.stream.flush()
+        self.logged += 1
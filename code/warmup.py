@@ -0,0 +1,94 @@
+"""Warmup requests replayed against a fresh vLLM server before it takes traffic"""
+
+import base64
+import io
+import json
+import re
+import time
+
+import httpx
+import orjson
+from PIL import Image
+
+# 图片占位符：{"type": "image_url", "image_url": {"url": "warmup:1080x2400"}} 在加载时替换为该分辨率的合成图片
+PLACEHOLDER = re.compile(r"^warmup:(\d+)x(\d+)$")
+
+
+def synthetic_image(width: int, height: int) -> str:
+    """JPEG data URL of a gradient image, so the image processor sees a real screenshot size"""
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def _image_parts(data: dict):
+    for message in data.get("messages") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and isinstance(part.get("image_url"), dict):
+                    yield part["image_url"]
+
+
+def load_warmup(path: str, multimodal: bool) -> list:
+    """(label, request) pairs from a JSONL file of chat requests
+
+    Requests with images are skipped for text-only models.
+    """
+    requests = []
+    images = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            sizes = []
+            for image_url in _image_parts(data):
+                match = PLACEHOLDER.match(image_url.get("url", ""))
+                if match:
+                    size = (int(match.group(1)), int(match.group(2)))
+                    if size not in images:
+                        images[size] = synthetic_image(*size)
+                    image_url["url"] = images[size]
+                    sizes.append(f"{size[0]}x{size[1]}")
+                else:
+                    sizes.append("image")
+            if sizes and not multimodal:
+                continue
+            requests.append(("image " + ",".join(sizes) if sizes else "text", data))
+    return requests
+
+
+async def run_warmup(send, requests: list, budget: float, name: str, model: str = None) -> list:
+    """Send each warmup request in turn until the time budget runs out
+
+    ``send(body, timeout)`` posts one request body and returns the response.
+    Failures are logged and skipped: warmup never blocks the server from
+    becoming ready. Returns the per-request timings.
+    """
+    deadline = time.monotonic() + budget
+    timings = []
+    for index, (label, data) in enumerate(requests):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"[warmup] {name}: budget of {budget:g}s used, skipping {len(requests) - index} requests")
+            break
+        body = dict(data)
+        if model:
+            body["model"] = model
+        body.pop("stream", None)
+        body.setdefault("max_tokens", 16)
+        started = time.monotonic()
+        try:
+            resp = await send(orjson.dumps(body), remaining)
+            status = resp.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        elapsed = time.monotonic() - started
+        timings.append({"request": label, "status": status, "seconds": round(elapsed, 3)})
+        print(f"[warmup] {name}: {label} -> {status} in {elapsed:.2f}s")
+    total = sum(t["seconds"] for t in timings)
+    print(f"[warmup] {name}: {len(timings)}/{len(requests)} requests in {total:.1f}s")
+    return timings
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""多模型部署编排（deploy_multi.sh 的 Python 版本）
+
+读取 model_presets.ini，把所有预设的工作整理成一张任务图并发执行：
+  - MODEL_ID 相同的预设只下载、上传一次（它们的下载过滤参数必须一致）
+  - 同一模型部署到多个区域时，只上传到第一个区域，其他区域的 bucket（sagemaker-{region}-{account}）
+    用 S3 服务端复制（按清单只复制内容变化的文件）
+  - 各区域的镜像检查/构建与模型传输并行，各预设的 Endpoint 部署互相并行
+每个任务仍调用 1_download_model.py / 2_upload_model.py / stream_model_to_s3.py / 3_deploy.py，
+输出 configs/<preset>.json 与 deploy_multi.sh 相同。
+
+用法:
+  python3 deploy_multi.py autoglm autoglm-tokyo
+  python3 deploy_multi.py --dry-run autoglm autoglm-tokyo autoglm-multilingual   # 只打印任务图
+"""
+import argparse
+import configparser
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+# 复用上传脚本的 S3 前缀、清单和传输参数，以及部署脚本的可选容器参数列表
+upload = importlib.import_module('2_upload_model')
+deploy = importlib.import_module('3_deploy')
+
+PRESETS_FILE = os.path.join(REPO_DIR, 'model_presets.ini')
+CONFIGS_DIR = os.path.join(REPO_DIR, 'configs')
+MODELS_DIR = os.path.join(REPO_DIR, 'models')
+# 每个任务在单独的目录中运行（各自的 deploy_vars.json / config.json），互不干扰
+WORK_DIR = os.path.join(CONFIGS_DIR, '.work')
+ECR_REPOSITORY = 'autoglm-vllm-byoc'
+DEFAULT_REGION = 'us-west-2'
+
+print_lock = threading.Lock()
+
+
+def log(message):
+    with print_lock:
+        print(message, flush=True)
+
+
+def load_presets(path, names):
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str
+    parser.read(path, encoding='utf-8')
+    presets = {}
+    for name in names:
+        if not parser.has_section(name):
+            raise SystemExit(f"❌ 预设 '{name}' 不存在于 {path}")
+        presets[name] = dict(parser.items(name))
+        presets[name].setdefault('AWS_REGION', DEFAULT_REGION)
+    return presets
+
+
+def deploy_vars(settings):
+    """deploy_vars.json for one preset (same fields as deploy_multi.sh writes)"""
+    data = {
+        'MODEL_ID': settings['MODEL_ID'],
+        'AWS_REGION': settings['AWS_REGION'],
+        'INSTANCE_TYPE': settings.get('INSTANCE_TYPE', ''),
+        'SERVED_MODEL_NAME': settings.get('SERVED_MODEL_NAME', 'model'),
+        'MAX_MODEL_LEN': settings.get('MAX_MODEL_LEN', '4096'),
+        'DTYPE': settings.get('DTYPE', 'auto'),
+        'MODEL_TYPE': settings.get('MODEL_TYPE', 'text'),
+    }
+    data.update({k: settings[k] for k in deploy.OPTIONAL_ENV_KEYS if settings.get(k)})
+    return data
+
+
+def run_script(stage, command, variables, env=None, cwd=None):
+    """Run a step script in the stage's own work dir, prefixing its output with the stage name"""
+    workdir = cwd or os.path.join(WORK_DIR, stage.replace(':', '_').replace('@', '_'))
+    os.makedirs(workdir, exist_ok=True)
+    if variables is not None:
+        with open(os.path.join(workdir, 'deploy_vars.json'), 'w') as f:
+            json.dump(variables, f, indent=2)
+    process = subprocess.Popen(command, cwd=workdir, env={**os.environ, 'PYTHONUNBUFFERED': '1', **(env or {})},
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in process.stdout:
+        log(f"  [{stage}] {line.rstrip()}")
+    if process.wait() != 0:
+        raise RuntimeError(f"{os.path.basename(command[-1])} 退出码 {process.returncode}")
+    return workdir
+
+
+def python_script(name):
+    return [sys.executable, os.path.join(REPO_DIR, name)]
+
+
+def s3_client(region):
+    return boto3.client('s3', region_name=region, config=Config(
+        max_pool_connections=upload.UPLOAD_WORKERS * upload.UPLOAD_FILE_CONCURRENCY + 4,
+        retries={'max_attempts': 10, 'mode': 'adaptive'},
+    ))
+
+
+def ensure_bucket(client, bucket, region):
+    try:
+        client.head_bucket(Bucket=bucket)
+    except Exception:
+        if region == 'us-east-1':
+            client.create_bucket(Bucket=bucket)
+        else:
+            client.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': region})
+
+
+def copy_model(stage, prefix, account_id, src_region, dst_region):
+    """Server-side copy of a model prefix between regional buckets, skipping files the destination already has"""
+    src_bucket = f"sagemaker-{src_region}-{account_id}"
+    dst_bucket = f"sagemaker-{dst_region}-{account_id}"
+    src_client, dst_client = s3_client(src_region), s3_client(dst_region)
+    ensure_bucket(dst_client, dst_bucket, dst_region)
+
+    manifest = upload.load_remote_manifest(src_client, src_bucket, prefix)
+    if manifest is None:
+        raise RuntimeError(f"s3://{src_bucket}/{prefix}/ 上没有清单 {upload.MANIFEST_NAME}")
+    changed, _ = upload.plan_upload(manifest, upload.load_remote_manifest(dst_client, dst_bucket, prefix),
+                                    upload.list_remote_sizes(dst_client, dst_bucket, prefix))
+    total_bytes = sum(manifest['files'][p]['size'] for p in changed)
+    log(f"  [{stage}] {len(manifest['files']) - len(changed)} 个文件未变化，复制 {len(changed)} 个文件"
+        f"（{total_bytes / 1024**3:.2f} GB）s3://{src_bucket} -> s3://{dst_bucket}")
+
+    transfer_config = TransferConfig(
+        multipart_threshold=upload.UPLOAD_CHUNK_MB * 1024**2,
+        multipart_chunksize=upload.UPLOAD_CHUNK_MB * 1024**2,
+        max_concurrency=upload.UPLOAD_FILE_CONCURRENCY,
+    )
+
+    def copy_one(rel_path):
+        key = f"{prefix}/{rel_path}"
+        # 大文件由 UploadPartCopy 分片复制，数据不经过本机
+        dst_client.copy({'Bucket': src_bucket, 'Key': key}, dst_bucket, key,
+                        SourceClient=src_client, Config=transfer_config)
+
+    with ThreadPoolExecutor(max_workers=upload.UPLOAD_WORKERS) as executor:
+        list(executor.map(copy_one, sorted(changed, key=lambda p: -manifest['files'][p]['size'])))
+    # 所有文件复制成功后才写入目标区域的清单
+    dst_client.put_object(Bucket=dst_bucket, Key=f"{prefix}/{upload.MANIFEST_NAME}",
+                          Body=json.dumps(manifest, indent=2).encode(), ContentType='application/json')
+
+
+class Stage:
+    def __init__(self, name, fn, deps):
+        self.name = name
+        self.fn = fn
+        self.deps = deps
+        self.state = 'pending'
+        self.elapsed = None
+        self.error = None
+
+
+class Pipeline:
+    """Dependency graph of stages; each stage starts as soon as all its dependencies succeeded"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, fn, deps=()):
+        if name not in self.stages:
+            self.stages[name] = Stage(name, fn, [d for d in deps if d])
+        return name
+
+    def print_graph(self):
+        for stage in self.stages.values():
+            print(f"  {stage.name}" + (f"  <- {', '.join(stage.deps)}" if stage.deps else ""))
+
+    def run(self, jobs):
+        total = len(self.stages)
+        finished = 0
+        running = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while True:
+                for stage in self.stages.values():
+                    if stage.state != 'pending':
+                        continue
+                    dep_states = {self.stages[d].state for d in stage.deps}
+                    if dep_states & {'failed', 'skipped'}:
+                        stage.state = 'skipped'
+                        finished += 1
+                        log(f"[{finished}/{total}] ⏭  {stage.name}: 依赖失败，跳过")
+                    elif dep_states <= {'done'}:
+                        stage.state = 'running'
+                        log(f"▶ {stage.name}")
+                        running[executor.submit(self._run_stage, stage)] = stage
+                if not running:
+                    break
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    stage = running.pop(future)
+                    finished += 1
+                    if stage.state == 'done':
+                        log(f"[{finished}/{total}] ✓ {stage.name}（{stage.elapsed:.1f}s）")
+                    else:
+                        log(f"[{finished}/{total}] ❌ {stage.name}（{stage.elapsed:.1f}s）: {stage.error}")
+        return all(stage.state == 'done' for stage in self.stages.values())
+
+    @staticmethod
+    def _run_stage(stage):
+        started = time.monotonic()
+        try:
+            stage.fn(stage.name)
+            stage.state = 'done'
+        except Exception as e:
+            stage.error = str(e) or type(e).__name__
+            stage.state = 'failed'
+        stage.elapsed = time.monotonic() - started
+
+    def summary(self):
+        print("\n==========================================")
+        print("任务耗时")
+        print("==========================================")
+        width = max(len(name) for name in self.stages)
+        for stage in self.stages.values():
+            elapsed = f"{stage.elapsed:7.1f}s" if stage.elapsed is not None else "      -"
+            print(f"  {stage.name:<{width}}  {stage.state:<8} {elapsed}")
+
+
+def build_pipeline(presets, account_id, transfer_mode):
+    """Stages: model transfer (once per model), cross-region copies, image per region, deploy per preset"""
+    pipeline = Pipeline()
+    os.makedirs(CONFIGS_DIR, exist_ok=True)
+
+    # 按模型分组：同一 MODEL_ID 的预设共用一份模型文件（S3 前缀只由 MODEL_ID 决定），
+    # 因此它们的下载过滤参数必须一致，否则各自的上传会互相覆盖清单
+    models = {}
+    for preset, settings in presets.items():
+        models.setdefault(settings['MODEL_ID'], []).append(preset)
+    for model_id, model_presets in models.items():
+        filters = {(presets[p].get('DOWNLOAD_INCLUDE', ''), presets[p].get('DOWNLOAD_EXCLUDE', ''))
+                   for p in model_presets}
+        if len(filters) > 1:
+            raise SystemExit(f"❌ 预设 {', '.join(model_presets)} 使用同一模型 {model_id}，"
+                             f"但 DOWNLOAD_INCLUDE / DOWNLOAD_EXCLUDE 不同（共用 S3 前缀 {upload.s3_prefix(model_id)}）")
+
+    model_ready = {}  # (preset) -> 模型在该预设所在区域就绪的任务
+    for model_id, model_presets in models.items():
+        first = model_presets[0]
+        settings = presets[first]
+        prefix = upload.s3_prefix(model_id)
+        label = prefix.split('/')[-1]
+        home = settings['AWS_REGION']
+        variables = deploy_vars(settings)
+        download_env = {k: settings[k] for k in ('DOWNLOAD_INCLUDE', 'DOWNLOAD_EXCLUDE', 'DOWNLOAD_WORKERS')
+                        if settings.get(k)}
+
+        if settings.get('TRANSFER_MODE', transfer_mode) == 'stream':
+            uploaded = pipeline.add(f"transfer:{label}@{home}", lambda stage, v=variables, e=download_env, p=first: run_script(
+                stage, python_script('stream_model_to_s3.py'), v,
+                {**e, 'STREAM_STATE': os.path.join(CONFIGS_DIR, f"{p}.stream.json")}))
+        else:
+            model_dir = os.path.join(MODELS_DIR, first)
+            download_info = os.path.join(CONFIGS_DIR, f"{first}.download.json")
+
+            def download_model(stage, v=variables, e=download_env, model_dir=model_dir, download_info=download_info):
+                if os.path.exists(download_info):
+                    with open(download_info) as f:
+                        if json.load(f).get('status') == 'completed':
+                            log(f"  [{stage}] 模型已存在，跳过下载: {model_dir}")
+                            return
+                os.makedirs(model_dir, exist_ok=True)
+                run_script(stage, python_script('1_download_model.py'), v,
+                           {**e, 'LOCAL_DIR': model_dir, 'DOWNLOAD_INFO': download_info})
+
+            downloaded = pipeline.add(f"download:{label}", download_model)
+            uploaded = pipeline.add(f"upload:{label}@{home}", lambda stage, v=variables, d=model_dir: run_script(
+                stage, python_script('2_upload_model.py'), v, {'LOCAL_MODEL_DIR': d}), [downloaded])
+
+        for preset in model_presets:
+            region = presets[preset]['AWS_REGION']
+            if region == home:
+                model_ready[preset] = uploaded
+            else:
+                model_ready[preset] = pipeline.add(
+                    f"copy:{label}@{region}",
+                    lambda stage, p=prefix, r=region, h=home: copy_model(stage, p, account_id, h, r),
+                    [uploaded])
+
+    image_lock = threading.Lock()
+
+    def ensure_image(stage, region):
+        ecr = boto3.client('ecr', region_name=region)
+        try:
+            ecr.describe_images(repositoryName=ECR_REPOSITORY, imageIds=[{'imageTag': 'latest'}])
+            log(f"  [{stage}] 镜像已存在: {account_id}.dkr.ecr.{region}.amazonaws.com/{ECR_REPOSITORY}:latest")
+            return
+        except Exception:
+            pass
+        # 同一台机器上的 docker 构建串行执行（后续区域复用构建缓存）
+        with image_lock:
+            run_script(stage, ['bash', os.path.join(REPO_DIR, '0_build_and_push.sh')], None,
+                       {'AWS_REGION': region}, cwd=REPO_DIR)
+
+    def deploy_preset(stage, preset):
+        settings = presets[preset]
+        config_file = os.path.join(CONFIGS_DIR, f"{preset}.json")
+        # configs/<preset>.json：与 deploy_multi.sh 相同的字段；保留已有的 endpoint_name，3_deploy.py 据此原地更新
+        previous = {}
+        if os.path.exists(config_file):
+            with open(config_file) as f:
+                previous = json.load(f)
+        with open(config_file, 'w') as f:
+            json.dump({
+                **previous,
+                "model_data_url": f"s3://sagemaker-{settings['AWS_REGION']}-{account_id}/{upload.s3_prefix(settings['MODEL_ID'])}/",
+                "compression": "None",
+                "region": settings['AWS_REGION'],
+                "preset": preset,
+                "model_id": settings['MODEL_ID'],
+            }, f, indent=2)
+        # SageMaker 资源名只允许字母、数字和连字符
+        name = re.sub(r'[^a-zA-Z0-9]+', '-', preset).strip('-')[:40]
+        run_script(stage, python_script('3_deploy.py'), deploy_vars(settings),
+                   {'CONFIG_JSON': config_file, 'DEPLOY_NAME': name})
+
+    for preset, settings in presets.items():
+        image = pipeline.add(f"image@{settings['AWS_REGION']}",
+                             lambda stage, r=settings['AWS_REGION']: ensure_image(stage, r))
+        pipeline.add(f"deploy:{preset}", lambda stage, p=preset: deploy_preset(stage, p), [model_ready[preset], image])
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多模型并行部署（任务图编排）')
+    parser.add_argument('presets', nargs='+', help='model_presets.ini 中的预设名')
+    parser.add_argument('--jobs', type=int, default=8, help='同时执行的任务数')
+    parser.add_argument('--transfer-mode', choices=['local', 'stream'], default=os.environ.get('TRANSFER_MODE', 'local'),
+                        help='模型传输方式（预设中的 TRANSFER_MODE 优先）')
+    parser.add_argument('--dry-run', action='store_true', help='只打印任务图，不执行')
+    args = parser.parse_args()
+
+    presets = load_presets(PRESETS_FILE, list(dict.fromkeys(args.presets)))
+    account_id = 'ACCOUNT' if args.dry_run else boto3.client('sts').get_caller_identity()['Account']
+    pipeline = build_pipeline(presets, account_id, args.transfer_mode)
+    print(f"准备部署 {len(presets)} 个预设，共 {len(pipeline.stages)} 个任务:")
+    pipeline.print_graph()
+    if args.dry_run:
+        return
+    print()
+
+    started = time.monotonic()
+    ok = pipeline.run(args.jobs)
+    pipeline.summary()
+    print(f"\n总耗时: {time.monotonic() - started:.1f}s")
+    for preset in presets:
+        stage = pipeline.stages[f"deploy:{preset}"]
+        if stage.state == 'done':
+            with open(os.path.join(CONFIGS_DIR, f"{preset}.json")) as f:
+                print(f"✅ {preset}: {json.load(f).get('endpoint_name')}")
+        else:
+            print(f"❌ {preset}: {stage.error or '依赖任务失败'}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,22 @@ PRESETS_FILE="model_presets.ini"
 CONFIGS_DIR="configs"
 MODELS_DIR="models"
 
+# 预设中可选的容器参数，配置了才写入 deploy_vars.json（列表只在 3_deploy.py 中维护，这里静态解析，不执行该脚本）
+OPTIONAL_ENV_KEYS=$(python3 -c '
+import ast
+for node in ast.parse(open("3_deploy.py").read()).body:
+    if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", None) == "OPTIONAL_ENV_KEYS":
+        print(" ".join(ast.literal_eval(node.value)))
+')
+if [ -z "$OPTIONAL_ENV_KEYS" ]; then
+    echo "无法从 3_deploy.py 读取 OPTIONAL_ENV_KEYS" >&2
+    exit 1
+fi
+# 预设中的下载参数（只用于 1_download_model.py，不传入容器）
+DOWNLOAD_ENV_KEYS="DOWNLOAD_INCLUDE DOWNLOAD_EXCLUDE DOWNLOAD_WORKERS TRANSFER_MODE"
+# 模型传输方式：local（下载到本地再上传）或 stream（从 HuggingFace 直接流式传到 S3），预设中的 TRANSFER_MODE 优先
+DEFAULT_TRANSFER_MODE="${TRANSFER_MODE:-local}"
+
 # 创建必要目录
 mkdir -p $CONFIGS_DIR $MODELS_DIR
 
@@ -60,6 +76,8 @@ list_deployed() {
     fi
     
     for config_file in $CONFIGS_DIR/*.json; do
+        # 跳过下载 / 流式传输的进度文件
+        case "$config_file" in *.download.json|*.stream.json) continue ;; esac
         if [ -f "$config_file" ]; then
             preset=$(basename "$config_file" .json)
             endpoint=$(jq -r '.endpoint_name // "N/A"' "$config_file")
@@ -117,7 +135,8 @@ deploy_model() {
         return 1
     fi
     
-    # 导出环境变量
+    # 导出环境变量（先清除上一个预设的可选参数）
+    unset $OPTIONAL_ENV_KEYS $DOWNLOAD_ENV_KEYS
     set -a
     source "$config_file"
     set +a
@@ -135,42 +154,66 @@ deploy_model() {
 }
 EOF
     
+    for key in $OPTIONAL_ENV_KEYS; do
+        if [ -n "${!key}" ]; then
+            jq --arg k "$key" --arg v "${!key}" '. + {($k): $v}' deploy_vars.json > deploy_vars.json.tmp
+            mv deploy_vars.json.tmp deploy_vars.json
+        fi
+    done
+    
     log_info "模型ID: $MODEL_ID"
     log_info "区域: ${AWS_REGION:-us-west-2}"
     log_info "实例类型: $INSTANCE_TYPE"
     log_info "模型目录: $MODEL_DIR"
     
-    # 1. 下载模型
-    if [ -d "$MODEL_DIR" ] && [ "$(ls -A $MODEL_DIR)" ]; then
-        log_warn "模型已存在，跳过下载: $MODEL_DIR"
+    # 1-2. 流式传输：不落本地磁盘，中断后重新运行续传未完成的分片
+    if [ "${TRANSFER_MODE:-$DEFAULT_TRANSFER_MODE}" = "stream" ]; then
+        log_info "[1-2/3] 从 HuggingFace 流式传输模型到 S3..."
+        STREAM_STATE="$CONFIGS_DIR/${preset}.stream.json" python3 stream_model_to_s3.py
+        
+        if [ $? -ne 0 ]; then
+            log_error "模型传输失败"
+            return 1
+        fi
     else
-        log_info "[1/3] 下载模型..."
-        mkdir -p "$MODEL_DIR"
+        # 1. 下载模型（上次下载未完成时重新运行，续传未完成的文件）
+        local download_info="$CONFIGS_DIR/${preset}.download.json"
+        if [ -f "$download_info" ] && [ "$(jq -r '.status' "$download_info")" = "completed" ]; then
+            log_warn "模型已存在，跳过下载: $MODEL_DIR"
+        else
+            log_info "[1/3] 下载模型..."
+            mkdir -p "$MODEL_DIR"
+            
+            # 临时修改 1_download_model.py 的输出目录
+            LOCAL_DIR="$MODEL_DIR" DOWNLOAD_INFO="$download_info" python3 1_download_model.py
+            
+            if [ $? -ne 0 ]; then
+                log_error "模型下载失败"
+                return 1
+            fi
+            log_success "模型下载完成"
+        fi
         
-        # 临时修改 1_download_model.py 的输出目录
-        LOCAL_DIR="$MODEL_DIR" python3 1_download_model.py
+        # 2. 上传到 S3
+        log_info "[2/3] 上传模型到 S3..."
+        LOCAL_MODEL_DIR="$MODEL_DIR" python3 2_upload_model.py
         
         if [ $? -ne 0 ]; then
-            log_error "模型下载失败"
+            log_error "模型上传失败"
             return 1
         fi
-        log_success "模型下载完成"
-    fi
-    
-    # 2. 上传到 S3
-    log_info "[2/3] 上传模型到 S3..."
-    LOCAL_MODEL_DIR="$MODEL_DIR" python3 2_upload_model.py
-    
-    if [ $? -ne 0 ]; then
-        log_error "模型上传失败"
-        return 1
     fi
     
     # 移动 config.json 到 configs 目录
     if [ -f "config.json" ]; then
+        # 保留已部署的 Endpoint 名称，3_deploy.py 据此原地更新
+        local previous_endpoint=""
+        if [ -f "$CONFIG_FILE" ]; then
+            previous_endpoint=$(jq -r '.endpoint_name // empty' "$CONFIG_FILE")
+        fi
         mv config.json "$CONFIG_FILE"
         # 添加模型信息
-        jq ". + {\"preset\": \"$preset\", \"model_id\": \"$MODEL_ID\"}" "$CONFIG_FILE" > "$CONFIG_FILE.tmp"
+        jq --arg e "$previous_endpoint" ". + {\"preset\": \"$preset\", \"model_id\": \"$MODEL_ID\"} + (if \$e != \"\" then {endpoint_name: \$e} else {} end)" "$CONFIG_FILE" > "$CONFIG_FILE.tmp"
         mv "$CONFIG_FILE.tmp" "$CONFIG_FILE"
         log_success "配置已保存: $CONFIG_FILE"
     fi
@@ -195,7 +238,8 @@ EOF
     
     # 3. 部署 Endpoint
     log_info "[3/3] 部署 SageMaker Endpoint..."
-    CONFIG_JSON="$CONFIG_FILE" python3 3_deploy.py
+    # 资源名以预设名开头（SageMaker 名称只允许字母、数字和连字符）
+    CONFIG_JSON="$CONFIG_FILE" DEPLOY_NAME=$(echo "$preset" | tr -c 'a-zA-Z0-9\n' '-') python3 3_deploy.py
     
     if [ $? -ne 0 ]; then
         log_error "Endpoint 部署失败"
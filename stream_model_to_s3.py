@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""从 HuggingFace 直接流式传输模型到 S3（不落本地磁盘，代替 1_download_model.py + 2_upload_model.py）
+
+每个文件按分片用 HTTP Range 从 Hub 读取，逐片写入 S3 分段上传，多个文件同时传输；内存占用上限为
+UPLOAD_WORKERS x UPLOAD_FILE_CONCURRENCY 个分片。每个分片带 sha256 校验和，由 S3 在接收时校验。
+未完成的分段上传记录在 STREAM_STATE 中，中断后重新运行只传缺少的分片。
+文件选择（DOWNLOAD_INCLUDE / DOWNLOAD_EXCLUDE）、S3 前缀、清单和 config.json 与两步流程相同。
+"""
+import os
+import json
+import base64
+import hashlib
+import importlib
+import threading
+import time
+import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from huggingface_hub import HfApi, hf_hub_url, get_session
+from huggingface_hub.utils import build_hf_headers
+
+# 复用两步流程的文件选择、S3 前缀、清单格式和传输参数
+download = importlib.import_module('1_download_model')
+upload = importlib.import_module('2_upload_model')
+
+REGION = upload.REGION
+MODEL_ID = upload.MODEL_ID
+S3_PREFIX = upload.S3_PREFIX
+PART_SIZE = upload.UPLOAD_CHUNK_MB * 1024**2
+STREAM_STATE = os.environ.get('STREAM_STATE', 'stream_transfer_state.json')
+PART_RETRIES = 3
+
+
+class TransferState:
+    """In-progress multipart uploads (rel_path -> upload id and part checksums), rewritten atomically on every change"""
+
+    def __init__(self, path, bucket):
+        self.path = path
+        self._lock = threading.Lock()
+        self.uploads = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('bucket') == bucket and state.get('prefix') == S3_PREFIX:
+                self.uploads = state.get('uploads', {})
+        self.bucket = bucket
+
+    def get(self, rel_path, sha256):
+        """(upload_id, {part_number: checksum}) of a resumable upload of this content, else (None, {})"""
+        entry = self.uploads.get(rel_path)
+        if entry and entry['sha256'] == sha256 and entry['part_size'] == PART_SIZE:
+            return entry['upload_id'], {int(n): c for n, c in entry['parts'].items()}
+        return None, {}
+
+    def set(self, rel_path, sha256, upload_id):
+        with self._lock:
+            self.uploads[rel_path] = {'upload_id': upload_id, 'sha256': sha256, 'part_size': PART_SIZE, 'parts': {}}
+            self._write()
+
+    def part_done(self, rel_path, number, checksum):
+        with self._lock:
+            self.uploads[rel_path]['parts'][str(number)] = checksum
+            self._write()
+
+    def remove(self, rel_path):
+        with self._lock:
+            self.uploads.pop(rel_path, None)
+            self._write()
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'bucket': self.bucket, 'prefix': S3_PREFIX, 'uploads': self.uploads}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def part_ranges(size):
+    """[(part_number, start, end_inclusive), ...] covering a file of ``size`` bytes"""
+    return [(index + 1, start, min(start + PART_SIZE, size) - 1)
+            for index, start in enumerate(range(0, size, PART_SIZE))]
+
+
+def fetch_range(session, url, start, end):
+    """Bytes [start, end] of a hub file, retried on connection errors and truncated bodies"""
+    headers = {**build_hf_headers(), 'Range': f'bytes={start}-{end}'}
+    for attempt in range(1, PART_RETRIES + 1):
+        try:
+            response = session.get(url, headers=headers, follow_redirects=True, timeout=120)
+            response.raise_for_status()
+            data = response.content
+            if len(data) == end - start + 1:
+                return data
+            error = f"expected {end - start + 1} bytes, got {len(data)} (HTTP {response.status_code})"
+        except Exception as e:
+            if attempt == PART_RETRIES or getattr(getattr(e, 'response', None), 'status_code', 500) < 500:
+                raise
+            error = str(e)
+        print(f"  ⚠️  重试 {url} [{start}-{end}]（{attempt}/{PART_RETRIES}）: {error}")
+        time.sleep(2 ** attempt)
+    raise IOError(f"{url} [{start}-{end}]: {error}")
+
+
+def sha256_b64(data):
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+def list_uploaded_parts(s3_client, bucket, key, upload_id):
+    """part_number -> part info for a multipart upload, or None when it no longer exists"""
+    parts = {}
+    try:
+        paginator = s3_client.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+            for part in page.get('Parts', []):
+                parts[part['PartNumber']] = part
+    except s3_client.exceptions.NoSuchUpload:
+        return None
+    return parts
+
+
+def stream_small(s3_client, session, bucket, repo, rel_path, size, progress):
+    """Files up to one part: a single GET and PutObject; returns the file's sha256"""
+    url = hf_hub_url(MODEL_ID, rel_path, revision=repo.sha)
+    data = fetch_range(session, url, 0, size - 1) if size else b''
+    digest = hashlib.sha256(data)
+    s3_client.put_object(Bucket=bucket, Key=f"{S3_PREFIX}/{rel_path}", Body=data,
+                         ChecksumSHA256=base64.b64encode(digest.digest()).decode())
+    progress.add_bytes(size)
+    return digest.hexdigest()
+
+
+def stream_multipart(s3_client, session, bucket, repo, rel_path, size, sha256, state, progress, part_pool):
+    """Copy one large file part by part, skipping parts already in an unfinished upload"""
+    key = f"{S3_PREFIX}/{rel_path}"
+    url = hf_hub_url(MODEL_ID, rel_path, revision=repo.sha)
+    ranges = part_ranges(size)
+
+    upload_id, checksums = state.get(rel_path, sha256)
+    done = list_uploaded_parts(s3_client, bucket, key, upload_id) if upload_id else None
+    if done is None:
+        upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, ChecksumAlgorithm='SHA256')['UploadId']
+        state.set(rel_path, sha256, upload_id)
+        done = {}
+    # 只保留大小正确、校验和已知的分片，其余重新上传
+    for number, part in done.items():
+        part.setdefault('ChecksumSHA256', checksums.get(number))
+    done = {n: p for n, p in done.items()
+            if n <= len(ranges) and p['Size'] == ranges[n - 1][2] - ranges[n - 1][1] + 1 and p['ChecksumSHA256']}
+    if done:
+        resumed = sum(p['Size'] for p in done.values())
+        print(f"  ↻ {rel_path}: 续传，已有 {len(done)}/{len(ranges)} 个分片")
+        progress.add_bytes(resumed)
+
+    def copy_part(part):
+        number, start, end = part
+        data = fetch_range(session, url, start, end)
+        checksum = sha256_b64(data)
+        response = s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number,
+                                         Body=data, ChecksumAlgorithm='SHA256', ChecksumSHA256=checksum)
+        state.part_done(rel_path, number, checksum)
+        progress.add_bytes(len(data))
+        return {'PartNumber': number, 'ETag': response['ETag'], 'ChecksumSHA256': checksum}
+
+    pending = [r for r in ranges if r[0] not in done]
+    parts = [{'PartNumber': n, 'ETag': p['ETag'], 'ChecksumSHA256': p['ChecksumSHA256']} for n, p in done.items()]
+    parts += list(part_pool.map(copy_part, pending))
+    s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                        MultipartUpload={'Parts': sorted(parts, key=lambda p: p['PartNumber'])})
+    state.remove(rel_path)
+
+
+def main():
+    sts = boto3.client('sts', region_name=REGION)
+    account_id = sts.get_caller_identity()['Account']
+    bucket = f"sagemaker-{REGION}-{account_id}"
+    s3_client = boto3.client('s3', region_name=REGION, config=Config(
+        max_pool_connections=upload.UPLOAD_WORKERS * upload.UPLOAD_FILE_CONCURRENCY + 4,
+        retries={'max_attempts': 10, 'mode': 'adaptive'},
+    ))
+    try:
+        s3_client.head_bucket(Bucket=bucket)
+    except Exception:
+        print(f"创建 S3 bucket: {bucket}")
+        if REGION == 'us-east-1':
+            s3_client.create_bucket(Bucket=bucket)
+        else:
+            s3_client.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': REGION})
+
+    print(f"📦 模型: {MODEL_ID} -> s3://{bucket}/{S3_PREFIX}/")
+    repo = HfApi().model_info(MODEL_ID, files_metadata=True)
+    siblings = {s.rfilename: s for s in repo.siblings}
+    selected, skipped = download.select_files(list(siblings))
+    sizes = {f: siblings[f].size or 0 for f in selected}
+    # LFS 文件的 sha256 由 Hub 提供；小文件传输时计算
+    hub_sha256 = {f: siblings[f].lfs.sha256 for f in selected if siblings[f].lfs}
+    print(f"文件: {len(selected)} 个（{sum(sizes.values()) / 1024**3:.1f} GB），跳过 {len(skipped)} 个")
+
+    remote_manifest = upload.load_remote_manifest(s3_client, bucket)
+    remote_files = (remote_manifest or {}).get('files', {})
+    remote_sizes = upload.list_remote_sizes(s3_client, bucket)
+    manifest = {'version': 1, 'model_id': MODEL_ID, 'revision': repo.sha, 'files': {}}
+    changed = []
+    for rel_path in selected:
+        sha256 = hub_sha256.get(rel_path)
+        if sha256 and remote_sizes.get(rel_path) == sizes[rel_path] and remote_files.get(rel_path, {}).get('sha256') == sha256:
+            manifest['files'][rel_path] = {'size': sizes[rel_path], 'sha256': sha256}
+        else:
+            changed.append(rel_path)
+    print(f"✓ {len(selected) - len(changed)} 个文件未变化，{len(changed)} 个文件需要传输")
+
+    workers, per_file = upload.UPLOAD_WORKERS, upload.UPLOAD_FILE_CONCURRENCY
+    print(f"⏳ 并行 {workers} 个文件 x {per_file} 个分片，分片 {upload.UPLOAD_CHUNK_MB} MB"
+          f"（缓冲上限 {workers * per_file * upload.UPLOAD_CHUNK_MB} MB）")
+    state = TransferState(STREAM_STATE, bucket)
+    progress = upload.Progress(sum(sizes[f] for f in changed), len(changed))
+    session = get_session()
+    lock = threading.Lock()
+
+    def transfer(rel_path):
+        size = sizes[rel_path]
+        sha256 = hub_sha256.get(rel_path)
+        try:
+            # 非 LFS 文件（配置、tokenizer 等）都很小，整体传输并计算 sha256
+            if size <= PART_SIZE or not sha256:
+                sha256 = stream_small(s3_client, session, bucket, repo, rel_path, size, progress)
+            else:
+                with ThreadPoolExecutor(max_workers=per_file) as part_pool:
+                    stream_multipart(s3_client, session, bucket, repo, rel_path, size, sha256, state, progress, part_pool)
+        except Exception as e:
+            print(f"\n❌ 传输失败: {rel_path}\n错误: {e}")
+            raise
+        progress.file_done()
+        with lock:
+            manifest['files'][rel_path] = {'size': size, 'sha256': sha256}
+
+    # 大文件在前：尽早开始最长的传输
+    ordered = sorted(changed, key=lambda f: -sizes[f])
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(transfer, ordered))
+    if changed:
+        print(progress.summary())
+
+    stale = sorted(p for p in remote_sizes if p not in manifest['files'] and p != upload.MANIFEST_NAME)
+    if stale:
+        if upload.UPLOAD_PRUNE:
+            for rel_path in stale:
+                s3_client.delete_object(Bucket=bucket, Key=f"{S3_PREFIX}/{rel_path}")
+            print(f"🗑  已删除 S3 上不属于该模型的 {len(stale)} 个文件")
+        else:
+            print(f"⚠️  S3 上有 {len(stale)} 个不属于该模型的文件（SageMaker 会一并下载），设置 UPLOAD_PRUNE=1 删除")
+
+    # 所有文件传输成功后才更新 S3 上的清单
+    manifest['files'] = dict(sorted(manifest['files'].items()))
+    s3_client.put_object(Bucket=bucket, Key=f"{S3_PREFIX}/{upload.MANIFEST_NAME}",
+                         Body=json.dumps(manifest, indent=2).encode(), ContentType='application/json')
+
+    model_data_url = f"s3://{bucket}/{S3_PREFIX}/"
+    config = {
+        "model_data_url": model_data_url,
+        "compression": "None",
+        "region": REGION
+    }
+    with open("config.json", "w") as f:
+        json.dump(config, f, indent=2)
+
+    print(f"\n✅ 完成: {model_data_url}")
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,13 @@ import sys
 import argparse
 import base64
 import os
+import time
 
 # 解析命令行参数
 parser = argparse.ArgumentParser(description='测试 SageMaker Endpoint')
 parser.add_argument('--config', default='config.json', help='配置文件路径 (默认: config.json)')
 parser.add_argument('--image', default='test/macos-desktop.jpg', help='测试图片路径')
+parser.add_argument('--stream', action='store_true', help='使用 invoke_endpoint_with_response_stream 流式输出')
 parser.add_argument('prompt', nargs='?', default='打开微信', help='测试提示词')
 args = parser.parse_args()
 
@@ -34,7 +36,37 @@ PRESET = config.get('preset', 'unknown')
 MODEL_ID = config.get('model_id', 'unknown')
 SERVED_MODEL_NAME = config.get('served_model_name', 'autoglm-phone-9b')
 
-def test_endpoint(prompt, image_path=None):
+def stream_endpoint(client, payload):
+    """流式调用：逐个打印 SSE 增量，并统计首 token 延迟"""
+    payload = dict(payload, stream=True)
+    start = time.perf_counter()
+    ttft = None
+    response = client.invoke_endpoint_with_response_stream(
+        EndpointName=ENDPOINT_NAME,
+        ContentType='application/json',
+        Body=json.dumps(payload)
+    )
+    
+    print("✅ 模型回复:")
+    buffer = b''
+    for event in response['Body']:
+        buffer += event.get('PayloadPart', {}).get('Bytes', b'')
+        while b'\n\n' in buffer:
+            line, buffer = buffer.split(b'\n\n', 1)
+            line = line.decode('utf-8').strip()
+            if not line.startswith('data:') or line == 'data: [DONE]':
+                continue
+            choices = json.loads(line[len('data:'):]).get('choices') or [{}]
+            delta = choices[0].get('delta', {})
+            if delta.get('content'):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                print(delta['content'], end='', flush=True)
+    
+    total = time.perf_counter() - start
+    print(f"\n\n⏱️  首 token: {ttft or 0:.2f}s, 总耗时: {total:.2f}s")
+
+def test_endpoint(prompt, image_path=None, stream=False):
     client = boto3.client('sagemaker-runtime', region_name=REGION)
     
     # 构建消息内容
@@ -61,6 +93,9 @@ def test_endpoint(prompt, image_path=None):
         print(f"🖼️  图片: {image_path}")
     print(f"\n📤 发送请求: {prompt}\n")
     
+    if stream:
+        return stream_endpoint(client, payload)
+    
     response = client.invoke_endpoint(
         EndpointName=ENDPOINT_NAME,
         ContentType='application/json',
@@ -87,4 +122,4 @@ def test_endpoint(prompt, image_path=None):
     return result
 
 if __name__ == "__main__":
-    test_endpoint(args.prompt, args.image)
+    test_endpoint(args.prompt, args.image, args.stream)
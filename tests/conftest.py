@@ -0,0 +1,43 @@
+"""Shared test setup: make code/ (container modules) and the repo root (host scripts) importable"""
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+SAMPLE_IMAGE = os.path.join(REPO_DIR, 'test', 'macos-desktop.jpg')
+
+sys.path.insert(0, os.path.join(REPO_DIR, 'code'))
+sys.path.insert(0, REPO_DIR)
+
+import socket  # noqa: E402
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def moto_url():
+    """A moto server shared by the session (subprocesses reach it through AWS_ENDPOINT_URL)"""
+    from moto.server import ThreadedMotoServer
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def aws(moto_url, monkeypatch):
+    """Point boto3 (in this process and in child processes) at a freshly reset moto server"""
+    import urllib.request
+
+    urllib.request.urlopen(urllib.request.Request(f"{moto_url}/moto-api/reset", method='POST')).close()
+    monkeypatch.setenv('AWS_ENDPOINT_URL', moto_url)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-west-2')
+    for name in ('AWS_PROFILE', 'AWS_SESSION_TOKEN'):
+        monkeypatch.delenv(name, raising=False)
+    return moto_url
@@ -0,0 +1,106 @@
+import json
+import time
+
+import boto3
+import pytest
+
+import check_logs
+
+ENDPOINT = ('ep', 'ep-20260101-000000', 'us-west-2')
+LOG_GROUP = '/aws/sagemaker/Endpoints/ep-20260101-000000'
+
+
+def test_parse_stats():
+    row = check_logs.parse_stats(
+        'INFO 01-01 00:00:00 [loggers.py:123] Engine 000: Avg prompt throughput: 812.3 tokens/s, '
+        'Avg generation throughput: 95.1 tokens/s, Running: 4 reqs, Waiting: 0 reqs, '
+        'GPU KV cache usage: 12.5%, Prefix cache hit rate: 41.0%')
+    assert row == {'kind': 'stats', 'prompt_tps': 812.3, 'generation_tps': 95.1, 'running': 4.0,
+                   'waiting': 0.0, 'kv_cache_pct': 12.5, 'prefix_cache_hit_pct': 41.0}
+    assert check_logs.parse_stats('[startup] phase: loading_weights (+12.5s)') == {
+        'kind': 'startup', 'phase': 'loading_weights', 'seconds': 12.5}
+    assert check_logs.parse_stats('Loading weights took 31.02 seconds') == {
+        'kind': 'startup', 'phase': 'load_weights', 'seconds': 31.02}
+    assert check_logs.parse_stats('Graph capturing finished in 9 secs, took 0.5 GiB') == {
+        'kind': 'startup', 'phase': 'cuda_graph_capture', 'seconds': 9.0}
+    assert check_logs.parse_stats('GET /ping HTTP/1.1 200') is None
+
+
+@pytest.fixture
+def logs(aws):
+    client = boto3.client('logs', region_name='us-west-2')
+    client.create_log_group(logGroupName=LOG_GROUP)
+    for stream in ('AllTraffic/i-1', 'AllTraffic/i-2'):
+        client.create_log_stream(logGroupName=LOG_GROUP, logStreamName=stream)
+    return client
+
+
+def put(client, stream, messages):
+    now = int(time.time() * 1000)
+    client.put_log_events(logGroupName=LOG_GROUP, logStreamName=stream,
+                          logEvents=[{'timestamp': now + i, 'message': m} for i, m in enumerate(messages)])
+
+
+def messages(events):
+    return sorted(e[3] for e in events)
+
+
+def test_cursor_resumes_where_the_last_run_stopped(logs, tmp_path):
+    cursor = str(tmp_path / '.log_cursor.json')
+    put(logs, 'AllTraffic/i-1', ['a1', 'a2'])
+    put(logs, 'AllTraffic/i-2', ['b1'])
+    assert messages(check_logs.LogFollower([ENDPOINT], cursor, 0, 4).poll()) == ['a1', 'a2', 'b1']
+    with open(cursor) as f:
+        assert len(json.load(f)) == 2
+
+    # 新的运行（新进程）从游标继续，只读取之后写入的日志
+    put(logs, 'AllTraffic/i-1', ['a3'])
+    follower = check_logs.LogFollower([ENDPOINT], cursor, 0, 4)
+    assert messages(follower.poll()) == ['a3']
+    assert follower.poll() == []
+    # 不使用游标时从头读取
+    assert len(check_logs.LogFollower([ENDPOINT], None, 0, 4).poll()) == 4
+
+
+def test_missing_log_group_has_no_events(aws):
+    assert check_logs.LogFollower([ENDPOINT], None, 0, 1).poll() == []
+
+
+class EmptyPages:
+    """Wraps a logs client so every stream starts with empty pages before the real events"""
+
+    def __init__(self, client, empty_pages):
+        self.client = client
+        self.empty_pages = empty_pages
+        self.tokens = {}
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def get_log_events(self, **request):
+        self.calls += 1
+        token = request.get('nextToken')
+        if token in self.tokens:
+            remaining, real_token = self.tokens.pop(token)
+        elif token is None:
+            remaining, real_token = self.empty_pages, None
+        else:
+            return self.client.get_log_events(**request)
+        if remaining:
+            fake = f"f/empty-{self.calls}"
+            self.tokens[fake] = (remaining - 1, real_token)
+            return {'events': [], 'nextForwardToken': fake, 'nextBackwardToken': 'b/0'}
+        request.pop('nextToken', None)
+        if real_token:
+            request['nextToken'] = real_token
+        return self.client.get_log_events(**request)
+
+
+def test_pagination_continues_past_empty_pages(logs):
+    put(logs, 'AllTraffic/i-1', ['late'])
+    follower = check_logs.LogFollower([ENDPOINT], None, 0, 1)
+    wrapper = EmptyPages(follower.clients['us-west-2'], empty_pages=2)
+    follower.clients['us-west-2'] = wrapper
+    assert messages(follower.poll()) == ['late']
+    assert wrapper.calls > 2
@@ -0,0 +1,58 @@
+from compaction import IMAGE_PLACEHOLDER, TRUNCATION_MARK, compact_history, estimate_tokens
+
+
+def image():
+    return {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}}
+
+
+def history():
+    return {"messages": [
+        {"role": "system", "content": "你是手机助手"},
+        {"role": "user", "content": [image(), {"type": "text", "text": "打开微信"}]},
+        {"role": "assistant", "content": "思考" * 300 + 'do(action="Tap")'},
+        {"role": "user", "content": [image(), {"type": "text", "text": "下一步"}]},
+        {"role": "assistant", "content": [{"type": "text", "text": "x" * 900}]},
+        {"role": "user", "content": [image(), {"type": "text", "text": None}]},
+        {"role": "assistant", "content": "最新回复"},
+    ]}
+
+
+def test_keeps_latest_images_and_truncates_older_turns():
+    data = history()
+    before, after = compact_history(data, max_images=1, assistant_tokens=10)
+    messages = data["messages"]
+    assert messages[1]["content"][0] == {"type": "text", "text": IMAGE_PLACEHOLDER}
+    assert messages[3]["content"][0] == {"type": "text", "text": IMAGE_PLACEHOLDER}
+    assert messages[5]["content"][0] == image()
+    # 截断保留结尾的动作指令，最新的助手回复不截断
+    assert messages[2]["content"].startswith(TRUNCATION_MARK)
+    assert messages[2]["content"].endswith('do(action="Tap")')
+    assert len(messages[4]["content"][0]["text"]) == 30 + len(TRUNCATION_MARK)
+    assert messages[6]["content"] == "最新回复"
+    assert after < before
+
+
+def test_disabled_steps_leave_request_unchanged():
+    data = history()
+    before, after = compact_history(data, max_images=0, assistant_tokens=0)
+    assert data == history()
+    assert before == after
+
+
+def test_null_and_non_string_text_parts():
+    data = {"messages": [
+        {"role": "user", "content": [{"type": "text", "text": None}, image()]},
+        {"role": "assistant", "content": [{"type": "text", "text": None}, {"type": "text", "text": 42},
+                                          {"type": "text"}, {"type": "text", "text": ["a"]}]},
+        {"role": "user", "content": [image(), {"type": "text", "text": "继续"}]},
+        {"role": "assistant", "content": None},
+    ]}
+    assert estimate_tokens(data["messages"], 1500) == 3000
+    before, after = compact_history(data, max_images=1, assistant_tokens=1)
+    assert (before, after) == (3000, 1500 + len(IMAGE_PLACEHOLDER) // 3)
+    # 非字符串文本保持原样
+    assert data["messages"][1]["content"][:2] == [{"type": "text", "text": None}, {"type": "text", "text": 42}]
+
+
+def test_not_a_chat_request():
+    assert compact_history({"prompt": "hi"}, max_images=1) == (0, 0)
@@ -0,0 +1,125 @@
+import json
+import os
+import subprocess
+
+import boto3
+import pytest
+
+import deploy_multi
+from conftest import REPO_DIR
+
+ACCOUNT = '123456789012'
+BASE = {'INSTANCE_TYPE': 'ml.g6e.xlarge', 'SERVED_MODEL_NAME': 'model', 'MAX_MODEL_LEN': '4096',
+        'DTYPE': 'auto', 'MODEL_TYPE': 'text'}
+
+
+def preset(model_id, region, **extra):
+    return {**BASE, 'MODEL_ID': model_id, 'AWS_REGION': region, **extra}
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """configs/, models/ and stage work dirs under tmp_path"""
+    configs = tmp_path / 'configs'
+    monkeypatch.setattr(deploy_multi, 'CONFIGS_DIR', str(configs))
+    monkeypatch.setattr(deploy_multi, 'MODELS_DIR', str(tmp_path / 'models'))
+    monkeypatch.setattr(deploy_multi, 'WORK_DIR', str(configs / '.work'))
+    return tmp_path
+
+
+def test_presets_sharing_a_model_transfer_it_once(workspace):
+    pipeline = deploy_multi.build_pipeline({
+        'a': preset('org/Model-A', 'us-west-2'),
+        'a-tokyo': preset('org/Model-A', 'ap-northeast-1'),
+        'a-again': preset('org/Model-A', 'us-west-2', MAX_MODEL_LEN='8192'),
+        'b': preset('org/Model-B', 'us-west-2'),
+    }, ACCOUNT, 'local')
+    stages = pipeline.stages
+    assert [name for name in stages if name.split(':')[0] in ('download', 'upload', 'copy')] == [
+        'download:model-a', 'upload:model-a@us-west-2', 'copy:model-a@ap-northeast-1',
+        'download:model-b', 'upload:model-b@us-west-2']
+    assert stages['deploy:a'].deps == ['upload:model-a@us-west-2', 'image@us-west-2']
+    assert stages['deploy:a-again'].deps == ['upload:model-a@us-west-2', 'image@us-west-2']
+    assert stages['deploy:a-tokyo'].deps == ['copy:model-a@ap-northeast-1', 'image@ap-northeast-1']
+
+
+def test_conflicting_download_filters_are_rejected(workspace):
+    with pytest.raises(SystemExit, match='DOWNLOAD_INCLUDE'):
+        deploy_multi.build_pipeline({
+            'a': preset('org/Model-A', 'us-west-2'),
+            'a-bin': preset('org/Model-A', 'us-east-1', DOWNLOAD_EXCLUDE='*.bin'),
+        }, ACCOUNT, 'local')
+
+
+def test_shell_script_reads_optional_env_keys_from_3_deploy():
+    script = subprocess.run(['sed', '-n', '/^OPTIONAL_ENV_KEYS=/,/^fi$/p', 'deploy_multi.sh'],
+                            cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout
+    keys = subprocess.run(['bash', '-c', f'{script}\necho "$OPTIONAL_ENV_KEYS"'],
+                          cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.split()
+    assert keys == deploy_multi.deploy.OPTIONAL_ENV_KEYS
+
+
+def test_pipeline_skips_dependents_of_failed_stages():
+    order = []
+    pipeline = deploy_multi.Pipeline()
+
+    def fail(stage):
+        raise RuntimeError('boom')
+    first = pipeline.add('first', order.append)
+    broken = pipeline.add('broken', fail, [first])
+    pipeline.add('after-first', order.append, [first])
+    pipeline.add('after-broken', order.append, [broken])
+    assert pipeline.run(jobs=4) is False
+    assert order == ['first', 'after-first']
+    assert pipeline.stages['broken'].error == 'boom'
+    assert pipeline.stages['after-broken'].state == 'skipped'
+
+
+def write_model(model_dir, files):
+    os.makedirs(model_dir, exist_ok=True)
+    for name, content in files.items():
+        with open(os.path.join(model_dir, name), 'wb') as f:
+            f.write(content)
+
+
+def run_transfer(presets, capsys):
+    """Run the pipeline for real (upload subprocess + server-side copy), recording image/deploy stages"""
+    pipeline = deploy_multi.build_pipeline(presets, ACCOUNT, 'local')
+    deployed = []
+    for stage in pipeline.stages.values():
+        if stage.name.startswith(('image@', 'deploy:')):
+            stage.fn = deployed.append
+    assert pipeline.run(jobs=4), {s.name: s.error for s in pipeline.stages.values()}
+    return deployed, capsys.readouterr().out
+
+
+def objects(client, bucket):
+    return {o['Key']: o['Size'] for o in client.list_objects_v2(Bucket=bucket).get('Contents', [])}
+
+
+def test_end_to_end_upload_once_and_copy_only_changed_files(workspace, aws, capsys):
+    presets = {'a': preset('org/Model-A', 'us-west-2'), 'a-east': preset('org/Model-A', 'us-east-1')}
+    model_dir = os.path.join(deploy_multi.MODELS_DIR, 'a')
+    write_model(model_dir, {'config.json': b'{}', 'model.safetensors': b'w' * 4096})
+    # 下载已完成：download 任务跳过，不访问 HuggingFace
+    os.makedirs(deploy_multi.CONFIGS_DIR, exist_ok=True)
+    with open(os.path.join(deploy_multi.CONFIGS_DIR, 'a.download.json'), 'w') as f:
+        json.dump({'status': 'completed'}, f)
+
+    deployed, out = run_transfer(presets, capsys)
+    assert sorted(deployed) == ['deploy:a', 'deploy:a-east', 'image@us-east-1', 'image@us-west-2']
+    assert '模型已存在，跳过下载' in out
+    assert '0 个文件未变化，复制 2 个文件' in out
+    west, east = boto3.client('s3', region_name='us-west-2'), boto3.client('s3', region_name='us-east-1')
+    expected = {'models/model-a/config.json': 2, 'models/model-a/model.safetensors': 4096}
+    assert objects(west, f'sagemaker-us-west-2-{ACCOUNT}').items() >= expected.items()
+    assert objects(east, f'sagemaker-us-east-1-{ACCOUNT}').items() >= expected.items()
+    assert 'models/model-a/.upload_manifest.json' in objects(east, f'sagemaker-us-east-1-{ACCOUNT}')
+
+    # 只改动一个文件：上传和跨区域复制都只处理该文件
+    write_model(model_dir, {'config.json': b'{"v": 2}'})
+    _, out = run_transfer(presets, capsys)
+    assert '1 个文件未变化，1 个文件需要上传' in out
+    assert '1 个文件未变化，复制 1 个文件' in out
+    body = east.get_object(Bucket=f'sagemaker-us-east-1-{ACCOUNT}', Key='models/model-a/config.json')['Body']
+    assert body.read() == b'{"v": 2}'
@@ -0,0 +1,61 @@
+import io
+
+from PIL import Image
+
+from conftest import SAMPLE_IMAGE
+from image_policy import ImagePolicy, estimate_image_tokens
+
+VLLM_MAX_PIXELS = 5000000
+
+
+def sample():
+    with open(SAMPLE_IMAGE, 'rb') as f:
+        return f.read()
+
+
+def test_estimate_image_tokens():
+    # 28x28 像素一个 token，向上取整
+    assert estimate_image_tokens(28, 28) == 1
+    assert estimate_image_tokens(29, 28) == 2
+    assert estimate_image_tokens(2940, 1912) == 105 * 69
+    # 超过 vLLM max_pixels 时先按其缩放再估算
+    assert estimate_image_tokens(2940, 1912, VLLM_MAX_PIXELS) == 99 * 65
+
+
+def test_downscale_sample_screenshot():
+    raw = sample()
+    policy = ImagePolicy(max_edge=1920, quality=90, vllm_max_pixels=VLLM_MAX_PIXELS)
+    out, ext, info = policy.apply(raw, 'jpeg')
+    assert ext == 'jpeg'
+    assert info == {'tokens_before': 6435, 'tokens_after': 3105}
+    assert Image.open(io.BytesIO(out)).size == (1919, 1248)
+    assert len(out) < len(raw)
+
+
+def test_pixel_budget_and_webp():
+    policy = ImagePolicy(max_pixels=1920 * 1080, fmt='webp', vllm_max_pixels=VLLM_MAX_PIXELS)
+    out, ext, info = policy.apply(sample(), 'jpeg')
+    width, height = Image.open(io.BytesIO(out)).size
+    assert ext == 'webp'
+    assert width * height <= 1920 * 1080
+    assert info['tokens_after'] < info['tokens_before']
+
+
+def test_within_budget_passes_through():
+    raw = sample()
+    for policy in (ImagePolicy(max_edge=4096), ImagePolicy()):
+        out, ext, info = policy.apply(raw, 'jpg')
+        assert out is raw
+        assert ext == 'jpg'
+        assert info['tokens_before'] == info['tokens_after']
+
+
+def test_corrupt_images_pass_through():
+    policy = ImagePolicy(max_edge=512)
+    raw = sample()
+    # 头部完整、数据截断：Image.open 成功，解码在 convert/resize 时才失败
+    for broken in (raw[:len(raw) // 4], b'not an image', raw[:200]):
+        out, ext, info = policy.apply(broken, 'jpeg')
+        assert out is broken
+        assert ext == 'jpeg'
+        assert info is None
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+from admission import Rejected
+from replicas import Replica, ReplicaPool
+from supervisor import StartupError
+
+
+def pool(count, **kwargs):
+    return ReplicaPool([Replica(i, f"http://127.0.0.1:{8000 + i}", client=None) for i in range(count)], **kwargs)
+
+
+def test_least_outstanding_replica_is_picked():
+    p = pool(3)
+    p.replicas[0].outstanding = 5
+    p.replicas[1].outstanding = 1
+    p.replicas[2].outstanding = 3
+    assert p.acquire() is p.replicas[1]
+    assert p.replicas[1].outstanding == 2
+    p.release(p.replicas[1])
+    assert p.replicas[1].outstanding == 1
+
+
+def test_equal_load_rotates():
+    p = pool(3)
+    assert {p.pick().index for _ in range(3)} == {0, 1, 2}
+
+
+def test_unhealthy_replicas_are_skipped():
+    p = pool(2)
+    p.replicas[0].healthy = False
+    assert {p.pick().index for _ in range(4)} == {1}
+    p.replicas[1].healthy = False
+    with pytest.raises(Rejected) as e:
+        p.acquire()
+    assert e.value.status_code == 503
+
+
+def test_session_affinity_is_stable_and_spills_when_saturated():
+    p = pool(4, affinity_slack=2)
+    preferred = {session: p.pick(session) for session in (f"s{i}" for i in range(32))}
+    # 同一会话总是路由到同一副本，不同会话分散到各副本
+    assert all(p.pick(session) is replica for session, replica in preferred.items())
+    assert len({r.index for r in preferred.values()}) > 1
+
+    replica = preferred["s0"]
+    replica.outstanding = 2
+    assert p.pick("s0") is replica
+    replica.outstanding = 3
+    spilled = p.pick("s0")
+    assert spilled is not replica and spilled.outstanding == 0
+    assert p.affinity_spills == 1
+
+
+class FakeProcess:
+    def __init__(self):
+        self.returncode = None
+        self.exited = asyncio.Event()
+
+    async def wait(self):
+        await self.exited.wait()
+        return self.returncode
+
+    def exit(self, code):
+        self.returncode = code
+        self.exited.set()
+
+
+class FakeSupervisor:
+    """Stands in for StartupSupervisor; ``failures`` restarts fail before one succeeds"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.starts = 0
+        self.stops = 0
+        self.process = None
+        self.started = asyncio.Event()
+
+    async def start(self):
+        self.starts += 1
+        self.process = FakeProcess()
+        if self.starts > 1 and self.failures:
+            self.failures -= 1
+            raise StartupError("vLLM exited with code 1 during startup")
+        self.started.set()
+
+    async def stop(self, grace=30.0):
+        self.stops += 1
+
+    def status(self):
+        return {"state": "ready"}
+
+
+def test_dead_replica_is_restarted_with_backoff(monkeypatch):
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+
+    async def run():
+        supervisor = FakeSupervisor(failures=2)
+        replica = Replica(0, "http://127.0.0.1:8000", client=None, supervisor=supervisor)
+        p = ReplicaPool([replica], restart_delay=1, max_restart_delay=8)
+        await p.start()
+        assert replica.healthy and p.ready
+        supervisor.started.clear()
+        supervisor.process.exit(137)
+        await asyncio.wait_for(supervisor.started.wait(), 5)
+        for watcher in p._watchers:
+            watcher.cancel()
+        return supervisor, replica
+
+    supervisor, replica = asyncio.run(run())
+    # 两次重启失败后成功：延迟 1 → 2 → 4 秒，失败的启动被停止
+    assert delays == [1, 2, 4]
+    assert supervisor.starts == 4
+    assert supervisor.stops == 2
+    assert replica.restarts == 3
+    assert replica.healthy
+
+
+def test_replica_is_unhealthy_while_restarting():
+    async def run():
+        supervisor = FakeSupervisor()
+        replica = Replica(0, "http://127.0.0.1:8000", client=None, supervisor=supervisor)
+        p = ReplicaPool([replica], restart_delay=30)
+        await p.start()
+        supervisor.process.exit(1)
+        await asyncio.sleep(0.01)
+        healthy = replica.healthy
+        for watcher in p._watchers:
+            watcher.cancel()
+        return healthy, p
+    healthy, p = asyncio.run(run())
+    assert healthy is False
+    assert p.pick() is None
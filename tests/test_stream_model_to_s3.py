@@ -0,0 +1,175 @@
+"""stream_model_to_s3: resumable multipart copies from a stand-in hub into moto"""
+import base64
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import boto3
+import httpx
+import pytest
+
+import stream_model_to_s3 as stream
+
+BUCKET = 'sagemaker-us-west-2-123456789012'
+REL_PATH = 'model-00001-of-00001.safetensors'
+PART_SIZE = 5 * 1024**2  # S3 的最小分片
+DATA = bytes(range(256)) * (PART_SIZE * 2 // 256) + b'tail' * 1000
+SHA256 = hashlib.sha256(DATA).hexdigest()
+REPO = SimpleNamespace(sha='0123abcd')
+
+
+class FakeHub:
+    """Session stand-in serving DATA with HTTP Range, optionally failing some parts"""
+
+    def __init__(self, fail_starts=(), truncate_once=()):
+        self.fail_starts = set(fail_starts)
+        self.truncate_once = set(truncate_once)
+        self.ranges = []
+
+    def get(self, url, headers, follow_redirects, timeout):
+        assert url.endswith(f"/{REPO.sha}/{REL_PATH}")
+        start, end = (int(v) for v in headers['Range'].removeprefix('bytes=').split('-'))
+        self.ranges.append((start, end))
+        request = httpx.Request('GET', url)
+        if start in self.fail_starts:
+            return httpx.Response(404, request=request)
+        data = DATA[start:end + 1]
+        if start in self.truncate_once:
+            self.truncate_once.discard(start)
+            data = data[:-1]
+        return httpx.Response(206, content=data, request=request)
+
+
+class RecordingS3:
+    """boto3 client wrapper that records the parts it uploads"""
+
+    def __init__(self, client):
+        self._client = client
+        self.parts = []
+        self.completed = None
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def upload_part(self, **kwargs):
+        self.parts.append((kwargs['PartNumber'], kwargs['ChecksumSHA256'], hashlib.sha256(kwargs['Body']).digest()))
+        return self._client.upload_part(**kwargs)
+
+    def complete_multipart_upload(self, **kwargs):
+        self.completed = kwargs['MultipartUpload']['Parts']
+        return self._client.complete_multipart_upload(**kwargs)
+
+
+@pytest.fixture
+def s3(aws, monkeypatch):
+    monkeypatch.setattr(stream, 'PART_SIZE', PART_SIZE)
+    client = boto3.client('s3', region_name='us-west-2')
+    client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+    return RecordingS3(client)
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    return str(tmp_path / 'stream_transfer_state.json')
+
+
+def copy(s3, hub, state_path):
+    state = stream.TransferState(state_path, BUCKET)
+    progress = stream.upload.Progress(len(DATA), 1)
+    with ThreadPoolExecutor(max_workers=1) as part_pool:
+        stream.stream_multipart(s3, hub, BUCKET, REPO, REL_PATH, len(DATA), SHA256, state, progress, part_pool)
+
+
+def interrupted_copy(s3, state_path):
+    """Copy parts 1 and 2, then fail on part 3"""
+    with pytest.raises(httpx.HTTPStatusError):
+        copy(s3, FakeHub(fail_starts={2 * PART_SIZE}), state_path)
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def uploaded_object(s3):
+    return s3.get_object(Bucket=BUCKET, Key=f"{stream.S3_PREFIX}/{REL_PATH}")['Body'].read()
+
+
+def test_part_ranges(monkeypatch):
+    monkeypatch.setattr(stream, 'PART_SIZE', 4)
+    assert stream.part_ranges(10) == [(1, 0, 3), (2, 4, 7), (3, 8, 9)]
+    assert stream.part_ranges(8) == [(1, 0, 3), (2, 4, 7)]
+
+
+def test_copy_sends_part_checksums(s3, state_path):
+    copy(s3, FakeHub(), state_path)
+
+    assert uploaded_object(s3) == DATA
+    assert [number for number, _, _ in s3.parts] == [1, 2, 3]
+    for _, checksum, digest in s3.parts:
+        assert base64.b64decode(checksum) == digest
+    assert [p['ChecksumSHA256'] for p in s3.completed] == [checksum for _, checksum, _ in s3.parts]
+    with open(state_path) as f:
+        assert json.load(f)['uploads'] == {}
+
+
+def test_resume_uploads_only_missing_parts(s3, state_path):
+    saved = interrupted_copy(s3, state_path)
+    entry = saved['uploads'][REL_PATH]
+    assert entry['sha256'] == SHA256 and sorted(entry['parts']) == ['1', '2']
+
+    hub = FakeHub()
+    s3.parts.clear()
+    copy(s3, hub, state_path)
+
+    assert hub.ranges == [(2 * PART_SIZE, len(DATA) - 1)]
+    assert [number for number, _, _ in s3.parts] == [3]
+    assert [p['ChecksumSHA256'] for p in s3.completed[:2]] == [entry['parts']['1'], entry['parts']['2']]
+    assert uploaded_object(s3) == DATA
+
+
+def test_resume_reuploads_parts_without_a_known_checksum(s3, state_path):
+    saved = interrupted_copy(s3, state_path)
+    # S3 仍有分片 1，但本地没有它的校验和（例如写状态前被中断）：不能信任，重新上传
+    del saved['uploads'][REL_PATH]['parts']['1']
+    with open(state_path, 'w') as f:
+        json.dump(saved, f)
+
+    hub = FakeHub()
+    copy(s3, hub, state_path)
+
+    assert [start for start, _ in hub.ranges] == [0, 2 * PART_SIZE]
+    assert uploaded_object(s3) == DATA
+
+
+@pytest.mark.parametrize('change', ['sha256', 'part_size', 'upload_id'])
+def test_resume_starts_over_when_the_saved_upload_does_not_match(s3, state_path, change):
+    saved = interrupted_copy(s3, state_path)
+    entry = saved['uploads'][REL_PATH]
+    if change == 'upload_id':
+        # 分段上传已被 S3 清理（生命周期规则或 abort）
+        s3.abort_multipart_upload(Bucket=BUCKET, Key=f"{stream.S3_PREFIX}/{REL_PATH}", UploadId=entry['upload_id'])
+    else:
+        entry[change] = 'other' if change == 'sha256' else PART_SIZE * 2
+        with open(state_path, 'w') as f:
+            json.dump(saved, f)
+
+    hub = FakeHub()
+    copy(s3, hub, state_path)
+
+    assert len(hub.ranges) == 3
+    assert uploaded_object(s3) == DATA
+
+
+def test_state_from_another_bucket_is_ignored(state_path):
+    with open(state_path, 'w') as f:
+        json.dump({'bucket': 'other', 'prefix': stream.S3_PREFIX,
+                   'uploads': {REL_PATH: {'upload_id': 'x', 'sha256': SHA256, 'part_size': stream.PART_SIZE,
+                                          'parts': {'1': 'c'}}}}, f)
+    assert stream.TransferState(state_path, BUCKET).get(REL_PATH, SHA256) == (None, {})
+    assert stream.TransferState(state_path, 'other').get(REL_PATH, SHA256) == ('x', {1: 'c'})
+
+
+def test_fetch_range_retries_truncated_bodies(monkeypatch):
+    monkeypatch.setattr(stream.time, 'sleep', lambda seconds: None)
+    hub = FakeHub(truncate_once={0})
+    assert stream.fetch_range(hub, f"https://hub/{REPO.sha}/{REL_PATH}", 0, 99) == DATA[:100]
+    assert hub.ranges == [(0, 99), (0, 99)]
@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+
+import model
+
+
+class FakeReplica:
+    def __init__(self, handler):
+        self.client = httpx.AsyncClient(base_url="http://vllm", transport=httpx.MockTransport(handler))
+
+
+class FakePool:
+    def __init__(self, handler):
+        self.replica = FakeReplica(handler)
+        self.outstanding = 0
+
+    def acquire(self, session=None):
+        self.outstanding += 1
+        return self.replica
+
+    def release(self, replica):
+        self.outstanding -= 1
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Point the proxy at an httpx MockTransport handler instead of vLLM"""
+    pools = []
+
+    def install(handler):
+        pool = FakePool(handler)
+        pools.append(pool)
+
+        async def upstream_pool(prepared):
+            return pool
+        monkeypatch.setattr(model, "upstream_pool", upstream_pool)
+        return pool
+    return install
+
+
+def invoke(body: bytes):
+    async def run():
+        transport = httpx.ASGITransport(app=model.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+            resp = await client.post("/invocations", content=body, headers={"content-type": "application/json"})
+            return resp.status_code, resp.content
+    return asyncio.run(run())
+
+
+def stream_count(status="200"):
+    return model.requests_total.values.get(("stream", status), 0)
+
+
+STREAM_REQUEST = b'{"messages": [{"role": "user", "content": "hi"}], "stream": true}'
+
+
+def sse_response(*chunks):
+    async def body():
+        for chunk in chunks:
+            yield chunk
+    return httpx.Response(200, content=body(), headers={"content-type": "text/event-stream"})
+
+
+def test_stream_relays_chunks_and_is_counted_once(upstream):
+    pool = upstream(lambda request: sse_response(b'data: {"choices": []}\n\n', b"data: [DONE]\n\n"))
+    inflight, counted = model.requests_inflight.value, stream_count()
+    status, content = invoke(STREAM_REQUEST)
+    assert status == 200
+    assert content.endswith(b"data: [DONE]\n\n")
+    assert stream_count() == counted + 1
+    assert model.requests_inflight.value == inflight
+    assert pool.outstanding == 0
+
+
+def test_empty_upstream_stream_is_counted(upstream):
+    pool = upstream(lambda request: sse_response())
+    inflight, counted = model.requests_inflight.value, stream_count()
+    status, content = invoke(STREAM_REQUEST)
+    assert (status, content) == (200, b"")
+    assert stream_count() == counted + 1
+    assert model.requests_inflight.value == inflight
+    assert pool.outstanding == 0
+
+
+def test_upstream_error_before_first_chunk(upstream):
+    def fail(request):
+        raise httpx.ConnectError("refused")
+    upstream(fail)
+    errors = model.upstream_errors.values.get(("transport",), 0)
+    inflight = model.requests_inflight.value
+    status, _ = invoke(STREAM_REQUEST)
+    assert status == 502
+    assert model.upstream_errors.values.get(("transport",), 0) == errors + 1
+    assert model.requests_inflight.value == inflight
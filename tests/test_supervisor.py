@@ -0,0 +1,105 @@
+import asyncio
+import json
+import socket
+import sys
+import time
+
+import pytest
+
+from supervisor import PHASE_PATTERNS, StartupError, StartupSupervisor
+
+# 代替 vLLM 的子进程：按顺序输出阶段日志，然后在指定端口提供 /health
+HEALTHY_CHILD = """
+import sys, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+for line in ["INFO Starting to load model /opt/ml/model", "INFO Model loading took 1.2 GiB and 0.1 seconds",
+             "INFO Capturing CUDA graphs (mixed prefill-decode)", "INFO Starting vLLM API server on port"]:
+    print(line, flush=True)
+    time.sleep(0.05)
+class Health(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200 if self.path == "/health" else 404)
+        self.end_headers()
+    def log_message(self, *args):
+        pass
+HTTPServer(("127.0.0.1", int(sys.argv[1])), Health).serve_forever()
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def supervisor(code, *args, port=None, **kwargs):
+    port = port or free_port()
+    return StartupSupervisor([sys.executable, '-c', code, *map(str, args)],
+                             health_url=f"http://127.0.0.1:{port}/health", poll_interval=0.05,
+                             max_poll_interval=0.2, **kwargs)
+
+
+def test_crash_fails_fast(tmp_path):
+    sup = supervisor("import sys; print('INFO Loading weights', flush=True); sys.exit(3)",
+                     timeout=60, timeline_path=str(tmp_path / 'timeline.json'))
+    started = time.monotonic()
+    with pytest.raises(StartupError, match='code 3'):
+        asyncio.run(sup.start())
+    # 子进程退出后立即失败，不等待健康检查超时
+    assert time.monotonic() - started < 10
+    assert sup.state == 'failed'
+    with open(tmp_path / 'timeline.json') as f:
+        timeline = json.load(f)
+    assert timeline['state'] == 'failed'
+    assert 'code 3' in timeline['error']
+
+
+def test_phases_are_detected_and_written_to_the_timeline(tmp_path):
+    port = free_port()
+    warmed = []
+
+    async def warmup():
+        warmed.append(True)
+
+    sup = supervisor(HEALTHY_CHILD, port, port=port, timeout=30,
+                     timeline_path=str(tmp_path / 'timeline.json'), warmup=warmup)
+
+    async def run():
+        try:
+            await sup.start()
+        finally:
+            await sup.stop(grace=5)
+    asyncio.run(run())
+
+    assert sup.ready
+    assert warmed == [True]
+    with open(tmp_path / 'timeline.json') as f:
+        timeline = json.load(f)
+    assert timeline['state'] == 'ready'
+    assert [p['name'] for p in timeline['phases']] == (
+        ['process_start'] + [name for name, _ in PHASE_PATTERNS] + ['warmup', 'ready'])
+    offsets = [p['offset_s'] for p in timeline['phases']]
+    assert offsets == sorted(offsets)
+
+
+def test_phase_patterns_only_move_forward():
+    sup = StartupSupervisor(['true'])
+    sup.started_at = time.monotonic()
+    sup._match_phase('Capturing CUDA graphs')
+    sup._match_phase('Loading weights')  # 已经过的阶段不会回退
+    assert [p['name'] for p in sup.phases] == ['cuda_graph_capture']
+
+
+def test_never_healthy_times_out():
+    sup = supervisor("import time; time.sleep(60)", timeout=1)
+
+    async def run():
+        try:
+            await sup.start()
+        finally:
+            await sup.stop(grace=1)
+    started = time.monotonic()
+    with pytest.raises(StartupError, match='not healthy'):
+        asyncio.run(run())
+    assert 1 <= time.monotonic() - started < 10
+    assert sup.process.returncode is not None
@@ -0,0 +1,106 @@
+"""2_upload_model: hash cache, upload plan and an incremental upload against moto"""
+import importlib
+import os
+
+import boto3
+import pytest
+
+upload = importlib.import_module('2_upload_model')
+
+BUCKET = 'sagemaker-us-west-2-123456789012'
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    path = tmp_path / 'model'
+    (path / '.cache').mkdir(parents=True)
+    (path / '.cache' / 'meta').write_text('skip')
+    (path / 'config.json').write_text('{"a": 1}')
+    (path / 'model.safetensors').write_bytes(b'w' * 4096)
+    return str(path)
+
+
+def rewrite(path, text):
+    """Change a file's content but not its size, with an mtime the hash cache cannot mistake for the old one"""
+    stat = os.stat(path)
+    with open(path, 'w') as f:
+        f.write(text)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def manifest_of(model_dir):
+    return upload.build_manifest(model_dir, upload.collect_files(model_dir))
+
+
+def test_collect_files_skips_cache_and_manifest(model_dir):
+    manifest_of(model_dir)
+    assert sorted(upload.collect_files(model_dir)) == ['config.json', 'model.safetensors']
+
+
+def test_build_manifest_reuses_cached_hashes(model_dir, monkeypatch):
+    first = manifest_of(model_dir)
+    assert first['files']['config.json']['sha256'] == upload.sha256_file(os.path.join(model_dir, 'config.json'))
+
+    hashed = []
+    sha256_file = upload.sha256_file
+    monkeypatch.setattr(upload, 'sha256_file', lambda path: hashed.append(path) or sha256_file(path))
+    assert manifest_of(model_dir) == first
+    assert hashed == []
+
+    rewrite(os.path.join(model_dir, 'config.json'), '{"a": 2}')
+    second = manifest_of(model_dir)
+    assert hashed == [os.path.join(model_dir, 'config.json')]
+    assert second['files']['config.json']['sha256'] != first['files']['config.json']['sha256']
+    assert second['files']['model.safetensors'] == first['files']['model.safetensors']
+
+
+def test_plan_upload_skips_unchanged_hashes():
+    manifest = {'files': {
+        'same.bin': {'size': 10, 'sha256': 'aa'},
+        'edited.bin': {'size': 10, 'sha256': 'bb'},
+        'resized.bin': {'size': 12, 'sha256': 'cc'},
+        'new.bin': {'size': 5, 'sha256': 'dd'},
+    }}
+    remote_manifest = {'files': {
+        'same.bin': {'size': 10, 'sha256': 'aa'},
+        'edited.bin': {'size': 10, 'sha256': 'b0'},
+        'resized.bin': {'size': 10, 'sha256': 'cc'},
+    }}
+    remote_sizes = {'same.bin': 10, 'edited.bin': 10, 'resized.bin': 10, 'old.bin': 3, upload.MANIFEST_NAME: 100}
+
+    changed, stale = upload.plan_upload(manifest, remote_manifest, remote_sizes)
+    assert sorted(changed) == ['edited.bin', 'new.bin', 'resized.bin']
+    assert stale == ['old.bin']
+
+
+def test_plan_upload_without_remote_manifest_compares_sizes():
+    manifest = {'files': {'same.bin': {'size': 10, 'sha256': 'aa'}, 'resized.bin': {'size': 12, 'sha256': 'bb'}}}
+    changed, stale = upload.plan_upload(manifest, None, {'same.bin': 10, 'resized.bin': 10})
+    assert changed == ['resized.bin']
+    assert stale == []
+
+
+def test_incremental_upload_to_s3(aws, model_dir, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(upload, 'LOCAL_MODEL_DIR', model_dir)
+    s3 = boto3.client('s3', region_name='us-west-2')
+
+    def run():
+        upload.main()
+        manifest = upload.build_manifest(model_dir, upload.collect_files(model_dir))
+        return upload.plan_upload(manifest, upload.load_remote_manifest(s3, BUCKET),
+                                  upload.list_remote_sizes(s3, BUCKET))
+
+    assert run() == ([], [])
+    assert sorted(upload.list_remote_sizes(s3, BUCKET)) == ['.upload_manifest.json', 'config.json', 'model.safetensors']
+
+    rewrite(os.path.join(model_dir, 'config.json'), '{"a": 2}')
+    put = []
+    upload_files = upload.upload_files
+    monkeypatch.setattr(upload, 'upload_files',
+                        lambda client, bucket, changed, manifest: put.extend(changed) or
+                        upload_files(client, bucket, changed, manifest))
+    assert run() == ([], [])
+    assert put == ['config.json']
+    body = s3.get_object(Bucket=BUCKET, Key=f"{upload.S3_PREFIX}/config.json")['Body'].read()
+    assert body == b'{"a": 2}'